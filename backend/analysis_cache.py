@@ -0,0 +1,230 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import bindparam, func
+from models import AnalysisCache
+from database import get_db_session
+from config import config
+import hashlib
+import json
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每寫入幾筆檢查一次是否超過容量，避免每次都 COUNT
+EVICTION_CHECK_INTERVAL = 100
+# 批次讀寫時每個 IN 查詢最多帶幾個 key，避免超過 SQLite 的參數上限
+KEY_CHUNK_SIZE = 500
+# 記憶體中累積多少個命中的 key 就寫回一次
+HIT_FLUSH_INTERVAL = 100
+
+
+class AnalysisResultCache:
+    """存在資料庫中的 OpenAI 分析結果快取（TTL + LRU）"""
+
+    def __init__(self, ttl_seconds: int = None, max_entries: int = None):
+        self.ttl_seconds = ttl_seconds or config.ANALYSIS_CACHE_TTL_SECONDS
+        self.max_entries = max_entries or config.ANALYSIS_CACHE_MAX_ENTRIES
+
+        self._lock = threading.Lock()
+        self._puts_since_eviction = 0
+        self._pending_hits = {}  # cache_key -> (命中次數, 最後存取時間)
+        self._counters = {"hits": 0, "misses": 0, "bypasses": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(model: str, prompt_version: str, subject: str, body: str) -> str:
+        payload = json.dumps([model, prompt_version, subject, body], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def record_bypass(self, amount: int = 1):
+        self._count("bypasses", amount)
+
+    def get(self, cache_key: str) -> Optional[Dict]:
+        """取得快取結果，過期或不存在時回傳 None"""
+        return self.get_many([cache_key]).get(cache_key)
+
+    def get_many(self, cache_keys: List[str]) -> Dict[str, Dict]:
+        """一次查詢多個 key，回傳 {cache_key: 結果}，只包含命中且未過期的項目
+
+        只讀取不寫入：命中次數與存取時間先記在記憶體，由 flush_hits 批次寫回；
+        過期的項目視為未命中，留給 evict 刪除
+        """
+        keys = list(dict.fromkeys(cache_keys))
+        if not keys:
+            return {}
+
+        db = get_db_session()
+        try:
+            expired_before = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+            results = {}
+            for start in range(0, len(keys), KEY_CHUNK_SIZE):
+                rows = db.query(AnalysisCache.cache_key, AnalysisCache.result).filter(
+                    AnalysisCache.cache_key.in_(keys[start : start + KEY_CHUNK_SIZE]),
+                    AnalysisCache.created_at >= expired_before,
+                )
+                results.update((cache_key, json.loads(result)) for cache_key, result in rows)
+
+        except Exception as e:
+            logger.error(f"Failed to read analysis cache: {e}")
+            self._count("misses", len(keys))
+            return {}
+        finally:
+            db.close()
+
+        self._count("hits", len(results))
+        self._count("misses", len(keys) - len(results))
+        self._record_hits(results)
+        return results
+
+    def _record_hits(self, cache_keys):
+        now = datetime.utcnow()
+        with self._lock:
+            for cache_key in cache_keys:
+                hits, _ = self._pending_hits.get(cache_key, (0, now))
+                self._pending_hits[cache_key] = (hits + 1, now)
+            should_flush = len(self._pending_hits) >= HIT_FLUSH_INTERVAL
+        if should_flush:
+            self.flush_hits()
+
+    def flush_hits(self, db=None):
+        """把記憶體中累積的命中次數與最後存取時間寫回資料庫（傳入 db 時由呼叫端 commit）"""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        if not pending:
+            return
+
+        own_session = db is None
+        db = db or get_db_session()
+        table = AnalysisCache.__table__
+        try:
+            db.execute(
+                table.update()
+                .where(table.c.cache_key == bindparam("hit_key"))
+                .values(
+                    hit_count=func.coalesce(table.c.hit_count, 0) + bindparam("hits"),
+                    last_accessed_at=bindparam("accessed_at"),
+                ),
+                [
+                    {"hit_key": cache_key, "hits": hits, "accessed_at": accessed_at}
+                    for cache_key, (hits, accessed_at) in pending.items()
+                ],
+            )
+            if own_session:
+                db.commit()
+
+        except Exception as e:
+            if not own_session:
+                raise
+            # 只是統計與 LRU 順序，失敗時捨棄即可
+            db.rollback()
+            logger.error(f"Failed to flush analysis cache hits: {e}")
+        finally:
+            if own_session:
+                db.close()
+
+    def put(self, cache_key: str, kind: str, model: str, result: Dict):
+        """寫入（或覆蓋）快取結果"""
+        self.put_many([(cache_key, kind, model, result)])
+
+    def put_many(self, entries: List[Tuple[str, str, str, Dict]]):
+        """在同一個 transaction 寫入多筆 (cache_key, kind, model, 結果)"""
+        # 同一批內重複的 key 以最後一筆為準
+        entries = {entry[0]: entry for entry in entries}
+        if not entries:
+            return
+
+        db = get_db_session()
+        try:
+            now = datetime.utcnow()
+            keys = list(entries)
+            existing = {}
+            for start in range(0, len(keys), KEY_CHUNK_SIZE):
+                existing.update(
+                    (entry.cache_key, entry)
+                    for entry in db.query(AnalysisCache).filter(
+                        AnalysisCache.cache_key.in_(keys[start : start + KEY_CHUNK_SIZE])
+                    )
+                )
+
+            for cache_key, kind, model, result in entries.values():
+                entry = existing.get(cache_key)
+                if not entry:
+                    entry = AnalysisCache(cache_key=cache_key, hit_count=0)
+                    db.add(entry)
+
+                entry.kind = kind
+                entry.model = model
+                entry.result = json.dumps(result, ensure_ascii=False)
+                entry.created_at = now
+                entry.last_accessed_at = now
+            self.flush_hits(db)
+            db.commit()
+            self._count("stores", len(entries))
+
+            with self._lock:
+                self._puts_since_eviction += len(entries)
+                should_evict = self._puts_since_eviction >= EVICTION_CHECK_INTERVAL
+                if should_evict:
+                    self._puts_since_eviction = 0
+            if should_evict:
+                self.evict(db)
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to write analysis cache: {e}")
+        finally:
+            db.close()
+
+    def evict(self, db=None):
+        """刪除過期項目，並在超過容量時淘汰最久沒使用的項目"""
+        own_session = db is None
+        db = db or get_db_session()
+        try:
+            # 先寫回累積的存取時間，LRU 才會依照實際使用順序淘汰
+            self.flush_hits(db)
+            expired_before = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+            removed = (
+                db.query(AnalysisCache)
+                .filter(AnalysisCache.created_at < expired_before)
+                .delete(synchronize_session=False)
+            )
+
+            overflow = db.query(AnalysisCache).count() - self.max_entries
+            if overflow > 0:
+                oldest_keys = (
+                    db.query(AnalysisCache.cache_key)
+                    .order_by(AnalysisCache.last_accessed_at)
+                    .limit(overflow)
+                    .subquery()
+                )
+                removed += (
+                    db.query(AnalysisCache)
+                    .filter(AnalysisCache.cache_key.in_(oldest_keys))
+                    .delete(synchronize_session=False)
+                )
+
+            db.commit()
+            if removed:
+                self._count("evictions", removed)
+                logger.info(f"Evicted {removed} analysis cache entries")
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to evict analysis cache: {e}")
+        finally:
+            if own_session:
+                db.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = round(counters["hits"] / lookups, 3) if lookups else None
+        return counters
+
+
+analysis_cache = AnalysisResultCache()
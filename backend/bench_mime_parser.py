@@ -0,0 +1,166 @@
+"""mime_parser 微基準測試
+
+以常見的真實郵件結構建立語料（ATS 通知、行事曆邀請、Big5 電子報、轉寄信、
+超大 HTML 電子報等），比較舊的遞迴 _extract_body 與新的 extract_parts。
+
+執行方式：python bench_mime_parser.py
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import base64
+import timeit
+from email.mime.application import MIMEApplication
+from email.mime.base import MIMEBase
+from email.mime.image import MIMEImage
+from email.mime.message import MIMEMessage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from mime_parser import extract_parts
+
+
+def to_gmail_payload(message):
+    """把 email.message 轉成 Gmail API format=full 的 payload 結構"""
+    payload = {
+        "mimeType": message.get_content_type(),
+        "filename": message.get_filename() or "",
+        "headers": [{"name": k, "value": v} for k, v in message.items()],
+        "body": {"size": 0},
+    }
+    if message.is_multipart():
+        payload["parts"] = [to_gmail_payload(part) for part in message.get_payload()]
+    else:
+        data = message.get_payload(decode=True) or b""
+        payload["body"] = {
+            "size": len(data),
+            "data": base64.urlsafe_b64encode(data).decode(),
+        }
+    return payload
+
+
+def legacy_extract_body(payload):
+    """舊版 GmailService._extract_body（遞迴、固定 utf-8、不限大小）"""
+    body_text = ""
+    body_html = ""
+
+    if "parts" in payload:
+        for part in payload["parts"]:
+            if part["mimeType"] == "text/plain" and "data" in part["body"]:
+                try:
+                    body_text = base64.urlsafe_b64decode(part["body"]["data"]).decode(
+                        "utf-8", errors="ignore"
+                    )
+                except Exception:
+                    body_text = base64.urlsafe_b64decode(part["body"]["data"]).decode(
+                        "latin-1", errors="ignore"
+                    )
+            elif part["mimeType"] == "text/html" and "data" in part["body"]:
+                try:
+                    body_html = base64.urlsafe_b64decode(part["body"]["data"]).decode(
+                        "utf-8", errors="ignore"
+                    )
+                except Exception:
+                    body_html = base64.urlsafe_b64decode(part["body"]["data"]).decode(
+                        "latin-1", errors="ignore"
+                    )
+            elif "parts" in part:
+                nested_text, nested_html = legacy_extract_body(part)
+                if nested_text:
+                    body_text = nested_text
+                if nested_html:
+                    body_html = nested_html
+    elif payload["mimeType"] == "text/plain" and "data" in payload["body"]:
+        body_text = base64.urlsafe_b64decode(payload["body"]["data"]).decode(
+            "utf-8", errors="ignore"
+        )
+    elif payload["mimeType"] == "text/html" and "data" in payload["body"]:
+        body_html = base64.urlsafe_b64decode(payload["body"]["data"]).decode(
+            "utf-8", errors="ignore"
+        )
+
+    return body_text, body_html
+
+
+def alternative(text, html, charset="utf-8"):
+    message = MIMEMultipart("alternative")
+    message.attach(MIMEText(text, "plain", charset))
+    message.attach(MIMEText(html, "html", charset))
+    return message
+
+
+def build_corpus():
+    invite_text = (
+        "Hi Alex,\n\nThanks for applying to the Backend Engineer role. "
+        "We'd like to invite you to a 45-minute interview on 2024/07/15 14:00 (GMT+8).\n"
+    ) * 3
+    invite_html = "<html><body>" + "<p>" + invite_text + "</p>" * 20 + "</body></html>"
+
+    corpus = {}
+
+    corpus["plain_only"] = MIMEText(invite_text, "plain", "utf-8")
+
+    corpus["ats_alternative"] = alternative(invite_text, invite_html)
+
+    # 附件是 text/plain，舊版會把它當成內文
+    with_attachment = MIMEMultipart("mixed")
+    with_attachment.attach(alternative(invite_text, invite_html))
+    resume = MIMEText("RESUME " * 20000, "plain", "utf-8")
+    resume.add_header("Content-Disposition", "attachment", filename="resume.txt")
+    with_attachment.attach(resume)
+    with_attachment.attach(MIMEApplication(b"%PDF-1.4" + b"\0" * 50000, Name="jd.pdf"))
+    corpus["mixed_with_attachments"] = with_attachment
+
+    calendar = MIMEMultipart("mixed")
+    body = alternative(invite_text, invite_html)
+    ics = "BEGIN:VCALENDAR\r\nMETHOD:REQUEST\r\nBEGIN:VEVENT\r\nSUMMARY:Interview\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n"
+    body.attach(MIMEText(ics, "calendar", "utf-8"))
+    calendar.attach(body)
+    ics_attachment = MIMEBase("application", "ics")
+    ics_attachment.set_payload(ics)
+    ics_attachment.add_header("Content-Disposition", "attachment", filename="invite.ics")
+    calendar.attach(ics_attachment)
+    corpus["calendar_invite"] = calendar
+
+    big5_text = "您好，誠摯邀請您參加本公司軟體工程師職位的面試。\n" * 50
+    corpus["big5_newsletter"] = alternative(
+        big5_text, "<div>" + big5_text + "</div>", charset="big5"
+    )
+
+    related = MIMEMultipart("related")
+    related.attach(MIMEText(invite_html, "html", "utf-8"))
+    related.attach(MIMEImage(b"\x89PNG\r\n" + b"\0" * 20000, "png"))
+    corpus["related_inline_image"] = related
+
+    forwarded = MIMEMultipart("mixed")
+    forwarded.attach(MIMEText("FYI, see below.", "plain", "utf-8"))
+    forwarded.attach(MIMEMessage(alternative(invite_text, invite_html)))
+    corpus["forwarded_message"] = forwarded
+
+    huge_html = "<table>" + "<tr><td>Deal of the day</td></tr>" * 100000 + "</table>"
+    corpus["huge_newsletter"] = alternative("Deals inside", huge_html)
+
+    return {name: to_gmail_payload(message) for name, message in corpus.items()}
+
+
+def main():
+    corpus = build_corpus()
+    print(f"{'structure':<26}{'legacy µs':>12}{'walker µs':>12}{'legacy KB':>12}{'walker KB':>12}")
+
+    for name, payload in corpus.items():
+        number = 200
+        legacy = timeit.timeit(lambda: legacy_extract_body(payload), number=number)
+        walker = timeit.timeit(lambda: extract_parts(payload), number=number)
+
+        legacy_size = sum(len(part) for part in legacy_extract_body(payload))
+        walker_size = sum(len(part) for part in extract_parts(payload).values())
+
+        print(
+            f"{name:<26}{legacy / number * 1e6:>12.1f}{walker / number * 1e6:>12.1f}"
+            f"{legacy_size / 1024:>12.1f}{walker_size / 1024:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
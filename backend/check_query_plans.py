@@ -0,0 +1,90 @@
+"""檢查熱門查詢是否使用索引
+
+以 EXPLAIN 查看 /emails、analyze-emails、面試郵件與面試資訊查詢的執行計畫，
+確認使用了 migration 建立的索引。支援 SQLite 與 PostgreSQL；PostgreSQL 在資料量小時
+會偏好循序掃描，因此檢查時關閉 enable_seqscan，確認索引「可以」被使用。
+
+執行方式：python check_query_plans.py（使用 DATABASE_URL 指定的資料庫，需先執行 migration）
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import json
+import sys
+from datetime import datetime
+
+from sqlalchemy import text
+
+from database import engine, get_db_session
+from email_store import email_list_query, encode_email_cursor, user_emails_query
+from models import Email, InterviewInvitation
+
+
+def hot_queries(db):
+    """(名稱, 查詢, 預期使用的索引)，查詢與各 endpoint 使用的相同"""
+    user_id = 1
+    return [
+        (
+            "/emails",
+            email_list_query(db, user_id).limit(10),
+            "ix_emails_user_received",
+        ),
+        (
+            "/emails next page",
+            email_list_query(db, user_id, encode_email_cursor(datetime(2024, 1, 1), 100)).limit(10),
+            "ix_emails_user_received",
+        ),
+        (
+            "analyze-emails",
+            user_emails_query(db, user_id).filter(Email.is_processed == False).limit(50),
+            "ix_emails_user_received",
+        ),
+        (
+            "interview emails",
+            db.query(Email).filter(Email.user_id == user_id, Email.is_interview_related == True),
+            "ix_emails_user_interview",
+        ),
+        (
+            "interview invitation by email",
+            db.query(InterviewInvitation).filter(InterviewInvitation.email_id == 1),
+            "ix_interview_invitations_email_id",
+        ),
+    ]
+
+
+def _compile(query) -> str:
+    statement = getattr(query, "statement", query)
+    return str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+
+
+def explain(conn, query) -> str:
+    sql = _compile(query)
+    if engine.dialect.name == "postgresql":
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+        return json.dumps(plan if not isinstance(plan, str) else json.loads(plan))
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+def main() -> int:
+    db = get_db_session()
+    failures = 0
+    try:
+        with engine.connect() as conn:
+            for name, query, index in hot_queries(db):
+                with conn.begin():
+                    plan = explain(conn, query)
+                used = index in plan
+                failures += not used
+                print(f"{'OK ' if used else 'FAIL'} {name:<32} {index}")
+                if not used:
+                    print(f"     plan: {plan}")
+    finally:
+        db.close()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,60 @@ class Config:
         "GOOGLE_REDIRECT_URI", "http://localhost:8000/auth/callback"
     )
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") 
+    # 批次分析時同時進行中的 OpenAI 請求上限
+    OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+    # 所有 OpenAI 呼叫共用的逾時、重試、同時呼叫上限與斷路設定
+    OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+    OPENAI_MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_IN_FLIGHT", "16"))
+    OPENAI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("OPENAI_CIRCUIT_FAILURE_THRESHOLD", "5"))
+    OPENAI_CIRCUIT_RESET_SECONDS = float(os.getenv("OPENAI_CIRCUIT_RESET_SECONDS", "30"))
+    # 郵件內容放進 prompt 前先整理，並限制在這些 token 數以內
+    PROMPT_BODY_TOKEN_BUDGET = int(os.getenv("PROMPT_BODY_TOKEN_BUDGET", "1500"))
+    # 離線批次分析：openai 使用 Batch API，local 為本機檔案模擬（測試用）
+    OPENAI_BATCH_TRANSPORT = os.getenv("OPENAI_BATCH_TRANSPORT", "openai")
+    OPENAI_BATCH_DIR = os.getenv("OPENAI_BATCH_DIR", "batch_jobs")
+
+    # OpenAI 分析結果快取
+    ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+    ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "50000"))
+
+    # 本地預分類器：機率低於 LOW 直接判定不是面試、高於 HIGH 直接判定是面試
+    LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "true").lower() == "true"
+    LOCAL_CLASSIFIER_LOW = float(os.getenv("LOCAL_CLASSIFIER_LOW", "0.09"))
+    LOCAL_CLASSIFIER_HIGH = float(os.getenv("LOCAL_CLASSIFIER_HIGH", "0.9"))
+
+    # 郵件內容壓縮方式：zlib，或安裝 zstandard 後使用 zstd
+    EMAIL_BODY_COMPRESSION = os.getenv("EMAIL_BODY_COMPRESSION", "zlib")
+    # /emails 每頁最多筆數
+    EMAIL_PAGE_MAX_SIZE = int(os.getenv("EMAIL_PAGE_MAX_SIZE", "100"))
+
+    # 全文搜尋：每封郵件最多索引的內容字數、每次最多回傳筆數
+    SEARCH_BODY_MAX_CHARS = int(os.getenv("SEARCH_BODY_MAX_CHARS", "10000"))
+    SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "50"))
+
+    # Gmail 同步設定
+    GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))  # Gmail 上限 100，建議 50 以內
+    GMAIL_BATCH_MAX_RETRIES = int(os.getenv("GMAIL_BATCH_MAX_RETRIES", "2"))
+    GMAIL_LIST_PAGE_SIZE = int(os.getenv("GMAIL_LIST_PAGE_SIZE", "500"))  # Gmail 上限 500
+    GMAIL_BACKFILL_QUERY = os.getenv("GMAIL_BACKFILL_QUERY", "-in:chats")
+    GMAIL_MAX_CONCURRENT_CALLS = int(os.getenv("GMAIL_MAX_CONCURRENT_CALLS", "8"))
+    GMAIL_SERVICE_CACHE_SIZE = int(os.getenv("GMAIL_SERVICE_CACHE_SIZE", "256"))
+    GMAIL_SERVICE_CACHE_TTL = int(os.getenv("GMAIL_SERVICE_CACHE_TTL", "1800"))  # 秒
+    GMAIL_MAX_BODY_BYTES = int(os.getenv("GMAIL_MAX_BODY_BYTES", str(512 * 1024)))
+    # 先抓 header 篩選，只有可能是面試相關的郵件才下載完整內容
+    GMAIL_TWO_PHASE_SYNC = os.getenv("GMAIL_TWO_PHASE_SYNC", "false").lower() == "true"
+
+    # 在 access token 到期前主動換新
+    TOKEN_REFRESH_ENABLED = os.getenv("TOKEN_REFRESH_ENABLED", "true").lower() == "true"
+    TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "600"))
+    TOKEN_REFRESH_CHECK_SECONDS = int(os.getenv("TOKEN_REFRESH_CHECK_SECONDS", "60"))
+
+    # 背景同步排程（多個 instance 時只需在其中一個開啟）
+    SYNC_SCHEDULER_ENABLED = os.getenv("SYNC_SCHEDULER_ENABLED", "false").lower() == "true"
+    SYNC_INTERVAL_SECONDS = int(os.getenv("SYNC_INTERVAL_SECONDS", "900"))
+    SYNC_INTERVAL_JITTER = float(os.getenv("SYNC_INTERVAL_JITTER", "0.2"))  # 間隔隨機 ±20%
+    SYNC_MAX_WORKERS = int(os.getenv("SYNC_MAX_WORKERS", "4"))
 
     GMAIL_SCOPES = [
         "https://www.googleapis.com/auth/gmail.readonly",
@@ -1,4 +1,6 @@
 import os
+from alembic import command
+from alembic.config import Config as AlembicConfig
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, Session
 from models import Base
@@ -72,54 +74,33 @@ def create_engine_with_fallback():
 engine = create_engine_with_fallback()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def upgrade_database():
-    """升級資料庫結構，添加新欄位"""
-    try:
-        with engine.connect() as conn:
-            # 檢查實際使用的是什麼資料庫
-            if "postgresql" in str(engine.url):
-                # PostgreSQL (Neon) 處理
-                try:
-                    conn.execute(
-                        text("ALTER TABLE users ADD COLUMN last_sync_at TIMESTAMP")
-                    )
-                    conn.commit()
-                    logger.info("已添加 last_sync_at 欄位到 users 表 (Neon PostgreSQL)")
-                except Exception as e:
-                    if "already exists" in str(e).lower() or "duplicate column" in str(e).lower():
-                        logger.info("last_sync_at 欄位已存在 (Neon PostgreSQL)")
-                    else:
-                        logger.warning(f"添加欄位時發生警告: {e}")
-            else:
-                # SQLite 處理
-                result = conn.execute(text("PRAGMA table_info(users)"))
-                columns = [row[1] for row in result.fetchall()]
-
-                if "last_sync_at" not in columns:
-                    conn.execute(
-                        text("ALTER TABLE users ADD COLUMN last_sync_at DATETIME")
-                    )
-                    conn.commit()
-                    logger.info("已添加 last_sync_at 欄位到 users 表 (SQLite)")
-                else:
-                    logger.info("last_sync_at 欄位已存在 (SQLite)")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def get_alembic_config(connection=None) -> AlembicConfig:
+    """以程式設定 Alembic，不依賴執行目錄下的 alembic.ini"""
+    alembic_config = AlembicConfig()
+    alembic_config.set_main_option("script_location", MIGRATIONS_DIR)
+    if connection is not None:
+        alembic_config.attributes["connection"] = connection
+    return alembic_config
 
-    except Exception as e:
-        logger.error(f"資料庫升級失敗: {e}")
 
-def create_tables():
+def run_migrations():
+    """把資料庫升級到最新版本；舊資料庫會由 baseline 補齊缺少的資料表與欄位"""
     try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("Database tables created successfully")
-        
+        with engine.connect() as conn:
+            command.upgrade(get_alembic_config(conn), "head")
+        logger.info("Database migrations applied successfully")
+
         # 記錄使用的資料庫類型
         if "postgresql" in str(engine.url):
             logger.info("🎉 使用 Neon PostgreSQL - 資料將永久保存！")
         else:
             logger.warning("⚠️ 使用 SQLite - 資料會在部署時丟失")
-            
+
     except Exception as e:
-        logger.error(f"Failed to create tables: {e}")
+        logger.error(f"Failed to apply migrations: {e}")
         raise
 
 def get_db():
@@ -136,8 +117,7 @@ def init_database():
     logger.info("初始化資料庫...")
     logger.info(f"目標資料庫: {DATABASE_URL.split('@')[1].split('/')[0] if '@' in DATABASE_URL and DATABASE_URL.startswith('postgresql') else 'SQLite'}")
     
-    create_tables()
-    upgrade_database()
+    run_migrations()
 
     try:
         db = get_db_session()
@@ -0,0 +1,55 @@
+"""郵件內容壓縮
+
+郵件內容以壓縮後的 blob 存在 email_bodies，每筆記錄自己的壓縮方式，
+因此可以改用其他演算法而不必重寫舊資料。zstd 需要安裝 zstandard，
+沒有安裝時使用標準函式庫的 zlib。
+"""
+from typing import Optional, Tuple
+from config import config
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # 選用套件，沒有安裝時以 zlib 壓縮
+    zstandard = None
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+
+def default_codec() -> str:
+    codec = config.EMAIL_BODY_COMPRESSION
+    if codec == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, compressing email bodies with zlib")
+        return "zlib"
+    return codec
+
+
+def compress_text(text: Optional[str], codec: str = None) -> Tuple[Optional[bytes], str]:
+    """壓縮文字，回傳 (blob, 壓縮方式)；None 維持 None"""
+    codec = codec or default_codec()
+    if text is None:
+        return None, codec
+    data = text.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data), codec
+    if codec == "zlib":
+        return zlib.compress(data, ZLIB_LEVEL), codec
+    raise ValueError(f"Unknown email body compression: {codec}")
+
+
+def decompress_text(blob: Optional[bytes], codec: str) -> Optional[str]:
+    if blob is None:
+        return None
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed email bodies")
+        data = zstandard.ZstdDecompressor().decompress(blob)
+    elif codec == "zlib":
+        data = zlib.decompress(blob)
+    else:
+        raise ValueError(f"Unknown email body compression: {codec}")
+    return data.decode("utf-8")
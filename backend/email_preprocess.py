@@ -0,0 +1,202 @@
+"""送進 prompt 前的郵件內容前處理
+
+HTML 轉純文字 → 移除引用的舊信、簽名檔與頁尾 → 內容仍超過 token 預算時
+保留與面試最相關的段落。token 數優先使用 tiktoken 計算，未安裝時用估算值。
+"""
+from html.parser import HTMLParser
+from functools import lru_cache
+from typing import List
+import html
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # 選用套件，沒有安裝時以估算值計算 token
+    tiktoken = None
+
+_HTML_RE = re.compile(r"<\s*(html|body|div|p|br|table|span|td)\b", re.IGNORECASE)
+_CJK_RE = re.compile("[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3000-\u303f\uff00-\uffef]")
+
+# 回覆舊信的開頭，之後的內容都是引用
+_QUOTE_HEADER_RE = re.compile(
+    r"^\s*(On .{5,200} wrote:|.{0,80}於 .{5,120} 寫道[:：]|-{2,}\s*Original Message\s*-{2,}|"
+    r"-{2,}\s*原始郵件\s*-{2,}|From: .+\n\s*(Sent|Date): .+)",
+    re.IGNORECASE | re.MULTILINE,
+)
+_FORWARDED_RE = re.compile(r"forwarded message|轉寄郵件|轉寄的郵件|^\s*Fwd?:", re.IGNORECASE | re.MULTILINE)
+_SIGNATURE_RE = re.compile(
+    r"^(-- ?|__+|Sent from my \w+.*|從我的 \w+ 傳送|Get Outlook for \w+.*)$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_FOOTER_RE = re.compile(
+    r"unsubscribe|取消訂閱|privacy policy|隱私權|confidential|機密|免責聲明|disclaimer|"
+    r"this (e-?mail|message) (and any attachments )?(is|was) (intended|sent)|"
+    r"all rights reserved|版權所有|view (it )?in (your )?browser",
+    re.IGNORECASE,
+)
+# 與面試安排相關的內容，超過預算時優先保留
+_RELEVANT_RE = re.compile(
+    r"interview|面試|面談|schedule|時間|日期|地點|location|address|地址|zoom|meet\.google|"
+    r"teams|\d{1,2}[:：]\d{2}|\b\d{1,2}\s?(am|pm)\b|上午|下午|\d{1,2}月\d{1,2}日|"
+    r"\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\b|星期|週|confirm|確認|position|職位|職缺|"
+    r"interviewer|面試官|online|onsite|phone|線上|視訊|電話",
+    re.IGNORECASE,
+)
+
+BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "h1", "h2", "h3", "h4",
+    "h5", "h6", "blockquote", "section", "article", "header", "footer", "hr",
+}
+SKIP_TAGS = {"script", "style", "head", "title", "noscript"}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+        elif tag == "td":
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(content: str) -> str:
+    """HTML 轉純文字，保留段落換行"""
+    parser = _TextExtractor()
+    try:
+        parser.feed(content)
+        parser.close()
+        text = "".join(parser.parts)
+    except Exception:
+        text = html.unescape(re.sub(r"<[^>]+>", " ", content))
+    return _normalize_whitespace(text)
+
+
+def _normalize_whitespace(text: str) -> str:
+    lines = [" ".join(line.split()) for line in text.replace("\r\n", "\n").split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def strip_quoted(text: str) -> str:
+    """移除回覆時引用的舊信；信件本身只有引用內容時保留原文"""
+    match = _QUOTE_HEADER_RE.search(text)
+    # 轉寄的信件內容才是重點，不當成引用
+    forwarded = match and _FORWARDED_RE.search(text[max(0, match.start() - 120) : match.start()])
+    if match and not forwarded and text[: match.start()].strip():
+        text = text[: match.start()]
+    lines = [line for line in text.split("\n") if not line.lstrip().startswith(">")]
+    return "\n".join(lines).strip()
+
+
+def strip_signature(text: str) -> str:
+    """移除簽名分隔線之後的內容與行動裝置簽名"""
+    match = _SIGNATURE_RE.search(text)
+    if match and text[: match.start()].strip():
+        text = text[: match.start()]
+    return text.strip()
+
+
+def _paragraphs(text: str) -> List[str]:
+    return [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+
+
+def strip_footers(text: str) -> str:
+    """移除含退訂連結、免責聲明等的頁尾段落"""
+    paragraphs = _paragraphs(text)
+    kept = [p for p in paragraphs if not _FOOTER_RE.search(p)]
+    return "\n\n".join(kept or paragraphs)
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """計算 token 數；沒有 tiktoken 時以中文每字 1 token、其他約 4 字元 1 token 估算"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk_chars = len(_CJK_RE.findall(text))
+    return cjk_chars + -(-(len(text) - cjk_chars) // 4)
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+    # 估算模式下逐步縮短直到符合預算
+    while text and count_tokens(text) > budget:
+        text = text[: int(len(text) * 0.9)]
+    return text
+
+
+def select_relevant(text: str, budget: int) -> str:
+    """超過預算時保留開頭段落與最相關的段落，維持原本順序"""
+    if count_tokens(text) <= budget:
+        return text
+
+    paragraphs, separator = _paragraphs(text), "\n\n"
+    # 沒有空行分段的純文字信改以每一行為單位
+    if len(paragraphs) < 3:
+        paragraphs, separator = [line for line in text.split("\n") if line.strip()], "\n"
+    costs = [count_tokens(p) for p in paragraphs]
+    # 開頭通常是問候與來意，一定保留；其餘依相關詞出現次數排序
+    ranked = sorted(
+        range(1, len(paragraphs)),
+        key=lambda i: len(_RELEVANT_RE.findall(paragraphs[i])),
+        reverse=True,
+    )
+
+    selected, used = set(), 0
+    for i in [0] + ranked:
+        if used + costs[i] <= budget:
+            selected.add(i)
+            used += costs[i]
+
+    if not selected:
+        return _truncate_to_tokens(paragraphs[0], budget)
+    return separator.join(paragraphs[i] for i in sorted(selected))
+
+
+def prepare_prompt_body(body: str, budget: int, label: str = "email") -> str:
+    """把郵件內容整理成適合放進 prompt 的文字，並記錄節省的 token 數"""
+    if not body:
+        return ""
+
+    text = html_to_text(body) if _HTML_RE.search(body) else _normalize_whitespace(body)
+    text = strip_footers(strip_signature(strip_quoted(text)))
+    text = select_relevant(text, budget)
+
+    before, after = count_tokens(body), count_tokens(text)
+    if before:
+        logger.info(
+            f"Prompt body for {label}: {before} -> {after} tokens "
+            f"({(before - after) / before:.0%} saved)"
+        )
+    return text
@@ -0,0 +1,311 @@
+"""郵件全文搜尋
+
+SQLite 使用 FTS5 虛擬表，PostgreSQL 使用 tsvector 欄位加 GIN 索引，資料表都叫 email_search。
+兩種資料庫的斷詞器都不會切中文，因此寫入前先在這裡斷詞：英數字以單字為單位、
+中日韓文字切成重疊的二字詞（「面試邀請」→「面試 試邀 邀請」），查詢時用同樣方式切詞後
+以片語比對相鄰的二字詞。只輸入一個中文字時以前綴比對。
+
+- 索引在寫入郵件與補抓內容時更新（email_store.insert_emails / set_email_body）
+- 每位用戶的郵件以 owner 欄位（SQLite）或 user_id 欄位（PostgreSQL）限定範圍
+- 排名：主旨 > 寄件人 > 內容；摘要與標示在 Python 端從原文產生，中文也能正確標示
+
+python email_search.py rebuild [user_id]   重建索引（不指定則全部用戶）
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from typing import Dict, List, Optional
+from sqlalchemy import Boolean, DateTime, bindparam, text
+from email_compression import decompress_text
+from email_preprocess import html_to_text, strip_quoted
+from config import config
+from database import get_db_session
+import html
+import logging
+import re
+import sys
+
+logger = logging.getLogger(__name__)
+
+# 中日韓文字（含假名與韓文）
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN_RE = re.compile(f"([{_CJK}]+)|([^\\W_{_CJK}]+)")
+
+SNIPPET_BEFORE = 40
+SNIPPET_LENGTH = 160
+REBUILD_BATCH_SIZE = 500
+
+# SQLite bm25 權重依欄位順序：owner, subject, sender, body；由 migration 設為 FTS5 的 rank
+SQLITE_RANK = "bm25(0.0, 10.0, 4.0, 1.0)"
+PG_DOCUMENT = (
+    "setweight(to_tsvector('simple', :subject), 'A') || "
+    "setweight(to_tsvector('simple', :sender), 'B') || "
+    "setweight(to_tsvector('simple', :body), 'D')"
+)
+
+
+def _cjk_tokens(run: str) -> List[str]:
+    if len(run) == 1:
+        return [run]
+    return [run[i : i + 2] for i in range(len(run) - 1)]
+
+
+def search_tokens(value: str) -> List[str]:
+    """斷詞：英數字轉小寫、中日韓文字切成二字詞"""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall(value or ""):
+        tokens.extend(_cjk_tokens(cjk) if cjk else [word.lower()])
+    return tokens
+
+
+def _body_for_search(body_text: Optional[str], body_html: Optional[str]) -> str:
+    """索引與摘要使用的內容：純文字、去掉引用的舊信，並限制長度"""
+    body = body_text if (body_text or "").strip() else html_to_text(body_html or "")
+    return " ".join(strip_quoted(body).split())[: config.SEARCH_BODY_MAX_CHARS]
+
+
+def build_search_document(
+    email_id: int,
+    user_id: int,
+    subject: str,
+    sender: str,
+    body_text: Optional[str],
+    body_html: Optional[str],
+) -> Dict:
+    body = _body_for_search(body_text, body_html)
+    return {
+        "email_id": email_id,
+        "user_id": user_id,
+        "owner": f"u{user_id}",
+        "subject": " ".join(search_tokens(subject)),
+        "sender": " ".join(search_tokens(sender)),
+        "body": " ".join(search_tokens(body)),
+    }
+
+
+def _dialect_name(bind) -> str:
+    """bind 可以是 Session 或 Connection"""
+    dialect = getattr(bind, "dialect", None) or bind.get_bind().dialect
+    return dialect.name
+
+
+def write_search_documents(bind, documents: List[Dict]):
+    """寫入或更新索引（不 commit）"""
+    if not documents:
+        return
+    if _dialect_name(bind) == "postgresql":
+        bind.execute(
+            text(
+                f"INSERT INTO email_search (email_id, user_id, document) "
+                f"VALUES (:email_id, :user_id, {PG_DOCUMENT}) "
+                f"ON CONFLICT (email_id) DO UPDATE "
+                f"SET user_id = EXCLUDED.user_id, document = EXCLUDED.document"
+            ),
+            documents,
+        )
+        return
+    # FTS5 沒有 upsert，先刪除再寫入
+    bind.execute(
+        text("DELETE FROM email_search WHERE rowid = :email_id"),
+        [{"email_id": document["email_id"]} for document in documents],
+    )
+    bind.execute(
+        text(
+            "INSERT INTO email_search (rowid, owner, subject, sender, body) "
+            "VALUES (:email_id, :owner, :subject, :sender, :body)"
+        ),
+        documents,
+    )
+
+
+def index_messages(db, user_id: int, messages: Dict[int, Dict]):
+    """以 GmailService 解析結果更新索引，messages 為 {email_id: message_data}（不 commit）"""
+    write_search_documents(
+        db,
+        [
+            build_search_document(
+                email_id,
+                user_id,
+                message_data.get("subject") or "",
+                message_data.get("sender") or "",
+                message_data.get("body_text"),
+                message_data.get("body_html"),
+            )
+            for email_id, message_data in messages.items()
+        ],
+    )
+
+
+def _parse_query(query: str) -> List[Dict]:
+    """把查詢字串拆成詞，每個詞包含比對用的 token 與標示用的原文"""
+    terms = []
+    for cjk, word in _TOKEN_RE.findall(query or ""):
+        if cjk:
+            terms.append({"tokens": _cjk_tokens(cjk), "prefix": len(cjk) == 1, "needle": cjk})
+        else:
+            terms.append({"tokens": [word.lower()], "prefix": True, "needle": word})
+    return terms
+
+
+def _fts5_match(user_id: int, terms: List[Dict]) -> str:
+    parts = [f"owner:u{user_id}"]
+    for term in terms:
+        phrase = '"' + " ".join(term["tokens"]) + '"'
+        parts.append(phrase + "*" if term["prefix"] else phrase)
+    return " AND ".join(parts)
+
+
+def _tsquery(terms: List[Dict]) -> str:
+    parts = []
+    for term in terms:
+        lexemes = [f"'{token}'" + (":*" if term["prefix"] else "") for token in term["tokens"]]
+        parts.append("(" + " <-> ".join(lexemes) + ")")
+    return " & ".join(parts)
+
+
+def highlight_snippet(value: str, terms: List[Dict]) -> str:
+    """從原文擷取第一個符合處附近的文字，HTML escape 後以 <mark> 標示查詢詞"""
+    if not value:
+        return ""
+    pattern = re.compile(
+        "|".join(re.escape(term["needle"]) for term in sorted(terms, key=lambda t: -len(t["needle"]))),
+        re.IGNORECASE,
+    )
+    match = pattern.search(value)
+    start = max(0, match.start() - SNIPPET_BEFORE) if match else 0
+    excerpt = value[start : start + SNIPPET_LENGTH]
+
+    parts, position = [], 0
+    for found in pattern.finditer(excerpt):
+        parts.append(html.escape(excerpt[position : found.start()]))
+        parts.append(f"<mark>{html.escape(found.group())}</mark>")
+        position = found.end()
+    parts.append(html.escape(excerpt[position:]))
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if start + SNIPPET_LENGTH < len(value) else ""
+    return prefix + "".join(parts) + suffix
+
+
+def search_emails(db, user_id: int, query: str, limit: int = 20, offset: int = 0) -> List[Dict]:
+    """依相關程度搜尋用戶的郵件，回傳含標示摘要的結果"""
+    terms = _parse_query(query)
+    if not terms:
+        return []
+
+    if _dialect_name(db) == "postgresql":
+        rows = db.execute(
+            text(
+                "SELECT email_id, ts_rank_cd(document, to_tsquery('simple', :query)) AS score "
+                "FROM email_search "
+                "WHERE user_id = :user_id AND document @@ to_tsquery('simple', :query) "
+                "ORDER BY score DESC, email_id DESC LIMIT :limit OFFSET :offset"
+            ),
+            {"query": _tsquery(terms), "user_id": user_id, "limit": limit, "offset": offset},
+        ).fetchall()
+    else:
+        # rank 即 bm25 分數，越小越相關
+        rows = db.execute(
+            text(
+                "SELECT rowid AS email_id, -rank AS score FROM email_search "
+                "WHERE email_search MATCH :query "
+                "ORDER BY rank LIMIT :limit OFFSET :offset"
+            ),
+            {"query": _fts5_match(user_id, terms), "limit": limit, "offset": offset},
+        ).fetchall()
+    if not rows:
+        return []
+
+    scores = {row.email_id: row.score for row in rows}
+    details = db.execute(
+        text(
+            "SELECT e.id, e.subject, e.sender, e.received_at, e.is_interview_related, "
+            "b.compression, b.text_data, b.html_data "
+            "FROM emails e LEFT JOIN email_bodies b ON b.email_id = e.id "
+            "WHERE e.id IN :ids"
+        )
+        .bindparams(bindparam("ids", expanding=True))
+        # 指定欄位型別，SQLite 也回傳 datetime / bool，與郵件列表 API 的格式一致
+        .columns(received_at=DateTime, is_interview_related=Boolean),
+        {"ids": list(scores)},
+    ).fetchall()
+    details = {row.id: row for row in details}
+
+    results = []
+    for email_id, score in scores.items():
+        row = details.get(email_id)
+        if row is None:
+            continue
+        body = ""
+        if row.compression:
+            body = _body_for_search(
+                decompress_text(row.text_data, row.compression),
+                decompress_text(row.html_data, row.compression),
+            )
+        results.append(
+            {
+                "id": row.id,
+                "subject": row.subject,
+                "sender": row.sender,
+                "received_at": row.received_at,
+                "is_interview_related": row.is_interview_related,
+                "subject_highlight": highlight_snippet(row.subject or "", terms),
+                "snippet": highlight_snippet(body, terms),
+                "score": round(float(score), 4),
+            }
+        )
+    return results
+
+
+def rebuild_search_index(bind, user_id: int = None) -> int:
+    """從 emails 與 email_bodies 重建索引（不 commit），依 id 分批處理，回傳索引的郵件數"""
+    select = (
+        "SELECT e.id, e.user_id, e.subject, e.sender, b.compression, b.text_data, b.html_data "
+        "FROM emails e LEFT JOIN email_bodies b ON b.email_id = e.id "
+        "WHERE e.id > :last_id AND e.user_id IS NOT NULL"
+    )
+    params = {"limit": REBUILD_BATCH_SIZE}
+    if user_id is not None:
+        select += " AND e.user_id = :user_id"
+        params["user_id"] = user_id
+    select = text(select + " ORDER BY e.id LIMIT :limit")
+
+    last_id = indexed = 0
+    while True:
+        rows = bind.execute(select, dict(params, last_id=last_id)).fetchall()
+        if not rows:
+            break
+        write_search_documents(
+            bind,
+            [
+                build_search_document(
+                    row.id,
+                    row.user_id,
+                    row.subject or "",
+                    row.sender or "",
+                    decompress_text(row.text_data, row.compression) if row.compression else None,
+                    decompress_text(row.html_data, row.compression) if row.compression else None,
+                )
+                for row in rows
+            ],
+        )
+        indexed += len(rows)
+        last_id = rows[-1].id
+        logger.info(f"Indexed {indexed} emails for search (up to email {last_id})")
+    return indexed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print(__doc__)
+        sys.exit(1)
+
+    db = get_db_session()
+    try:
+        target = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        count = rebuild_search_index(db, target)
+        db.commit()
+        print(f"已重建 {count} 封郵件的搜尋索引")
+    finally:
+        db.close()
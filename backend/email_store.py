@@ -0,0 +1,298 @@
+from sqlalchemy import func, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import Email, EmailBody, InterviewInvitation
+from language_detector import language_profile
+from mailbox_stats import adjust_mailbox_stats
+from email_search import index_messages
+from email_preprocess import html_to_text
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+import base64
+import html
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每個 INSERT 最多帶幾筆，避免超過 SQLite 的參數上限
+INSERT_CHUNK_SIZE = 200
+
+PREVIEW_LENGTH = 200
+PREVIEW_HTML_CHARS = 64 * 1024
+
+# 郵件列表只需要的欄位，不讀取 body_text / body_html
+EMAIL_LIST_COLUMNS = (
+    Email.id,
+    Email.subject,
+    Email.sender,
+    Email.received_at,
+    Email.is_interview_related,
+    Email.body_preview,
+)
+
+
+def detect_email_language(message_data: Dict):
+    """寫入時就偵測語言，之後產生回信不必再判斷；沒有可判斷的文字時回傳 None"""
+    body = message_data.get("body_text") or message_data.get("body_html") or ""
+    return language_profile(message_data.get("subject") or "", body)["language"]
+
+
+def email_prompt_body(email: Email) -> str:
+    """分析用的郵件內容，沒有純文字 part 時改用 HTML（由 email_preprocess 轉成文字）"""
+    return email.body_text or email.body_html or ""
+
+
+def body_storage_stats(db: Session) -> Dict:
+    """郵件內容壓縮前後的大小"""
+    stored_size = func.coalesce(func.length(EmailBody.text_data), 0) + func.coalesce(
+        func.length(EmailBody.html_data), 0
+    )
+    count, raw_size, stored = db.query(
+        func.count(EmailBody.email_id), func.sum(EmailBody.raw_size), func.sum(stored_size)
+    ).one()
+    raw_size, stored = raw_size or 0, stored or 0
+    return {
+        "bodies": count,
+        "raw_bytes": raw_size,
+        "stored_bytes": stored,
+        "saved_ratio": round(1 - stored / raw_size, 3) if raw_size else None,
+    }
+
+
+def build_body_preview(message_data: Dict) -> Optional[str]:
+    """郵件列表顯示的預覽文字，寫入時產生；沒有內容時改用 Gmail 的 snippet"""
+    text = message_data.get("body_text") or ""
+    if not text.strip() and message_data.get("body_html"):
+        # 預覽只需要開頭，不必轉換整封 HTML
+        text = html_to_text(message_data["body_html"][:PREVIEW_HTML_CHARS])
+    if not text.strip():
+        text = html.unescape(message_data.get("snippet") or "")
+    text = " ".join(text.split())
+    if not text:
+        return None
+    return text[:PREVIEW_LENGTH] + "..." if len(text) > PREVIEW_LENGTH else text
+
+
+def set_email_body(email: Email, message_data: Dict):
+    """補上 header-only 郵件的內容，並更新預覽、語言與搜尋索引（不 commit）"""
+    email.set_body(message_data["body_text"], message_data["body_html"])
+    email.body_fetched = True
+    email.body_preview = build_body_preview(message_data) or email.body_preview
+    # header-only 時只用主旨判斷，有內容後重新偵測
+    email.language = detect_email_language(message_data) or email.language
+
+    db = Session.object_session(email)
+    if db is not None and email.id is not None:
+        indexed = dict(message_data, subject=email.subject, sender=email.sender)
+        index_messages(db, email.user_id, {email.id: indexed})
+
+
+def user_emails_query(db: Session, user_id: int):
+    """用戶的郵件由新到舊，使用 ix_emails_user_received 索引"""
+    return (
+        db.query(Email)
+        .filter(Email.user_id == user_id)
+        .order_by(Email.received_at.desc(), Email.id.desc())
+    )
+
+
+def encode_email_cursor(received_at: datetime, email_id: int) -> str:
+    """分頁 cursor：最後一筆的 (received_at, id)，以 base64 編碼，前端不需解讀"""
+    raw = json.dumps([received_at.isoformat(), email_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_email_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析 cursor，格式不正確時拋出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        received_at, email_id = json.loads(raw)
+        return datetime.fromisoformat(received_at), int(email_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def email_list_query(db: Session, user_id: int, cursor: str = None):
+    """郵件列表查詢，只讀取列表需要的欄位；有 cursor 時從該筆之後開始"""
+    query = user_emails_query(db, user_id).with_entities(*EMAIL_LIST_COLUMNS)
+    if cursor:
+        received_at, email_id = decode_email_cursor(cursor)
+        query = query.filter(tuple_(Email.received_at, Email.id) < tuple_(received_at, email_id))
+    return query
+
+
+def user_emails_page(db: Session, user_id: int, limit: int, cursor: str = None):
+    """郵件列表的一頁，回傳 (資料列, 下一頁 cursor)"""
+    # 多取一筆判斷是否還有下一頁
+    rows = email_list_query(db, user_id, cursor).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_email_cursor(rows[-1].received_at, rows[-1].id)
+    return rows, next_cursor
+
+
+def _build_email_row(user_id: int, message_data: Dict) -> Dict:
+    """把 GmailService 解析結果轉成 emails 資料列"""
+    return {
+        "user_id": user_id,
+        "gmail_id": message_data["gmail_id"],
+        "thread_id": message_data["thread_id"],
+        "subject": message_data["subject"],
+        "sender": message_data["sender"],
+        "recipient": message_data["recipient"],
+        "received_at": message_data["received_at"],
+        "body_preview": build_body_preview(message_data),
+        "body_fetched": message_data.get("body_fetched", True),
+        "language": detect_email_language(message_data),
+    }
+
+
+def _has_body(message_data: Dict) -> bool:
+    return bool(message_data.get("body_text") or message_data.get("body_html"))
+
+
+def _build_body_row(email_id: int, message_data: Dict) -> Dict:
+    """壓縮後的 email_bodies 資料列"""
+    body = EmailBody()
+    body.set_content(message_data["body_text"], message_data["body_html"])
+    return {
+        "email_id": email_id,
+        "compression": body.compression,
+        "text_data": body.text_data,
+        "html_data": body.html_data,
+        "raw_size": body.raw_size,
+    }
+
+
+def insert_emails(db: Session, user_id: int, messages_data: List[Dict]) -> List[int]:
+    """批次寫入郵件、壓縮後的內容與搜尋索引，已存在的 gmail_id 會略過，回傳新增的 Email ID（不 commit）"""
+    # 同一批內重複的 gmail_id 只保留第一筆
+    messages = {}
+    for message_data in messages_data:
+        messages.setdefault(message_data["gmail_id"], message_data)
+    rows = [_build_email_row(user_id, message_data) for message_data in messages.values()]
+    if not rows:
+        return []
+
+    dialect = db.get_bind().dialect.name
+    inserted_ids = []
+    received_dates = []
+    inserted_messages = {}
+
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start : start + INSERT_CHUNK_SIZE]
+
+        if dialect in ("postgresql", "sqlite"):
+            # 一次 INSERT ... ON CONFLICT DO NOTHING RETURNING id，內容只寫入新增的郵件
+            insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            stmt = (
+                insert(Email)
+                .values(chunk)
+                .on_conflict_do_nothing(index_elements=["gmail_id"])
+                .returning(Email.id, Email.gmail_id, Email.received_at)
+            )
+            body_rows = []
+            for email_id, gmail_id, received_at in db.execute(stmt):
+                inserted_ids.append(email_id)
+                received_dates.append(received_at)
+                inserted_messages[email_id] = messages[gmail_id]
+                if _has_body(messages[gmail_id]):
+                    body_rows.append(_build_body_row(email_id, messages[gmail_id]))
+            if body_rows:
+                db.execute(insert(EmailBody).values(body_rows))
+        else:
+            # 其他資料庫：一次 IN 查詢找出已存在的郵件
+            existing = {
+                gmail_id
+                for (gmail_id,) in db.query(Email.gmail_id).filter(
+                    Email.gmail_id.in_([row["gmail_id"] for row in chunk])
+                )
+            }
+            records = []
+            for row in chunk:
+                if row["gmail_id"] in existing:
+                    continue
+                record = Email(**row)
+                message_data = messages[row["gmail_id"]]
+                if _has_body(message_data):
+                    record.set_body(message_data["body_text"], message_data["body_html"])
+                records.append(record)
+            db.add_all(records)
+            db.flush()
+            inserted_ids.extend(record.id for record in records)
+            received_dates.extend(record.received_at for record in records)
+            inserted_messages.update((record.id, messages[record.gmail_id]) for record in records)
+
+    index_messages(db, user_id, inserted_messages)
+    adjust_mailbox_stats(
+        db,
+        user_id,
+        total=len(inserted_ids),
+        last_received_at=max(filter(None, received_dates), default=None),
+    )
+    logger.info(f"Inserted {len(inserted_ids)}/{len(rows)} messages for user {user_id}")
+    return inserted_ids
+
+
+INVITATION_FIELDS = [
+    "company_name",
+    "position",
+    "interview_time",
+    "interview_location",
+    "interview_type",
+    "interviewer_name",
+    "interviewer_email",
+    "additional_info",
+]
+
+
+def parse_interview_date(value):
+    """把 AI 回傳的 YYYY-MM-DD 轉成 datetime，格式不符時回傳 None"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def save_interview_invitation(db: Session, email_id: int, interview_info: Dict):
+    """建立或更新郵件的面試邀請記錄（不 commit）"""
+    invitation = (
+        db.query(InterviewInvitation)
+        .filter(InterviewInvitation.email_id == email_id)
+        .first()
+    )
+    if not invitation:
+        invitation = InterviewInvitation(email_id=email_id)
+        db.add(invitation)
+
+    for key in INVITATION_FIELDS:
+        value = interview_info.get(key)
+        if value is not None:
+            setattr(invitation, key, value)
+
+    interview_date = parse_interview_date(interview_info.get("interview_date"))
+    if interview_date:
+        invitation.interview_date = interview_date
+    invitation.confidence_score = interview_info.get("confidence_score", 0)
+    return invitation
+
+
+def apply_email_analysis(db: Session, email: Email, analysis: Dict):
+    """把分析結果寫回郵件與面試資訊（不 commit）"""
+    adjust_mailbox_stats(
+        db,
+        email.user_id,
+        interview=int(bool(analysis["is_interview"])) - int(bool(email.is_interview_related)),
+        processed=0 if email.is_processed else 1,
+    )
+    email.is_interview_related = analysis["is_interview"]
+    email.is_processed = True
+    # 語言以寫入時的本地偵測為準，舊資料才用分析結果補上
+    if not email.language and analysis["language"]:
+        email.language = analysis["language"]
+    if analysis["interview_info"]:
+        save_interview_invitation(db, email.id, analysis["interview_info"])
@@ -1,59 +1,200 @@
+from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
-from sqlalchemy.orm import Session
+from googleapiclient.http import build_http
+from google_auth_httplib2 import AuthorizedHttp
 from models import User, Email
 from database import get_db_session
+from email_store import insert_emails, set_email_body
+from mime_parser import extract_parts
+from local_classifier import ATS_SENDER_DOMAINS, INTERVIEW_KEYWORDS, RECRUITING_KEYWORDS
+from config import config
+from collections import OrderedDict
 import base64
 import email
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Gmail 單一 batch request 最多 100 個子請求
+GMAIL_MAX_BATCH_SIZE = 100
+# 兩階段同步第一階段只抓這些 header
+METADATA_HEADERS = ["Subject", "From", "To", "Date"]
+# 第一階段用來挑出可能是面試相關郵件的關鍵字（寄件網域見 local_classifier.ATS_SENDER_DOMAINS）
+CANDIDATE_KEYWORDS = INTERVIEW_KEYWORDS + RECRUITING_KEYWORDS
+# 子請求遇到這些狀態碼時視為暫時性錯誤，稍後重試
+RETRYABLE_STATUS_CODES = {403, 429, 500, 502, 503, 504}
+
+# 整個 process 同時進行中的 Gmail API 呼叫上限（batch 算一次）
+_gmail_call_slots = threading.BoundedSemaphore(config.GMAIL_MAX_CONCURRENT_CALLS)
+
+# 已建立的 Gmail service：user_id -> (service, credentials, 建立時間)
+# httplib2 不是 thread-safe，因此 service 只用來組 request，實際連線由每個 thread
+# 自己的 Http 物件送出（_thread_http），快取大小只隨用戶數增加，不隨 thread 數增加
+_service_cache = OrderedDict()
+_service_cache_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_thread_local = threading.local()
+_discovery_doc = None
+
+
+def is_sync_candidate(message_data) -> bool:
+    """只看 header 判斷郵件是否值得下載完整內容"""
+    subject = (message_data.get("subject") or "").lower()
+    sender = (message_data.get("sender") or "").lower()
+
+    if any(domain in sender for domain in ATS_SENDER_DOMAINS):
+        return True
+    return any(keyword in subject for keyword in CANDIDATE_KEYWORDS)
+
+
+def _get_discovery_doc():
+    """讀取套件內附的 Gmail discovery 文件，只讀一次"""
+    global _discovery_doc
+    if _discovery_doc is None:
+        _discovery_doc = get_static_doc("gmail", "v1")
+    return _discovery_doc
+
+
+def _build_service(user_id: int):
+    """依資料庫中的 token 建立 Gmail service"""
+    db = get_db_session()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user or not user.access_token:
+            raise ValueError(f"User {user_id} not found or no access token")
+
+        expiry = user.token_expires_at
+        if expiry and expiry.tzinfo is not None:
+            # google-auth 使用 naive UTC 時間
+            expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+
+        credentials = Credentials(
+            token=user.access_token,
+            refresh_token=user.refresh_token,
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id=config.GOOGLE_CLIENT_ID,
+            client_secret=config.GOOGLE_CLIENT_SECRET,
+            expiry=expiry,
+        )
+    finally:
+        # 確保連線關閉
+        db.close()
+
+    service = build_from_document(_get_discovery_doc(), credentials=credentials)
+    return service, credentials
+
+
+def _thread_http():
+    """目前 thread 專用的 httplib2 連線，所有用戶共用（認證 header 由 AuthorizedHttp 逐次加上）"""
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        http = _thread_local.http = build_http()
+    return http
+
+
+def _get_cached_service(user_id: int):
+    """取得快取的 Gmail service，過期（TTL）或不存在時重新建立"""
+    now = time.monotonic()
+
+    with _service_cache_lock:
+        entry = _service_cache.get(user_id)
+        if entry and now - entry[2] < config.GMAIL_SERVICE_CACHE_TTL:
+            _service_cache.move_to_end(user_id)
+        else:
+            entry = None
+            _service_cache.pop(user_id, None)
+
+    if entry:
+        service, credentials = entry[0], entry[1]
+    else:
+        service, credentials = _build_service(user_id)
+        with _service_cache_lock:
+            _service_cache[user_id] = (service, credentials, now)
+            # LRU：超過上限時淘汰最久沒用的
+            while len(_service_cache) > config.GMAIL_SERVICE_CACHE_SIZE:
+                _service_cache.popitem(last=False)
+
+    # access token 過期時先換新，避免第一個 API 呼叫才收到 401
+    # （正常情況下 TokenManager 會在到期前就換好）；credentials 由各 thread 共用，換新時加鎖
+    if credentials.expired and credentials.refresh_token:
+        with _refresh_lock:
+            if credentials.expired:
+                credentials.refresh(Request())
+                save_user_token(user_id, credentials.token, credentials.expiry)
+
+    return service, credentials
+
+
+def update_cached_credentials(user_id: int, token: str, expiry: datetime):
+    """把新的 access token 套用到該用戶快取中的 credentials"""
+    with _service_cache_lock:
+        entry = _service_cache.get(user_id)
+        if entry:
+            credentials = entry[1]
+            credentials.token = token
+            credentials.expiry = expiry
+
+
+def save_user_token(user_id: int, token: str, expiry: datetime):
+    """把換新的 access token 寫回資料庫，並同步給快取中的 Gmail service"""
+    db = get_db_session()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if user:
+            user.access_token = token
+            user.token_expires_at = expiry
+            user.updated_at = datetime.utcnow()
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to save refreshed token for user {user_id}: {e}")
+    finally:
+        db.close()
+
+    update_cached_credentials(user_id, token, expiry)
+
+
+def invalidate_gmail_service(user_id: int):
+    """移除用戶的快取 service（例如重新授權取得新 token 後）"""
+    with _service_cache_lock:
+        _service_cache.pop(user_id, None)
+
 
 class GmailService:
     def __init__(self, user_id: int):
         self.user_id = user_id
         self.service = None
+        self.credentials = None
+        self.failed_message_ids = []  # batch 重試後仍抓不到的郵件
         self._setup_service()
 
     def _setup_service(self):
         """設置 Gmail 服務"""
-        db = get_db_session()
         try:
-            user = db.query(User).filter(User.id == self.user_id).first()
-            if not user or not user.access_token:
-                raise ValueError(f"User {self.user_id} not found or no access token")
-
-            from config import config
-
-            credentials = Credentials(
-                token=user.access_token,
-                refresh_token=user.refresh_token,
-                token_uri="https://oauth2.googleapis.com/token",
-                client_id=config.GOOGLE_CLIENT_ID,
-                client_secret=config.GOOGLE_CLIENT_SECRET,
-            )
-
-            self.service = build("gmail", "v1", credentials=credentials)
-            logger.info(f"Gmail service setup for user {self.user_id}")
-
+            self.service, self.credentials = _get_cached_service(self.user_id)
         except Exception as e:
             logger.error(f"Failed to setup Gmail service: {e}")
             raise
-        finally:
-            # 確保連線關閉
-            db.close()
+
+    def _execute(self, request):
+        """執行 Gmail API 請求，受全域並行上限控制；以目前 thread 的連線送出"""
+        http = AuthorizedHttp(self.credentials, http=_thread_http())
+        with _gmail_call_slots:
+            return request.execute(http=http)
 
     def get_messages(self, query: str = "", max_results: int = 10):
         """取得郵件列表"""
         try:
-            results = (
+            results = self._execute(
                 self.service.users()
                 .messages()
                 .list(userId="me", q=query, maxResults=max_results)
-                .execute()
             )
 
             messages = results.get("messages", [])
@@ -63,14 +204,30 @@ class GmailService:
             logger.error(f"Failed to get messages: {e}")
             return []
 
+    def iter_message_id_pages(self, query: str = "", page_token: str = None, page_size: int = None):
+        """逐頁列出郵件 ID，每頁 yield (message_ids, next_page_token)"""
+        page_size = min(page_size or config.GMAIL_LIST_PAGE_SIZE, 500)
+
+        while True:
+            results = self._execute(
+                self.service.users()
+                .messages()
+                .list(userId="me", q=query, maxResults=page_size, pageToken=page_token)
+            )
+
+            page_token = results.get("nextPageToken")
+            yield [msg["id"] for msg in results.get("messages", [])], page_token
+
+            if not page_token:
+                break
+
     def get_message_details(self, message_id: str):
         """取得郵件詳細內容"""
         try:
-            message = (
+            message = self._execute(
                 self.service.users()
                 .messages()
                 .get(userId="me", id=message_id, format="full")
-                .execute()
             )
 
             return self._parse_message(message)
@@ -79,7 +236,95 @@ class GmailService:
             logger.error(f"Failed to get message {message_id}: {e}")
             return None
 
-    def _parse_message(self, message):
+    def iter_message_details(self, message_ids, batch_size: int = None, headers_only: bool = False):
+        """以 Gmail HTTP batch 分批取得郵件詳細內容，每批 yield 一次解析結果
+
+        headers_only=True 時只抓 Subject/From/To/Date，不下載內容
+        """
+        batch_size = max(1, min(batch_size or config.GMAIL_BATCH_SIZE, GMAIL_MAX_BATCH_SIZE))
+        # batch 內的 request_id 必須唯一
+        message_ids = list(dict.fromkeys(message_ids))
+
+        for start in range(0, len(message_ids), batch_size):
+            chunk = message_ids[start : start + batch_size]
+            results = {}
+            pending = chunk
+
+            for attempt in range(config.GMAIL_BATCH_MAX_RETRIES + 1):
+                if attempt:
+                    # 指數退避，避免持續觸發 rate limit
+                    time.sleep(2 ** (attempt - 1))
+                pending = self._execute_message_batch(pending, results, headers_only)
+                if not pending:
+                    break
+
+            if pending:
+                logger.error(f"Batch fetch gave up on {len(pending)} messages: {pending}")
+                self.failed_message_ids.extend(pending)
+
+            # 保持 Gmail 列表原本的順序
+            yield [results[message_id] for message_id in chunk if message_id in results]
+
+    def get_messages_details_batch(self, message_ids, batch_size: int = None):
+        """批次取得郵件詳細內容"""
+        parsed_messages = []
+        for batch_results in self.iter_message_details(message_ids, batch_size):
+            parsed_messages.extend(batch_results)
+        return parsed_messages
+
+    def _execute_message_batch(self, message_ids, results, headers_only: bool = False):
+        """執行單一 batch request，回傳需要重試的郵件 ID"""
+        retry_ids = []
+
+        def handle_response(request_id, response, exception):
+            if exception is None:
+                parsed = self._parse_message(response, include_body=not headers_only)
+                if parsed:
+                    results[request_id] = parsed
+                return
+
+            status = getattr(getattr(exception, "resp", None), "status", None)
+            if status in RETRYABLE_STATUS_CODES:
+                retry_ids.append(request_id)
+            else:
+                # 其他錯誤（例如 404 郵件已刪除）不重試，只略過該封
+                logger.error(f"Failed to get message {request_id}: {exception}")
+
+        batch = self.service.new_batch_http_request(callback=handle_response)
+        for message_id in message_ids:
+            if headers_only:
+                request = (
+                    self.service.users()
+                    .messages()
+                    .get(
+                        userId="me",
+                        id=message_id,
+                        format="metadata",
+                        metadataHeaders=METADATA_HEADERS,
+                    )
+                )
+            else:
+                request = (
+                    self.service.users()
+                    .messages()
+                    .get(userId="me", id=message_id, format="full")
+                )
+            batch.add(request, request_id=message_id)
+
+        try:
+            self._execute(batch)
+        except Exception as e:
+            # 整個 batch 失敗（連線或認證問題），尚未回應的郵件全部重試
+            logger.warning(f"Batch request failed: {e}")
+            return [
+                message_id
+                for message_id in message_ids
+                if message_id not in results and message_id not in retry_ids
+            ] + retry_ids
+
+        return retry_ids
+
+    def _parse_message(self, message, include_body: bool = True):
         """解析郵件內容"""
         try:
             headers = message["payload"].get("headers", [])
@@ -91,7 +336,7 @@ class GmailService:
             date_str = next((h["value"] for h in headers if h["name"] == "Date"), "")
 
             # 提取郵件內容
-            body_text, body_html = self._extract_body(message["payload"])
+            parts = self._extract_parts(message["payload"]) if include_body else {}
 
             # 解析日期
             received_at = self._parse_date(date_str)
@@ -102,74 +347,25 @@ class GmailService:
                 "subject": subject,
                 "sender": sender,
                 "recipient": recipient,
-                "body_text": body_text,
-                "body_html": body_html,
+                "body_text": parts.get("plain", ""),
+                "body_html": parts.get("html", ""),
+                "body_calendar": parts.get("calendar", ""),
                 "received_at": received_at,
+                "snippet": message.get("snippet", ""),
+                "body_fetched": include_body,
             }
 
         except Exception as e:
             logger.error(f"Failed to parse message: {e}")
             return None
 
-    def _extract_body(self, payload):
-        """提取郵件內容"""
-        body_text = ""
-        body_html = ""
-
+    def _extract_parts(self, payload):
+        """提取郵件中的 plain / html / calendar 內容"""
         try:
-            # 處理 multipart 郵件
-            if "parts" in payload:
-                for part in payload["parts"]:
-                    if part["mimeType"] == "text/plain" and "data" in part["body"]:
-                        try:
-                            body_text = base64.urlsafe_b64decode(
-                                part["body"]["data"]
-                            ).decode("utf-8", errors="ignore")
-                        except:
-                            body_text = base64.urlsafe_b64decode(
-                                part["body"]["data"]
-                            ).decode("latin-1", errors="ignore")
-                    elif part["mimeType"] == "text/html" and "data" in part["body"]:
-                        try:
-                            body_html = base64.urlsafe_b64decode(
-                                part["body"]["data"]
-                            ).decode("utf-8", errors="ignore")
-                        except:
-                            body_html = base64.urlsafe_b64decode(
-                                part["body"]["data"]
-                            ).decode("latin-1", errors="ignore")
-                    # 處理嵌套的 multipart
-                    elif "parts" in part:
-                        nested_text, nested_html = self._extract_body(part)
-                        if nested_text:
-                            body_text = nested_text
-                        if nested_html:
-                            body_html = nested_html
-
-            # 處理單一 part 郵件
-            elif payload["mimeType"] == "text/plain" and "data" in payload["body"]:
-                try:
-                    body_text = base64.urlsafe_b64decode(
-                        payload["body"]["data"]
-                    ).decode("utf-8", errors="ignore")
-                except:
-                    body_text = base64.urlsafe_b64decode(
-                        payload["body"]["data"]
-                    ).decode("latin-1", errors="ignore")
-            elif payload["mimeType"] == "text/html" and "data" in payload["body"]:
-                try:
-                    body_html = base64.urlsafe_b64decode(
-                        payload["body"]["data"]
-                    ).decode("utf-8", errors="ignore")
-                except:
-                    body_html = base64.urlsafe_b64decode(
-                        payload["body"]["data"]
-                    ).decode("latin-1", errors="ignore")
-
+            return extract_parts(payload)
         except Exception as e:
             logger.error(f"Failed to extract body: {e}")
-
-        return body_text, body_html
+            return {}
 
     def _parse_date(self, date_str):
         """解析郵件日期"""
@@ -184,101 +380,198 @@ class GmailService:
 
         return datetime.utcnow()
 
-    def save_message_to_db(self, message_data):
-        """將郵件儲存到資料庫"""
-        # 確保資料庫連線正確關閉
+    def save_messages_to_db(self, messages_data):
+        """批次將郵件儲存到資料庫，回傳新增的 Email ID；寫入失敗時回滾並拋出例外，
+        讓呼叫端不推進同步狀態"""
+        if not messages_data:
+            return []
+
+        # 整批只用一個連線、一次 commit
         db = get_db_session()
         try:
-            # 檢查是否已存在
-            existing = (
-                db.query(Email)
-                .filter(Email.gmail_id == message_data["gmail_id"])
-                .first()
-            )
-
-            if existing:
-                logger.info(f"Message {message_data['gmail_id']} already exists")
-                return existing
-
-            # 建立新郵件記錄
-            email_record = Email(
-                user_id=self.user_id,
-                gmail_id=message_data["gmail_id"],
-                thread_id=message_data["thread_id"],
-                subject=message_data["subject"],
-                sender=message_data["sender"],
-                recipient=message_data["recipient"],
-                body_text=message_data["body_text"],
-                body_html=message_data["body_html"],
-                received_at=message_data["received_at"],
-            )
-
-            db.add(email_record)
+            inserted_ids = insert_emails(db, self.user_id, messages_data)
             db.commit()
-            db.refresh(email_record)
-
-            logger.info(f"Saved message {message_data['gmail_id']} to database")
-            return email_record
+            return inserted_ids
 
         except Exception as e:
             # 發生錯誤時回滾
             db.rollback()
-            logger.error(f"Failed to save message: {e}")
-            return None
+            logger.error(f"Failed to save messages: {e}")
+            raise
         finally:
             # 確保連線關閉
             db.close()
 
-    def sync_recent_emails(self, max_results: int = 50):
+    def fetch_and_save_messages(self, message_ids, progress=None) -> int:
+        """下載郵件並寫入資料庫，回傳新增數量
+
+        開啟兩階段同步時先抓 header，只有候選郵件下載完整內容，
+        其他郵件存成 header-only，之後需要時再用 fetch_email_body 補抓。
+        progress（例如 SyncJob）每寫完一批會收到 record_batch(fetched, saved)
+        """
+        saved_count = 0
+        failed_before = len(self.failed_message_ids)
+
+        if not config.GMAIL_TWO_PHASE_SYNC:
+            for batch_results in self.iter_message_details(message_ids):
+                inserted = len(self.save_messages_to_db(batch_results))
+                saved_count += inserted
+                if progress:
+                    progress.record_batch(len(batch_results), inserted)
+        else:
+            for headers_batch in self.iter_message_details(message_ids, headers_only=True):
+                candidate_ids = [m["gmail_id"] for m in headers_batch if is_sync_candidate(m)]
+                header_only = [m for m in headers_batch if not is_sync_candidate(m)]
+
+                inserted = len(self.save_messages_to_db(header_only))
+                for batch_results in self.iter_message_details(candidate_ids):
+                    inserted += len(self.save_messages_to_db(batch_results))
+
+                saved_count += inserted
+                if progress:
+                    progress.record_batch(len(headers_batch), inserted)
+                logger.info(
+                    f"兩階段同步：{len(candidate_ids)}/{len(headers_batch)} 封下載完整內容"
+                )
+
+        failed_count = len(self.failed_message_ids) - failed_before
+        if failed_count and progress:
+            progress.record_error(f"{failed_count} 封郵件重試後仍無法下載")
+
+        return saved_count
+
+    def fetch_email_body(self, email_record: Email) -> bool:
+        """補抓 header-only 郵件的內容（由呼叫端 commit）"""
+        message_details = self.get_message_details(email_record.gmail_id)
+        if not message_details:
+            return False
+
+        set_email_body(email_record, message_details)
+        return True
+
+    def get_history_id(self):
+        """取得目前 mailbox 的 historyId"""
+        profile = self._execute(self.service.users().getProfile(userId="me"))
+        return profile.get("historyId")
+
+    def get_added_message_ids(self, start_history_id: str):
+        """透過 history API 取得 start_history_id 之後新增的郵件 ID
+
+        回傳 (message_ids, latest_history_id)；historyId 已過期時回傳 (None, None)
+        """
+        message_ids = []
+        latest_history_id = start_history_id
+        page_token = None
+
+        try:
+            while True:
+                results = self._execute(
+                    self.service.users()
+                    .history()
+                    .list(
+                        userId="me",
+                        startHistoryId=start_history_id,
+                        historyTypes="messageAdded",
+                        pageToken=page_token,
+                    )
+                )
+
+                for record in results.get("history", []):
+                    for added in record.get("messagesAdded", []):
+                        message = added["message"]
+                        # 草稿每次編輯都會產生新的 message，不需要同步
+                        if "DRAFT" in message.get("labelIds", []):
+                            continue
+                        message_ids.append(message["id"])
+
+                latest_history_id = results.get("historyId", latest_history_id)
+                page_token = results.get("nextPageToken")
+                if not page_token:
+                    break
+
+        except HttpError as e:
+            # Gmail 對過期或無效的 startHistoryId 回傳 404
+            if e.resp.status == 404:
+                logger.warning(f"History {start_history_id} expired for user {self.user_id}")
+                return None, None
+            raise
+
+        return list(dict.fromkeys(message_ids)), latest_history_id
+
+    def sync_recent_emails(self, max_results: int = 50, progress=None):
         """增量同步郵件到資料庫"""
         # 確保資料庫連線正確關閉
         db = get_db_session()
         try:
-            # 取得用戶最後同步時間
+            # 取得用戶最後同步狀態
             user = db.query(User).filter(User.id == self.user_id).first()
             if not user:
                 raise ValueError(f"User {self.user_id} not found")
 
-            # 建構查詢條件
-            if user.last_sync_at:
-                # 增量同步：只取上次同步後的郵件
-                after_date = user.last_sync_at.strftime("%Y/%m/%d")
-                query = f"after:{after_date}"
-                logger.info(f"增量同步：查詢 {after_date} 之後的郵件")
-            else:
-                # 首次同步：只取最近7天
-                query = "newer_than:7d"
-                logger.info("首次同步：查詢最近7天的郵件")
-
-            # 取得郵件列表
-            messages = self.get_messages(query=query, max_results=max_results)
-            saved_count = 0
-
-            if not messages:
-                logger.info("沒有新郵件需要同步")
-                # 更新同步時間即使沒有新郵件
-                user.last_sync_at = datetime.utcnow()
-                db.commit()
-                return 0
-
-            # 暫時釋放連線 在處理郵件時重新獲取
-            user.last_sync_at = datetime.utcnow()
-            db.commit()
+            history_id = user.gmail_history_id
+            last_sync_at = user.last_sync_at
+            # 查詢 Gmail 期間不佔用資料庫連線
             db.close()
 
-            # 處理郵件
-            for msg in messages:
-                message_details = self.get_message_details(msg["id"])
-                if message_details:
-                    saved_email = self.save_message_to_db(message_details)
-                    if saved_email:
-                        saved_count += 1
+            failed_before = len(self.failed_message_ids)
+            message_ids = None
+            new_history_id = None
+
+            if history_id:
+                # 增量同步：只取 historyId 之後新增的郵件
+                message_ids, new_history_id = self.get_added_message_ids(history_id)
+                if message_ids is not None:
+                    sync_type = "增量同步"
+                    logger.info(f"增量同步：history {history_id} 之後新增 {len(message_ids)} 封郵件")
+
+            if message_ids is None:
+                # 首次同步或 historyId 過期：先記下目前 historyId 再列出時間窗內的郵件，
+                # 避免列表與記錄之間到達的郵件被漏掉
+                new_history_id = self.get_history_id()
+                if last_sync_at:
+                    after_date = last_sync_at.strftime("%Y/%m/%d")
+                    query = f"after:{after_date}"
+                    sync_type = "重新同步"
+                    logger.info(f"重新同步：查詢 {after_date} 之後的郵件")
+                else:
+                    query = "newer_than:7d"
+                    sync_type = "首次同步"
+                    logger.info("首次同步：查詢最近7天的郵件")
+
+                # 時間窗內的郵件要全部列完才能推進 historyId，max_results 只是每頁大小
+                message_ids = []
+                for page_ids, _ in self.iter_message_id_pages(query=query, page_size=max_results):
+                    message_ids.extend(page_ids)
+
+            if progress:
+                progress.sync_type = sync_type
+
+            # 處理郵件：每批取回後直接寫入資料庫（寫入失敗會拋出例外）
+            saved_count = self.fetch_and_save_messages(message_ids, progress)
+
+            failed_count = len(self.failed_message_ids) - failed_before
+            if failed_count:
+                # 有郵件抓不到時不更新同步狀態，下次從同一個 historyId 重試（已寫入的郵件會略過）
+                logger.warning(
+                    f"{failed_count} 封郵件下載失敗，user {self.user_id} 的同步狀態維持不變"
+                )
+                return saved_count
+
+            # 郵件都處理完才更新同步狀態，失敗時下次會從同一個 historyId 重試
+            db = get_db_session()
+            user = db.query(User).filter(User.id == self.user_id).first()
+            user.last_sync_at = datetime.utcnow()
+            if new_history_id:
+                user.gmail_history_id = str(new_history_id)
+            db.commit()
 
-            logger.info(f"增量同步完成：新增 {saved_count}/{len(messages)} 封郵件")
+            logger.info(f"增量同步完成：新增 {saved_count}/{len(message_ids)} 封郵件")
             return saved_count
 
         except Exception as e:
             logger.error(f"Failed to sync emails: {e}")
+            if progress:
+                progress.record_error(str(e), fatal=True)
             # 回滾
             try:
                 db.rollback()
@@ -292,6 +585,78 @@ class GmailService:
             except:
                 pass  # 如果連線已關閉，忽略關閉錯誤
 
+    def backfill_emails(self, max_pages: int = None, page_size: int = None, progress=None):
+        """逐頁回填整個信箱，可中斷後從 User.backfill_page_token 繼續
+
+        每次只在記憶體中保留一頁 ID 與一個 batch 的郵件內容
+        """
+        db = get_db_session()
+        try:
+            user = db.query(User).filter(User.id == self.user_id).first()
+            if not user:
+                raise ValueError(f"User {self.user_id} not found")
+            page_token = user.backfill_page_token
+            already_completed = user.backfill_completed_at is not None
+        finally:
+            db.close()
+
+        if already_completed and not page_token:
+            # 回填完成後的新郵件由增量同步負責
+            return {"saved_count": 0, "pages": 0, "completed": True}
+
+        if page_token:
+            logger.info(f"繼續回填 user {self.user_id}，從上次的分頁位置開始")
+
+        saved_count = 0
+        page_count = 0
+        completed = False
+
+        try:
+            for message_ids, next_page_token in self.iter_message_id_pages(
+                query=config.GMAIL_BACKFILL_QUERY,
+                page_token=page_token,
+                page_size=page_size,
+            ):
+                failed_before = len(self.failed_message_ids)
+                saved_count += self.fetch_and_save_messages(message_ids, progress)
+
+                if len(self.failed_message_ids) > failed_before:
+                    # 這頁有郵件抓不到，游標留在原地，下次回填重做這一頁
+                    logger.warning(f"回填 user {self.user_id}：第 {page_count + 1} 頁有郵件下載失敗，停止回填")
+                    break
+
+                page_count += 1
+                completed = next_page_token is None
+                # 每頁寫完才推進游標，中斷時最多重做一頁
+                self._save_backfill_cursor(next_page_token, completed)
+                logger.info(f"回填 user {self.user_id}：完成第 {page_count} 頁，累計 {saved_count} 封")
+
+                if max_pages and page_count >= max_pages:
+                    break
+
+        except Exception as e:
+            # 列表、下載或寫入失敗時游標停在最後一個完成的頁面
+            logger.error(f"Failed to backfill emails: {e}")
+            if progress:
+                progress.record_error(str(e), fatal=True)
+
+        return {"saved_count": saved_count, "pages": page_count, "completed": completed}
+
+    def _save_backfill_cursor(self, page_token, completed: bool):
+        """記錄回填游標"""
+        db = get_db_session()
+        try:
+            user = db.query(User).filter(User.id == self.user_id).first()
+            user.backfill_page_token = page_token
+            if completed:
+                user.backfill_completed_at = datetime.utcnow()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to save backfill cursor: {e}")
+        finally:
+            db.close()
+
     def send_email(self, to: str, subject: str, body: str):
         """發送郵件"""
         try:
@@ -301,11 +666,10 @@ class GmailService:
                 ).decode()
             }
 
-            result = (
+            result = self._execute(
                 self.service.users()
                 .messages()
                 .send(userId="me", body=message)
-                .execute()
             )
 
             logger.info(f"Email sent successfully: {result['id']}")
@@ -0,0 +1,64 @@
+"""本地語言偵測
+
+以 Unicode 字元所屬文字（CJK 漢字 / 拉丁字母）的比例為主，常用詞統計為輔，
+判斷郵件是中文還是英文。中英夾雜的郵件（英文公司名、中文簽名檔等）
+以份量較重的一方為主要語言，並標示為 mixed。
+"""
+from typing import Dict
+import re
+
+# 只看前面這麼多字就足以判斷語言
+MAX_SCAN_CHARS = 4000
+# 少數語言佔比超過此值時視為中英夾雜
+MIXED_THRESHOLD = 0.25
+# 平均約 1.5 個漢字對應一個英文單字，用來把兩種文字換算成相同單位
+CJK_CHARS_PER_WORD = 1.5
+
+_CJK_RE = re.compile("[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_LATIN_WORD_RE = re.compile(r"[A-Za-z]{2,}")
+# 網址、email 地址與 HTML 標籤不算進任何語言
+_NOISE_RE = re.compile(r"https?://\S+|www\.\S+|\S+@\S+|<[^>]*>|&\w+;")
+
+ENGLISH_COMMON_WORDS = frozenset(
+    "the and you your to of for we our in on at is are be will with this that "
+    "please thank thanks would like interview position regards best dear".split()
+)
+CHINESE_COMMON_WORDS = (
+    "的", "您", "我們", "是", "在", "請", "謝謝", "感謝", "面試", "時間", "敬上", "您好", "公司",
+)
+
+
+def _clean(text: str) -> str:
+    return _NOISE_RE.sub(" ", (text or "")[:MAX_SCAN_CHARS])
+
+
+def language_profile(subject: str, body: str = "") -> Dict:
+    """回傳 {"language", "chinese_ratio", "mixed"}，沒有可判斷的文字時 language 為 None"""
+    # 主旨通常比內文更能代表寄件者使用的語言，權重加倍
+    text = _clean(subject) * 2 + " " + _clean(body)
+
+    cjk_chars = len(_CJK_RE.findall(text))
+    latin_words = _LATIN_WORD_RE.findall(text.lower())
+
+    chinese_score = cjk_chars / CJK_CHARS_PER_WORD
+    english_score = float(len(latin_words))
+
+    # 常用詞代表真正的句子，而不只是夾雜的專有名詞
+    chinese_score += 2 * sum(text.count(word) for word in CHINESE_COMMON_WORDS)
+    english_score += 2 * sum(1 for word in latin_words if word in ENGLISH_COMMON_WORDS)
+
+    total = chinese_score + english_score
+    if not total:
+        return {"language": None, "chinese_ratio": 0.0, "mixed": False}
+
+    chinese_ratio = chinese_score / total
+    return {
+        "language": "chinese" if chinese_ratio >= 0.5 else "english",
+        "chinese_ratio": round(chinese_ratio, 3),
+        "mixed": MIXED_THRESHOLD <= chinese_ratio <= 1 - MIXED_THRESHOLD,
+    }
+
+
+def detect_language(subject: str, body: str = "", default: str = "english") -> str:
+    """回傳 "chinese" 或 "english"，無法判斷時回傳 default"""
+    return language_profile(subject, body)["language"] or default
@@ -0,0 +1,352 @@
+"""整個 process 共用的 OpenAI 呼叫入口
+
+- 共用同一個 client 與連線池，不再每個請求建立新的 client
+- 每次呼叫有逾時；429 / 5xx / 連線錯誤以加上隨機抖動的指數退避重試
+- 連續失敗達門檻時斷路，暫停呼叫一段時間後只放一個請求試探
+- 限制同時進行中的呼叫數：同步呼叫（在 worker thread 中執行）以 threading semaphore、
+  非同步呼叫以綁定 event loop 的 asyncio.Semaphore 各自限制，event loop 上不會有阻塞的等待
+- 統計延遲、重試次數與 token 用量
+"""
+from collections import deque
+from typing import AsyncIterator, Dict
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+)
+from config import config
+import asyncio
+import httpx
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# 保留最近幾次的延遲計算百分位數
+LATENCY_WINDOW = 500
+
+
+class CircuitOpenError(Exception):
+    """斷路中，暫時不呼叫 OpenAI"""
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES
+
+
+def _retry_after(error: Exception):
+    """429 回應帶有 Retry-After 時依照伺服器指示等待"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        api_key: str = None,
+        timeout: float = None,
+        max_retries: int = None,
+        max_in_flight: int = None,
+        failure_threshold: int = None,
+        reset_seconds: float = None,
+    ):
+        self.api_key = api_key or config.OPENAI_API_KEY
+        self.timeout = timeout or config.OPENAI_TIMEOUT_SECONDS
+        self.max_retries = config.OPENAI_MAX_RETRIES if max_retries is None else max_retries
+        self.max_in_flight = max_in_flight or config.OPENAI_MAX_IN_FLIGHT
+        self.failure_threshold = failure_threshold or config.OPENAI_CIRCUIT_FAILURE_THRESHOLD
+        self.reset_seconds = reset_seconds or config.OPENAI_CIRCUIT_RESET_SECONDS
+        self.backoff_base = 0.5
+        self.backoff_cap = 20.0
+
+        self._client = None
+        self._async_client = None
+        self._async_loop = None
+        self._async_slots = None
+        self._client_lock = threading.Lock()
+
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._in_flight = 0
+
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "rejected_by_circuit": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+        }
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight
+        )
+
+    @property
+    def client(self) -> OpenAI:
+        """共用的同步 client；重試由 gateway 處理，因此關閉 SDK 內建重試"""
+        with self._client_lock:
+            if self._client is None:
+                self._client = OpenAI(
+                    api_key=self.api_key,
+                    timeout=self.timeout,
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=self._limits()),
+                )
+            return self._client
+
+    def _bind_loop(self):
+        """回傳目前 event loop 的 (非同步 client, semaphore)；兩者都綁定 event loop，換了 loop 就重建"""
+        loop = asyncio.get_running_loop()
+        with self._client_lock:
+            if self._async_client is None or self._async_loop is not loop:
+                self._async_client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    timeout=self.timeout,
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(limits=self._limits()),
+                )
+                self._async_slots = asyncio.Semaphore(self.max_in_flight)
+                self._async_loop = loop
+            return self._async_client, self._async_slots
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """共用的非同步 client"""
+        return self._bind_loop()[0]
+
+    # 斷路器
+
+    def _before_call(self) -> bool:
+        """檢查斷路狀態，回傳這次呼叫是否為半開時的試探請求"""
+        with self._lock:
+            self._counters["calls"] += 1
+            if self._opened_at is None:
+                return False
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._probe_in_flight:
+                self._counters["rejected_by_circuit"] += 1
+                raise CircuitOpenError("OpenAI circuit is open")
+            # 冷卻時間已過，放一個請求試探
+            self._probe_in_flight = True
+            return True
+
+    def _end_probe(self, probe: bool):
+        """試探請求結束（包含被取消、沒有成功或失敗結果時），讓出試探名額"""
+        if probe:
+            with self._lock:
+                self._probe_in_flight = False
+
+    def _record_success(self, started: float, usage):
+        with self._lock:
+            self._counters["succeeded"] += 1
+            self._latencies.append(time.monotonic() - started)
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+            if usage is not None:
+                for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                    self._counters[key] += getattr(usage, key, 0) or 0
+
+    def _record_failure(self, error: Exception):
+        with self._lock:
+            self._counters["failed"] += 1
+            self._probe_in_flight = False
+            # 請求本身有誤（400 等）不代表服務異常，不計入斷路
+            if not _is_retryable(error):
+                return
+            self._consecutive_failures += 1
+            if self._opened_at is not None or self._consecutive_failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.error(
+                        f"OpenAI circuit opened after {self._consecutive_failures} failures"
+                    )
+                self._opened_at = time.monotonic()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        with self._lock:
+            self._counters["retries"] += 1
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_cap)
+        # full jitter
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+
+    # 同時進行中的呼叫數
+    # 同步呼叫只應在 worker thread 中執行（FastAPI handler 經由 run_in_threadpool）；
+    # 非同步呼叫使用 asyncio.Semaphore，不與同步呼叫共用，event loop 不會卡在 threading 的 acquire
+
+    def _acquire_slot(self):
+        self._slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+
+    def _release_slot(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    async def _acquire_slot_async(self) -> asyncio.Semaphore:
+        """取得非同步名額，回傳要在 _release_slot_async 釋放的 semaphore"""
+        _, slots = self._bind_loop()
+        await slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+        return slots
+
+    def _release_slot_async(self, slots: asyncio.Semaphore):
+        with self._lock:
+            self._in_flight -= 1
+        slots.release()
+
+    # 呼叫
+
+    def chat(self, **kwargs):
+        """同步 chat completion，參數同 client.chat.completions.create
+
+        會等待名額並以 time.sleep 退避，不可直接在 event loop 上呼叫
+        """
+        probe = self._before_call()
+        started = time.monotonic()
+        try:
+            for attempt in range(self.max_retries + 1):
+                self._acquire_slot()
+                try:
+                    response = self.client.chat.completions.create(**kwargs)
+                except Exception as e:
+                    if attempt < self.max_retries and _is_retryable(e):
+                        delay = self._backoff(attempt, e)
+                        logger.warning(f"OpenAI call failed ({e}), retrying in {delay:.1f}s")
+                    else:
+                        self._record_failure(e)
+                        raise
+                else:
+                    self._record_success(started, response.usage)
+                    return response
+                finally:
+                    self._release_slot()
+                time.sleep(delay)
+        finally:
+            self._end_probe(probe)
+
+    async def achat(self, **kwargs):
+        """非同步 chat completion；被取消時同樣會釋放名額與試探名額"""
+        probe = self._before_call()
+        started = time.monotonic()
+        try:
+            for attempt in range(self.max_retries + 1):
+                slots = await self._acquire_slot_async()
+                try:
+                    response = await self.async_client.chat.completions.create(**kwargs)
+                except Exception as e:
+                    if attempt < self.max_retries and _is_retryable(e):
+                        delay = self._backoff(attempt, e)
+                        logger.warning(f"OpenAI call failed ({e}), retrying in {delay:.1f}s")
+                    else:
+                        self._record_failure(e)
+                        raise
+                else:
+                    self._record_success(started, response.usage)
+                    return response
+                finally:
+                    self._release_slot_async(slots)
+                await asyncio.sleep(delay)
+        finally:
+            self._end_probe(probe)
+
+    async def astream(self, **kwargs) -> AsyncIterator:
+        """串流 chat completion，逐一 yield chunk
+
+        只有在還沒收到任何內容前才重試；迭代中途停止或被取消時會關閉上游連線並釋放名額
+        """
+        probe = self._before_call()
+        started = time.monotonic()
+        kwargs = dict(kwargs, stream=True, stream_options={"include_usage": True})
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                slots = await self._acquire_slot_async()
+                try:
+                    stream = await self.async_client.chat.completions.create(**kwargs)
+                    break
+                except BaseException as e:
+                    # 包含 CancelledError：連線還沒建立就被取消時也要歸還名額
+                    self._release_slot_async(slots)
+                    if attempt < self.max_retries and _is_retryable(e):
+                        delay = self._backoff(attempt, e)
+                        logger.warning(f"OpenAI stream failed ({e}), retrying in {delay:.1f}s")
+                    else:
+                        if isinstance(e, Exception):
+                            self._record_failure(e)
+                        raise
+                await asyncio.sleep(delay)
+        except BaseException:
+            self._end_probe(probe)
+            raise
+
+        usage = None
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                yield chunk
+            self._record_success(started, usage)
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        finally:
+            # 呼叫端中途停止時沒有成功或失敗的結果，仍要讓出試探名額
+            self._end_probe(probe)
+            self._release_slot_async(slots)
+            await stream.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+            latencies = sorted(self._latencies)
+            circuit = "closed"
+            if self._opened_at is not None:
+                cooling = time.monotonic() - self._opened_at < self.reset_seconds
+                circuit = "open" if cooling else "half_open"
+            counters.update(
+                {
+                    "in_flight": self._in_flight,
+                    "max_in_flight": self.max_in_flight,
+                    "circuit": circuit,
+                    "consecutive_failures": self._consecutive_failures,
+                }
+            )
+
+        def percentile(p: float):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1)
+
+        counters["latency_ms"] = {
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "max": round(latencies[-1] * 1000, 1) if latencies else None,
+        }
+        return counters
+
+
+llm_gateway = LLMGateway()
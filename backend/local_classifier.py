@@ -0,0 +1,331 @@
+"""本地面試郵件預分類器
+
+以關鍵字 / 正規表示式、寄件網域等特徵搭配小型邏輯迴歸模型，在本機算出
+「是面試邀請」的機率。確定不是面試邀請的郵件不必呼叫 LLM；確定是面試邀請的
+郵件仍要交給 LLM 提取面試資訊，因此只有 negative 算是省下的呼叫。出現面試關鍵字的
+郵件一律不在本地判定為 negative，漏掉真正的面試邀請比多呼叫一次 LLM 代價高得多。
+
+python local_classifier.py train      以 fixtures 重新訓練並印出權重
+python local_classifier.py evaluate   評估本地判斷的比例、正確率、面試郵件召回率與可省下的 LLM 呼叫
+python local_classifier.py calibrate  以交叉驗證（held-out）的機率找出不漏掉面試郵件的 LOW 門檻
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+from config import config
+import json
+import math
+import os
+import re
+import sys
+import threading
+
+# 強烈表示面試的關鍵字
+INTERVIEW_KEYWORDS = ["interview", "面試", "面談", "會面"]
+# 招募流程相關詞彙
+RECRUITING_KEYWORDS = [
+    "recruit",
+    "招募",
+    "hiring",
+    "應徵",
+    "職缺",
+    "application",
+    "candidate",
+    "position",
+    "role",
+    "offer",
+    "assessment",
+    "phone screen",
+    "人資",
+    "履歷",
+]
+# 招募系統（ATS）與求職平台的寄件網域
+ATS_SENDER_DOMAINS = [
+    "greenhouse.io",
+    "lever.co",
+    "myworkday.com",
+    "myworkdayjobs.com",
+    "smartrecruiters.com",
+    "ashbyhq.com",
+    "icims.com",
+    "104.com.tw",
+    "cakeresume.com",
+    "yourator.co",
+]
+
+_SCHEDULING_RE = re.compile(
+    r"\d{1,2}[:：]\d{2}|\b\d{1,2}\s?(am|pm)\b|上午|下午|星期|週[一二三四五六日]|"
+    r"\b(monday|tuesday|wednesday|thursday|friday)\b|availability|available|"
+    r"schedule|calendar|time slot|時段|方便的時間|\d{1,2}月\d{1,2}日",
+    re.IGNORECASE,
+)
+_INVITE_RE = re.compile(
+    r"invite you|invitation|would like to (invite|schedule|meet)|邀請您|誠摯邀請|"
+    r"next (step|round)|下一階段|安排.{0,6}(面試|面談)",
+    re.IGNORECASE,
+)
+_MARKETING_RE = re.compile(
+    r"unsubscribe|取消訂閱|newsletter|電子報|promotion|優惠|折扣|\d+% off|webinar|sale\b",
+    re.IGNORECASE,
+)
+_REJECTION_RE = re.compile(
+    r"unfortunately|regret to|not (be )?moving forward|other candidates|很遺憾|婉拒|未能錄取",
+    re.IGNORECASE,
+)
+_RECEIPT_RE = re.compile(
+    r"(received|receipt of) your application|thank you for (applying|your application)|"
+    r"已收到您的(履歷|應徵)|感謝您的應徵",
+    re.IGNORECASE,
+)
+
+FEATURE_NAMES = [
+    "bias",
+    "subject_interview",
+    "body_interview",
+    "scheduling",
+    "invite_phrase",
+    "recruiting_terms",
+    "ats_sender",
+    "marketing",
+    "rejection",
+    "application_receipt",
+    "reply_subject",
+]
+
+# 以 fixtures/interview_emails.jsonl 訓練（python local_classifier.py train）
+WEIGHTS = [
+    -2.5668,  # bias
+    1.8095,  # subject_interview
+    1.0583,  # body_interview
+    0.9638,  # scheduling
+    2.0459,  # invite_phrase
+    0.8673,  # recruiting_terms
+    -0.1588,  # ats_sender
+    -0.9092,  # marketing
+    -0.5324,  # rejection
+    -0.1100,  # application_receipt
+    0.0088,  # reply_subject
+]
+
+# 這些特徵成立時不在本地判定為 negative
+_KEYWORD_FEATURES = [FEATURE_NAMES.index("subject_interview"), FEATURE_NAMES.index("body_interview")]
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "interview_emails.jsonl")
+
+
+def extract_features(subject: str, body: str, sender: str = "") -> List[float]:
+    """把一封郵件轉成特徵向量（順序同 FEATURE_NAMES）"""
+    subject = (subject or "").lower()
+    body = (body or "")[:5000].lower()
+    sender = (sender or "").lower()
+    text = subject + "\n" + body
+
+    recruiting_hits = sum(1 for keyword in RECRUITING_KEYWORDS if keyword in text)
+
+    return [
+        1.0,
+        float(any(keyword in subject for keyword in INTERVIEW_KEYWORDS)),
+        float(any(keyword in body for keyword in INTERVIEW_KEYWORDS)),
+        float(bool(_SCHEDULING_RE.search(text))),
+        float(bool(_INVITE_RE.search(text))),
+        min(recruiting_hits, 3) / 3,
+        float(any(domain in sender for domain in ATS_SENDER_DOMAINS)),
+        float(bool(_MARKETING_RE.search(text))),
+        float(bool(_REJECTION_RE.search(text))),
+        float(bool(_RECEIPT_RE.search(text))),
+        float(subject.startswith(("re:", "回覆", "答覆"))),
+    ]
+
+
+def _sigmoid(value: float) -> float:
+    if value < -30:
+        return 0.0
+    if value > 30:
+        return 1.0
+    return 1 / (1 + math.exp(-value))
+
+
+def score_matrix(features: Sequence[Sequence[float]], weights: Sequence[float] = None) -> List[float]:
+    """一次計算整批特徵向量的機率"""
+    weights = weights or WEIGHTS
+    return [_sigmoid(sum(w * x for w, x in zip(weights, row))) for row in features]
+
+
+def has_interview_keyword(features: Sequence[float]) -> bool:
+    return any(features[i] for i in _KEYWORD_FEATURES)
+
+
+class LocalClassifier:
+    """本地分類器：低於 low 判定不是面試、高於 high 判定是面試，中間交給 LLM"""
+
+    def __init__(self, low: float = None, high: float = None, weights: Sequence[float] = None):
+        self.low = config.LOCAL_CLASSIFIER_LOW if low is None else low
+        self.high = config.LOCAL_CLASSIFIER_HIGH if high is None else high
+        self.weights = list(weights or WEIGHTS)
+
+        self._lock = threading.Lock()
+        self._counters = {"negative": 0, "positive": 0, "uncertain": 0}
+
+    def predict_batch(self, emails: Sequence[Tuple[str, str, str]]) -> List[float]:
+        """emails 為 (subject, body, sender) 列表，回傳每封是面試邀請的機率"""
+        features = [extract_features(*email) for email in emails]
+        return score_matrix(features, self.weights)
+
+    def predict(self, subject: str, body: str, sender: str = "") -> float:
+        return self.predict_batch([(subject, body, sender)])[0]
+
+    def decide(self, probability: float, has_keyword: bool = False) -> Optional[bool]:
+        """回傳 True / False，落在不確定區間時回傳 None；has_keyword 時不會回傳 False"""
+        if probability <= self.low and not has_keyword:
+            decision, counter = False, "negative"
+        elif probability >= self.high:
+            decision, counter = True, "positive"
+        else:
+            decision, counter = None, "uncertain"
+
+        with self._lock:
+            self._counters[counter] += 1
+        return decision
+
+    def classify(self, subject: str, body: str, sender: str = "") -> Tuple[Optional[bool], float]:
+        """回傳 (判斷結果或 None, 判斷的信心度 0-100)"""
+        features = extract_features(subject, body, sender)
+        probability = score_matrix([features], self.weights)[0]
+        decision = self.decide(probability, has_interview_keyword(features))
+        return decision, round(max(probability, 1 - probability) * 100, 1)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+        total = sum(counters.values())
+        # positive 仍會呼叫 LLM 提取資訊，只有 negative 省下呼叫
+        counters["llm_avoided_rate"] = round(counters["negative"] / total, 3) if total else None
+        counters["positive_rate"] = round(counters["positive"] / total, 3) if total else None
+        return counters
+
+
+def load_fixtures(path: str = FIXTURE_PATH) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def train(
+    examples: Sequence[Dict], epochs: int = 3000, learning_rate: float = 0.5, l2: float = 0.01
+) -> List[float]:
+    """以批次梯度下降訓練邏輯迴歸（log loss，本身即為機率校準）"""
+    features = [extract_features(e["subject"], e["body"], e.get("sender", "")) for e in examples]
+    labels = [float(e["label"]) for e in examples]
+    weights = [0.0] * len(FEATURE_NAMES)
+
+    for _ in range(epochs):
+        predictions = score_matrix(features, weights)
+        gradient = [0.0] * len(weights)
+        for row, prediction, label in zip(features, predictions, labels):
+            error = prediction - label
+            for i, value in enumerate(row):
+                gradient[i] += error * value
+        for i in range(len(weights)):
+            penalty = l2 * weights[i] if i else 0.0
+            weights[i] -= learning_rate * (gradient[i] / len(features) + penalty)
+
+    return weights
+
+
+def _features(examples: Sequence[Dict]) -> List[List[float]]:
+    return [extract_features(e["subject"], e["body"], e.get("sender", "")) for e in examples]
+
+
+def evaluate(examples: Sequence[Dict], weights: Sequence[float], low: float, high: float) -> Dict:
+    """在訓練資料上評估（會高估效果，held-out 的結果見 _cross_validate）"""
+    features = _features(examples)
+    return _summary(examples, features, score_matrix(features, weights), low, high)
+
+
+def _summary(
+    examples: Sequence[Dict],
+    features: Sequence[Sequence[float]],
+    probabilities: Sequence[float],
+    low: float,
+    high: float,
+) -> Dict:
+    """統計本地就能決定的比例、這些決定的正確率、省下的 LLM 呼叫（只有 negative），
+    以及面試郵件沒有被本地 negative 擋掉的比例（interview_recall）"""
+    decided = correct = avoided = missed = 0
+    for row, probability, example in zip(features, probabilities, examples):
+        label = bool(example["label"])
+        if probability <= low and not has_interview_keyword(row):
+            decided += 1
+            avoided += 1
+            correct += int(not label)
+            missed += int(label)
+        elif probability >= high:
+            decided += 1
+            correct += int(label)
+
+    positives = sum(1 for e in examples if e["label"])
+    return {
+        "emails": len(examples),
+        "decided_locally": decided,
+        "local_accuracy": round(correct / decided, 3) if decided else None,
+        "llm_avoided": avoided,
+        "llm_avoided_rate": round(avoided / len(examples), 3),
+        "missed_interviews": missed,
+        "interview_recall": round(1 - missed / positives, 3) if positives else None,
+    }
+
+
+def _out_of_fold_probabilities(examples: List[Dict], folds: int) -> List[float]:
+    """k-fold：每封郵件的機率都由沒看過它的模型算出"""
+    features = _features(examples)
+    probabilities = [0.0] * len(examples)
+    for fold in range(folds):
+        train_set = [e for i, e in enumerate(examples) if i % folds != fold]
+        weights = train(train_set)
+        for i in range(fold, len(examples), folds):
+            probabilities[i] = score_matrix([features[i]], weights)[0]
+    return probabilities
+
+
+def _cross_validate(examples: List[Dict], folds: int, low: float, high: float) -> Dict:
+    """k-fold 交叉驗證，避免在訓練資料上評估而高估效果"""
+    return _summary(
+        examples, _features(examples), _out_of_fold_probabilities(examples, folds), low, high
+    )
+
+
+def calibrate_low(examples: List[Dict], folds: int = 5, margin: float = 0.5) -> float:
+    """以 held-out 機率找出不會把任何面試郵件判定為 negative 的 LOW 門檻
+
+    取會被本地判斷的面試郵件中最低的機率，再乘上 margin 保留餘裕
+    """
+    features = _features(examples)
+    probabilities = _out_of_fold_probabilities(examples, folds)
+    lowest_positive = min(
+        (
+            probability
+            for row, probability, example in zip(features, probabilities, examples)
+            if example["label"] and not has_interview_keyword(row)
+        ),
+        default=1.0,
+    )
+    return round(lowest_positive * margin, 3)
+
+
+local_classifier = LocalClassifier()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "evaluate"
+    fixtures = load_fixtures()
+
+    if command == "train":
+        trained = train(fixtures)
+        print("WEIGHTS = [")
+        for name, weight in zip(FEATURE_NAMES, trained):
+            print(f"    {weight:.4f},  # {name}")
+        print("]")
+    elif command == "calibrate":
+        print(f"LOCAL_CLASSIFIER_LOW = {calibrate_low(fixtures)}")
+    else:
+        low, high = local_classifier.low, local_classifier.high
+        print(f"不確定區間: ({low}, {high})")
+        print("內建權重（訓練資料）:", evaluate(fixtures, WEIGHTS, low, high))
+        print("5-fold 交叉驗證:", _cross_validate(fixtures, 5, low, high))
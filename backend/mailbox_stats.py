@@ -0,0 +1,126 @@
+"""每位用戶的信箱統計
+
+總郵件數、面試郵件數、已分析數與最新收信時間存在 user_mailbox_stats，
+由寫入郵件（insert_emails）與寫回分析結果（apply_email_analysis）時以增量更新，
+和郵件本身在同一個 transaction commit。讀取時只需一次主鍵查詢，不必 COUNT 整個信箱。
+
+python mailbox_stats.py repair [user_id]   從 emails 重新計算（不指定則全部用戶）
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy import case, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import Email, User, UserMailboxStats
+from database import get_db_session
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+def _ensure_row(db: Session, user_id: int):
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        db.execute(
+            insert(UserMailboxStats)
+            .values(user_id=user_id)
+            .on_conflict_do_nothing(index_elements=["user_id"])
+        )
+    elif db.get(UserMailboxStats, user_id) is None:
+        db.add(UserMailboxStats(user_id=user_id))
+        db.flush()
+
+
+def adjust_mailbox_stats(
+    db: Session,
+    user_id: int,
+    total: int = 0,
+    interview: int = 0,
+    processed: int = 0,
+    last_received_at: Optional[datetime] = None,
+):
+    """以增量更新統計（不 commit）；以資料庫端的加減計算，同時寫入也不會互相覆蓋"""
+    if not (total or interview or processed or last_received_at):
+        return
+    _ensure_row(db, user_id)
+
+    stats = UserMailboxStats
+    values = {
+        "total_emails": stats.total_emails + total,
+        "interview_emails": stats.interview_emails + interview,
+        "processed_emails": stats.processed_emails + processed,
+        "updated_at": datetime.utcnow(),
+    }
+    if last_received_at:
+        values["last_received_at"] = case(
+            (stats.last_received_at == None, last_received_at),
+            (stats.last_received_at < last_received_at, last_received_at),
+            else_=stats.last_received_at,
+        )
+    db.execute(
+        update(stats).where(stats.user_id == user_id).values(**values),
+        execution_options={"synchronize_session": False},
+    )
+
+
+def get_mailbox_stats(db: Session, user_id: int) -> Dict:
+    """讀取統計；還沒有任何郵件的用戶回傳 0"""
+    stats = db.get(UserMailboxStats, user_id)
+    return {
+        "total_emails": stats.total_emails if stats else 0,
+        "interview_emails": stats.interview_emails if stats else 0,
+        "processed_emails": stats.processed_emails if stats else 0,
+        "last_received_at": stats.last_received_at if stats else None,
+    }
+
+
+def recompute_mailbox_stats(db: Session, user_id: int = None) -> int:
+    """從 emails 重新計算統計並覆寫（不 commit），回傳更新的用戶數"""
+    query = db.query(
+        Email.user_id,
+        func.count(Email.id),
+        func.sum(case((Email.is_interview_related == True, 1), else_=0)),
+        func.sum(case((Email.is_processed == True, 1), else_=0)),
+        func.max(Email.received_at),
+    ).group_by(Email.user_id)
+    users = db.query(User.id)
+    if user_id is not None:
+        query = query.filter(Email.user_id == user_id)
+        users = users.filter(User.id == user_id)
+
+    counted = {row[0]: row[1:] for row in query}
+    now = datetime.utcnow()
+    updated = 0
+    for (uid,) in users:
+        total, interview, processed, last_received_at = counted.get(uid, (0, 0, 0, None))
+        stats = db.get(UserMailboxStats, uid) or UserMailboxStats(user_id=uid)
+        stats.total_emails = total
+        stats.interview_emails = interview or 0
+        stats.processed_emails = processed or 0
+        stats.last_received_at = last_received_at
+        stats.updated_at = now
+        db.add(stats)
+        updated += 1
+    return updated
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "repair":
+        print(__doc__)
+        sys.exit(1)
+
+    db = get_db_session()
+    try:
+        target = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        count = recompute_mailbox_stats(db, target)
+        db.commit()
+        print(f"已重新計算 {count} 位用戶的信箱統計")
+    finally:
+        db.close()
@@ -1,19 +1,38 @@
-from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi import BackgroundTasks, FastAPI, Request, Depends, HTTPException
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 import uvicorn
 import requests
 import urllib.parse
+from contextlib import aclosing
 from datetime import datetime, timedelta, timezone
 from config import config
 from models import User, Email, InterviewInvitation, DraftReply
-from database import create_tables, get_db
-from gmail_service import get_gmail_service
+from database import init_database, get_db, get_db_session
+from gmail_service import get_gmail_service, invalidate_gmail_service
+from email_store import (
+    apply_email_analysis,
+    body_storage_stats,
+    email_prompt_body,
+    set_email_body,
+    user_emails_page,
+    user_emails_query,
+)
+from sync_scheduler import sync_scheduler
+from token_manager import token_manager
 from openai_service import get_openai_service
+from analysis_cache import analysis_cache
+from local_classifier import local_classifier
+from llm_gateway import llm_gateway
+from language_detector import detect_language
+from mailbox_stats import get_mailbox_stats
+from email_search import search_emails
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+import json
 import logging
 import os
 
@@ -35,8 +54,23 @@ frontend_path = "/app/frontend"
 if os.path.exists(frontend_path):
     app.mount("/static", StaticFiles(directory=frontend_path), name="static")
 
-# 初始化資料庫
-create_tables()
+# 初始化資料庫（建立資料表並補上新欄位）
+init_database()
+
+
+@app.on_event("startup")
+def start_background_workers():
+    if config.TOKEN_REFRESH_ENABLED:
+        token_manager.start()
+    if config.SYNC_SCHEDULER_ENABLED:
+        sync_scheduler.start()
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    sync_scheduler.stop()
+    token_manager.stop()
+    analysis_cache.flush_hits()
 
 
 def create_oauth_url(scopes: list):
@@ -71,6 +105,19 @@ def exchange_code_for_token(code: str):
     raise Exception(f"Token exchange failed: {response.status_code}")
 
 
+def ensure_email_body(email: Email, db: Session):
+    """header-only 郵件在需要內容時才向 Gmail 補抓"""
+    if email.body_fetched is not False:
+        return
+
+    try:
+        gmail_service = get_gmail_service(email.user_id)
+        if gmail_service.fetch_email_body(email):
+            db.commit()
+    except Exception as e:
+        logger.error(f"Failed to fetch body for email {email.id}: {e}")
+
+
 @app.get("/")
 async def root():
     return {"message": "Interview Assistant API", "status": "ready"}
@@ -129,6 +176,8 @@ async def auth_callback(request: Request, db: Session = Depends(get_db)):
         db.add(user)
 
     db.commit()
+    # 新 token 生效，丟掉舊 token 建立的 Gmail service
+    invalidate_gmail_service(user.id)
     return RedirectResponse(f"/static/dashboard.html?success=true&user_id={user.id}")
 
 
@@ -161,11 +210,12 @@ async def get_user(user_id: int, db: Session = Depends(get_db)):
             "email": user.email,
             "name": user.name,
             "created_at": user.created_at,
-            "email_count": len(user.emails),
+            "email_count": get_mailbox_stats(db, user_id)["total_emails"],
         },
     }
 
 
+# 同步在背景 thread pool 執行，POST 立即回傳 job_id，前端以 GET /sync-jobs/{job_id} 查詢進度
 @app.post("/sync-emails/{user_id}")
 async def sync_emails(
     user_id: int, max_results: int = 50, db: Session = Depends(get_db)
@@ -175,29 +225,79 @@ async def sync_emails(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    gmail_service = get_gmail_service(user_id)
-    synced_count = gmail_service.sync_recent_emails(max_results)
+    # 同一用戶已有同步在跑時併入該工作；正在回填時排在回填之後
+    job, created = sync_scheduler.submit(user_id, max_results=max_results)
+
+    return {
+        "success": True,
+        "job_id": job.id,
+        "coalesced": not created,
+        "job": job.to_dict(),
+    }
+
+
+@app.post("/backfill-emails/{user_id}")
+async def backfill_emails(
+    user_id: int, max_pages: int = 1, db: Session = Depends(get_db)
+):
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    # 更新同步資訊
-    sync_type = "首次同步" if not user.last_sync_at else "增量同步"
+    job, created = sync_scheduler.submit(user_id, kind="backfill", max_pages=max_pages)
 
     return {
         "success": True,
-        "synced_count": synced_count,
-        "sync_type": sync_type,
-        "message": f"{sync_type}完成，新增 {synced_count} 封郵件",
+        "job_id": job.id,
+        "coalesced": not created,
+        "job": job.to_dict(),
     }
 
 
+@app.get("/sync-jobs/{job_id}")
+async def get_sync_job(job_id: int):
+    job = sync_scheduler.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+
+    return {"success": True, "job": job.to_dict()}
+
+
+@app.get("/sync-scheduler/status")
+async def get_sync_scheduler_status():
+    return {"success": True, "scheduler": sync_scheduler.status()}
+
+
+@app.get("/analysis-cache/stats")
+async def get_analysis_cache_stats():
+    return {"success": True, "stats": analysis_cache.stats()}
+
+
+@app.get("/llm-gateway/stats")
+async def get_llm_gateway_stats():
+    return {"success": True, "stats": llm_gateway.stats()}
+
+
+@app.get("/email-bodies/stats")
+async def get_email_body_stats(db: Session = Depends(get_db)):
+    return {"success": True, "stats": body_storage_stats(db)}
+
+
+@app.get("/local-classifier/stats")
+async def get_local_classifier_stats():
+    return {"success": True, "stats": local_classifier.stats()}
+
+
+# 以 cursor 分頁：回傳的 next_cursor 帶入下一次請求，為 null 表示沒有更多郵件
 @app.get("/emails/{user_id}")
-async def get_user_emails(user_id: int, limit: int = 10, db: Session = Depends(get_db)):
-    emails = (
-        db.query(Email)
-        .filter(Email.user_id == user_id)
-        .order_by(Email.received_at.desc())
-        .limit(limit)
-        .all()
-    )
+async def get_user_emails(
+    user_id: int, limit: int = 10, cursor: str = None, db: Session = Depends(get_db)
+):
+    limit = max(1, min(limit, config.EMAIL_PAGE_MAX_SIZE))
+    try:
+        emails, next_cursor = user_emails_page(db, user_id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
     return {
         "success": True,
@@ -208,12 +308,32 @@ async def get_user_emails(user_id: int, limit: int = 10, db: Session = Depends(g
                 "sender": email.sender,
                 "received_at": email.received_at,
                 "is_interview_related": email.is_interview_related,
-                "body_preview": email.body_text[:200] + "..."
-                if email.body_text and len(email.body_text) > 200
-                else email.body_text,
+                "body_preview": email.body_preview,
             }
             for email in emails
         ],
+        "next_cursor": next_cursor,
+    }
+
+
+# 全文搜尋，依相關程度排序；snippet 已 HTML escape，符合的文字以 <mark> 標示
+@app.get("/search-emails/{user_id}")
+async def search_user_emails(
+    user_id: int, q: str, limit: int = 20, offset: int = 0, db: Session = Depends(get_db)
+):
+    limit = max(1, min(limit, config.SEARCH_MAX_RESULTS))
+    try:
+        # 多取一筆判斷是否還有更多結果
+        results = search_emails(db, user_id, q, limit + 1, max(0, offset))
+    except Exception as e:
+        logger.error(f"Search failed for user {user_id}: {e}")
+        raise HTTPException(status_code=500, detail="Search failed")
+
+    return {
+        "success": True,
+        "query": q,
+        "results": results[:limit],
+        "has_more": len(results) > limit,
     }
 
 
@@ -234,12 +354,8 @@ async def gmail_status(user_id: int, db: Session = Depends(get_db)):
             token_expires_utc = user.token_expires_at
         token_expired = datetime.now(timezone.utc) > token_expires_utc
 
-    email_count = db.query(Email).filter(Email.user_id == user_id).count()
-    interview_count = (
-        db.query(Email)
-        .filter(Email.user_id == user_id, Email.is_interview_related == True)
-        .count()
-    )
+    mailbox_stats = get_mailbox_stats(db, user_id)
+    email_count = mailbox_stats["total_emails"]
 
     # 新增同步資訊
     sync_info = {
@@ -254,165 +370,296 @@ async def gmail_status(user_id: int, db: Session = Depends(get_db)):
         "email": user.email,
         "gmail_connected": has_token and not token_expired,
         "token_expired": token_expired,
-        "stats": {"total_emails": email_count, "interview_emails": interview_count},
+        "stats": {
+            "total_emails": email_count,
+            "interview_emails": mailbox_stats["interview_emails"],
+            "processed_emails": mailbox_stats["processed_emails"],
+            "last_received_at": mailbox_stats["last_received_at"],
+        },
         "sync_info": sync_info,
     }
 
 
-@app.post("/analyze-email/{email_id}")
-async def analyze_email(email_id: int, db: Session = Depends(get_db)):
-    email = db.query(Email).filter(Email.id == email_id).first()
-    if not email:
-        raise HTTPException(status_code=404, detail="Email not found")
+def invitation_to_info(invitation: InterviewInvitation) -> dict:
+    return {
+        "company_name": invitation.company_name,
+        "position": invitation.position,
+        "interview_date": str(invitation.interview_date.date())
+        if invitation.interview_date
+        else None,
+        "interview_time": invitation.interview_time,
+        "interview_location": invitation.interview_location,
+        "interview_type": invitation.interview_type,
+        "interviewer_name": invitation.interviewer_name,
+        "interviewer_email": invitation.interviewer_email,
+        "additional_info": invitation.additional_info,
+        "confidence_score": invitation.confidence_score,
+    }
+
+
+def run_email_analysis(email: Email, db: Session, use_cache: bool = True) -> dict:
+    """以單次 AI 呼叫分析郵件，並把分類、語言與面試資訊寫回資料庫
+
+    會同步等待 Gmail 與 OpenAI，async handler 要經由 run_in_threadpool 呼叫
+    """
+    ensure_email_body(email, db)
 
     openai_service = get_openai_service()
-    is_interview, confidence = openai_service.is_interview_email(
-        email.subject or "", email.body_text or ""
+    analysis = openai_service.analyze_email(
+        email.subject or "",
+        email_prompt_body(email),
+        use_cache=use_cache,
+        sender=email.sender or "",
     )
 
-    email.is_interview_related = is_interview
+    apply_email_analysis(db, email, analysis)
     db.commit()
+    return analysis
+
+
+def fetch_missing_bodies(user_id: int, emails: list):
+    """一次 batch 補抓多封 header-only 郵件的內容（由呼叫端 commit）"""
+    missing = {email.gmail_id: email for email in emails if email.body_fetched is False}
+    if not missing:
+        return
+
+    try:
+        gmail_service = get_gmail_service(user_id)
+        for message_data in gmail_service.get_messages_details_batch(list(missing)):
+            set_email_body(missing[message_data["gmail_id"]], message_data)
+    except Exception as e:
+        logger.error(f"Failed to fetch bodies for user {user_id}: {e}")
+
+
+# refresh=true 時略過快取，重新呼叫 AI
+@app.post("/analyze-email/{email_id}")
+async def analyze_email(
+    email_id: int, refresh: bool = False, db: Session = Depends(get_db)
+):
+    email = db.query(Email).filter(Email.id == email_id).first()
+    if not email:
+        raise HTTPException(status_code=404, detail="Email not found")
+
+    analysis = await run_in_threadpool(run_email_analysis, email, db, use_cache=not refresh)
 
     return {
         "success": True,
         "email_id": email_id,
         "subject": email.subject,
-        "is_interview": is_interview,
-        "confidence": confidence,
+        "is_interview": analysis["is_interview"],
+        "confidence": analysis["confidence"],
+        "language": analysis["language"],
+        "extracted_info": analysis["interview_info"],
     }
 
 
-@app.post("/extract-info/{email_id}")
-async def extract_interview_info(email_id: int, db: Session = Depends(get_db)):
-    email = db.query(Email).filter(Email.id == email_id).first()
-    if not email:
-        raise HTTPException(status_code=404, detail="Email not found")
+# 並行分析用戶所有尚未處理的郵件，結果在同一個 transaction 寫入
+@app.post("/analyze-emails/{user_id}")
+async def analyze_user_emails(
+    user_id: int, limit: int = 50, refresh: bool = False, db: Session = Depends(get_db)
+):
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    emails = (
+        user_emails_query(db, user_id)
+        .filter(Email.is_processed == False)
+        .options(selectinload(Email.body))
+        .limit(limit)
+        .all()
+    )
+    if not emails:
+        return {"success": True, "analyzed": 0, "failed": 0, "results": []}
+
+    await run_in_threadpool(fetch_missing_bodies, user_id, emails)
 
     openai_service = get_openai_service()
-    interview_info = openai_service.extract_interview_info(
-        email.subject or "", email.body_text or ""
+    analyses = await openai_service.analyze_emails_async(
+        [(email.subject or "", email_prompt_body(email), email.sender or "") for email in emails],
+        use_cache=not refresh,
     )
 
-    if not interview_info:
-        return JSONResponse(
-            {"success": False, "error": "extraction_failed"}, status_code=400
+    results = []
+    for email, analysis in zip(emails, analyses):
+        # 失敗的郵件維持未處理，下次批次分析會再試
+        if isinstance(analysis, Exception):
+            logger.error(f"Failed to analyze email {email.id}: {analysis}")
+            results.append({"email_id": email.id, "success": False, "error": str(analysis)})
+            continue
+
+        apply_email_analysis(db, email, analysis)
+        results.append(
+            {
+                "email_id": email.id,
+                "success": True,
+                "is_interview": analysis["is_interview"],
+                "confidence": analysis["confidence"],
+                "language": email.language,
+                "has_interview_info": bool(analysis["interview_info"]),
+            }
         )
 
-    existing_invitation = (
+    try:
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to save analysis results for user {user_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to save analysis results")
+
+    analyzed = sum(1 for result in results if result["success"])
+    return {
+        "success": True,
+        "analyzed": analyzed,
+        "failed": len(results) - analyzed,
+        "results": results,
+    }
+
+
+@app.post("/extract-info/{email_id}")
+async def extract_interview_info(
+    email_id: int, refresh: bool = False, db: Session = Depends(get_db)
+):
+    email = db.query(Email).filter(Email.id == email_id).first()
+    if not email:
+        raise HTTPException(status_code=404, detail="Email not found")
+
+    invitation = (
         db.query(InterviewInvitation)
         .filter(InterviewInvitation.email_id == email_id)
         .first()
     )
 
-    if existing_invitation:
-        for key, value in interview_info.items():
-            if key != "confidence_score" and value is not None:
-                setattr(existing_invitation, key, value)
-        existing_invitation.confidence_score = interview_info.get("confidence_score", 0)
-        invitation = existing_invitation
-    else:
-        invitation = InterviewInvitation(
-            email_id=email_id,
-            company_name=interview_info.get("company_name"),
-            position=interview_info.get("position"),
-            interview_time=interview_info.get("interview_time"),
-            interview_location=interview_info.get("interview_location"),
-            interview_type=interview_info.get("interview_type"),
-            interviewer_name=interview_info.get("interviewer_name"),
-            interviewer_email=interview_info.get("interviewer_email"),
-            additional_info=interview_info.get("additional_info"),
-            confidence_score=interview_info.get("confidence_score", 0),
+    # 已分析過的郵件直接使用儲存的結果，不再呼叫 AI
+    if refresh or (not invitation and not email.is_processed):
+        await run_in_threadpool(run_email_analysis, email, db, use_cache=not refresh)
+        invitation = (
+            db.query(InterviewInvitation)
+            .filter(InterviewInvitation.email_id == email_id)
+            .first()
         )
-        db.add(invitation)
 
-    db.commit()
-    return {"success": True, "email_id": email_id, "extracted_info": interview_info}
+    if not invitation:
+        return JSONResponse(
+            {"success": False, "error": "extraction_failed"}, status_code=400
+        )
 
+    return {
+        "success": True,
+        "email_id": email_id,
+        "extracted_info": invitation_to_info(invitation),
+    }
 
-@app.post("/generate-reply/{email_id}")
-async def generate_reply(
-    email_id: int, tone: str = "professional", db: Session = Depends(get_db)
-):
+
+def prepare_reply_context(email_id: int, db: Session):
+    """回傳 (email, invitation, auto_extracted, error)，無法生成回信時 error 為錯誤內容"""
     email = db.query(Email).filter(Email.id == email_id).first()
     if not email:
         raise HTTPException(status_code=404, detail="Email not found")
 
-    # 如果還沒有面試資訊，自動提取
+    # 如果還沒有面試資訊，自動分析（單次 AI 呼叫）
     invitation = (
         db.query(InterviewInvitation)
         .filter(InterviewInvitation.email_id == email_id)
         .first()
     )
+    auto_extracted = False
 
     if not invitation:
-        # 先分析是否為面試邀請
-        openai_service = get_openai_service()
-        is_interview, confidence = openai_service.is_interview_email(
-            email.subject or "", email.body_text or ""
+        if not email.is_processed:
+            run_email_analysis(email, db)
+            auto_extracted = True
+
+        if not email.is_interview_related:
+            return email, None, auto_extracted, {
+                "success": False,
+                "error": "not_interview",
+                "message": "這不是面試邀請郵件，無法生成回信",
+            }
+
+        invitation = (
+            db.query(InterviewInvitation)
+            .filter(InterviewInvitation.email_id == email_id)
+            .first()
         )
 
-        if not is_interview:
-            return JSONResponse(
-                {
-                    "success": False,
-                    "error": "not_interview",
-                    "message": "這不是面試邀請郵件，無法生成回信",
-                },
-                status_code=400,
-            )
+        if not invitation:
+            return email, None, auto_extracted, {
+                "success": False,
+                "error": "extraction_failed",
+                "message": "無法提取面試資訊，請手動分析郵件",
+            }
 
-        # 更新郵件狀態
-        email.is_interview_related = True
+    # 語言在寫入郵件時已偵測，舊資料在這裡補上一次
+    if not email.language:
+        email.language = detect_language(email.subject or "", email.body_text or "")
+        db.commit()
 
-        # 自動提取面試資訊
-        interview_info = openai_service.extract_interview_info(
-            email.subject or "", email.body_text or ""
-        )
+    return email, invitation, auto_extracted, None
 
-        if not interview_info:
-            return JSONResponse(
-                {
-                    "success": False,
-                    "error": "extraction_failed",
-                    "message": "無法提取面試資訊，請手動分析郵件",
-                },
-                status_code=400,
-            )
 
-        # 建立面試邀請記錄
-        invitation = InterviewInvitation(
-            email_id=email_id,
-            company_name=interview_info.get("company_name"),
-            position=interview_info.get("position"),
-            interview_time=interview_info.get("interview_time"),
-            interview_location=interview_info.get("interview_location"),
-            interview_type=interview_info.get("interview_type"),
-            interviewer_name=interview_info.get("interviewer_name"),
-            interviewer_email=interview_info.get("interviewer_email"),
-            additional_info=interview_info.get("additional_info"),
-            confidence_score=interview_info.get("confidence_score", 0),
-        )
-        db.add(invitation)
+def save_draft_reply(
+    db: Session, invitation_id: int, subject: str, body: str, tone: str, polish_status: str = None
+) -> DraftReply:
+    draft = DraftReply(
+        interview_invitation_id=invitation_id,
+        subject=subject,
+        body=body,
+        tone=tone,
+        polish_status=polish_status,
+    )
+    db.add(draft)
+    db.commit()
+    return draft
+
+
+def polish_draft_reply(draft_id: int, interview_info: dict, tone: str, language: str):
+    """背景工作：以 LLM 潤飾範本草稿，使用者已送出草稿時不覆蓋"""
+    db = get_db_session()
+    try:
+        draft = db.query(DraftReply).filter(DraftReply.id == draft_id).first()
+        if not draft or draft.polish_status != "pending":
+            return
+
+        polished = get_openai_service().polish_reply(draft.body, interview_info, tone, language)
+        db.refresh(draft)
+        if draft.is_sent:
+            draft.polish_status = None
+        elif polished:
+            draft.body = polished
+            draft.polish_status = "done"
+        else:
+            draft.polish_status = "failed"
         db.commit()
-        db.refresh(invitation)
+    except Exception as e:
+        logger.error(f"Failed to polish draft {draft_id}: {e}")
+    finally:
+        db.close()
+
+
+# 以範本立即生成回信；polish=true 時另在背景以 AI 潤飾，可用 /draft-replies/{id} 查詢結果
+@app.post("/generate-reply/{email_id}")
+async def generate_reply(
+    email_id: int,
+    background_tasks: BackgroundTasks,
+    tone: str = "professional",
+    polish: bool = False,
+    db: Session = Depends(get_db),
+):
+    email, invitation, auto_extracted, error = await run_in_threadpool(
+        prepare_reply_context, email_id, db
+    )
+    if error:
+        return JSONResponse(error, status_code=400)
 
     # 準備面試資訊
-    interview_info = {
-        "company_name": invitation.company_name,
-        "position": invitation.position,
-        "interview_date": str(invitation.interview_date)
-        if invitation.interview_date
-        else None,
-        "interview_time": invitation.interview_time,
-        "interview_location": invitation.interview_location,
-        "interview_type": invitation.interview_type,
-        "interviewer_name": invitation.interviewer_name,
-    }
+    interview_info = invitation_to_info(invitation)
 
-    # 生成回信
     openai_service = get_openai_service()
-    reply_body = openai_service.generate_reply(interview_info, tone)
-    reply_subject = openai_service.generate_reply_subject(email.subject or "")
+    reply_body = openai_service.generate_reply(interview_info, tone, email.language)
+    reply_subject = openai_service.generate_reply_subject(
+        email.subject or "", email.language
+    )
 
     if not reply_body:
         return JSONResponse(
@@ -421,27 +668,132 @@ async def generate_reply(
         )
 
     # 儲存草稿
-    draft = DraftReply(
-        interview_invitation_id=invitation.id,
-        subject=reply_subject,
-        body=reply_body,
-        tone=tone,
+    draft = save_draft_reply(
+        db, invitation.id, reply_subject, reply_body, tone, "pending" if polish else None
     )
-
-    db.add(draft)
-    db.commit()
+    if polish:
+        background_tasks.add_task(
+            polish_draft_reply, draft.id, interview_info, tone, email.language
+        )
 
     return {
         "success": True,
         "email_id": email_id,
+        "draft_id": draft.id,
         "subject": reply_subject,
         "body": reply_body,
         "tone": tone,
-        "auto_extracted": not invitation
-        or invitation.created_at == invitation.created_at,
+        "polish_status": draft.polish_status,
+        "auto_extracted": auto_extracted,
+    }
+
+
+@app.get("/draft-replies/{draft_id}")
+async def get_draft_reply(draft_id: int, db: Session = Depends(get_db)):
+    draft = db.query(DraftReply).filter(DraftReply.id == draft_id).first()
+    if not draft:
+        raise HTTPException(status_code=404, detail="Draft not found")
+
+    return {
+        "success": True,
+        "draft_id": draft.id,
+        "subject": draft.subject,
+        "body": draft.body,
+        "tone": draft.tone,
+        "polish_status": draft.polish_status,
+        "is_sent": draft.is_sent,
     }
 
 
+def sse_event(event: str, data: dict) -> str:
+    """組出一則 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+# 以 SSE 逐段回傳回信內容（範本草稿的 AI 潤飾版，與 /generate-reply?polish=true 相同），完成後才儲存草稿
+# 事件：meta（開始）、token（新的文字）、done（草稿已儲存）、error
+# 儀表板改用 /generate-reply（範本立即回傳、背景潤飾）；這個端點保留給要即時顯示
+# 模型輸出的 API 用戶端，例如以 EventSource 串接的外部前端或 curl -N 測試
+@app.get("/generate-reply-stream/{email_id}")
+async def generate_reply_stream(
+    email_id: int, request: Request, tone: str = "professional", db: Session = Depends(get_db)
+):
+    email, invitation, auto_extracted, error = await run_in_threadpool(
+        prepare_reply_context, email_id, db
+    )
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if error:
+        return StreamingResponse(
+            iter([sse_event("error", error)]), media_type="text/event-stream", headers=headers
+        )
+
+    interview_info = invitation_to_info(invitation)
+    invitation_id = invitation.id
+    original_subject = email.subject or ""
+    language = email.language
+
+    async def events():
+        openai_service = get_openai_service()
+        # 主旨以範本產生，開始串流時就先送出
+        reply_subject = openai_service.generate_reply_subject(original_subject, language)
+        chunks = []
+        try:
+            yield sse_event(
+                "meta",
+                {
+                    "email_id": email_id,
+                    "subject": reply_subject,
+                    "tone": tone,
+                    "auto_extracted": auto_extracted,
+                },
+            )
+
+            # 斷線時離開 async with 會立即關閉串流與上游連線，不留給 GC，避免繼續產生 token
+            async with aclosing(openai_service.stream_reply(interview_info, tone, language)) as stream:
+                async for text in stream:
+                    if await request.is_disconnected():
+                        logger.info(f"Client disconnected while streaming reply for email {email_id}")
+                        return
+                    chunks.append(text)
+                    yield sse_event("token", {"text": text})
+
+            reply_body = "".join(chunks).strip()
+            if not reply_body:
+                yield sse_event(
+                    "error",
+                    {"success": False, "error": "generation_failed", "message": "無法生成回信內容"},
+                )
+                return
+
+            draft_db = get_db_session()
+            try:
+                draft = save_draft_reply(draft_db, invitation_id, reply_subject, reply_body, tone)
+                draft_id = draft.id
+            finally:
+                draft_db.close()
+
+            yield sse_event(
+                "done",
+                {
+                    "success": True,
+                    "email_id": email_id,
+                    "draft_id": draft_id,
+                    "subject": reply_subject,
+                    "body": reply_body,
+                    "tone": tone,
+                    "auto_extracted": auto_extracted,
+                },
+            )
+        except Exception as e:
+            logger.error(f"Failed to stream reply for email {email_id}: {e}")
+            yield sse_event(
+                "error",
+                {"success": False, "error": "generation_failed", "message": "無法生成回信內容"},
+            )
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
 if __name__ == "__main__":
     print("Starting Interview Assistant API...")
     print("前端: /static/login.html")
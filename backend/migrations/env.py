@@ -0,0 +1,44 @@
+"""Alembic 執行環境
+
+init_database 會把已開啟的連線放在 config.attributes["connection"]；
+從命令列執行時則使用 database.py 建立的 engine。
+"""
+from alembic import context
+from models import Base
+
+config = context.config
+target_metadata = Base.metadata
+
+
+# 全文搜尋的資料表依資料庫而不同（FTS5 虛擬表或 tsvector），不在 models 中定義
+UNMANAGED_TABLE_PREFIX = "email_search"
+
+
+def include_name(name, type_, parent_names):
+    if type_ == "table":
+        return not name.startswith(UNMANAGED_TABLE_PREFIX)
+    return True
+
+
+def run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_name=include_name,
+        # SQLite 不支援大部分 ALTER TABLE，改以重建資料表的方式處理
+        render_as_batch=connection.dialect.name == "sqlite",
+        # 每個版本各自 commit，含 CONCURRENTLY 建索引的版本才能跳出 transaction
+        transaction_per_migration=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+connection = config.attributes.get("connection")
+if connection is not None:
+    run_migrations(connection)
+else:
+    from database import engine
+
+    with engine.connect() as connection:
+        run_migrations(connection)
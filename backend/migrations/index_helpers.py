@@ -0,0 +1,34 @@
+"""migration 共用的 PostgreSQL 索引工具
+
+CREATE INDEX CONCURRENTLY 失敗時會留下 INVALID 的索引：查詢不會使用它，但寫入仍要維護，
+IF NOT EXISTS 也會把它當成已存在而略過。這裡建立索引後一律檢查 pg_index.indisvalid。
+以下函式都要在 op.get_context().autocommit_block() 內呼叫。
+"""
+from alembic import op
+import sqlalchemy as sa
+import logging
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+
+def pg_index_valid(name: str):
+    """PostgreSQL 索引是否可用，不存在時回傳 None"""
+    return op.get_bind().execute(
+        sa.text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+        ),
+        {"name": name},
+    ).scalar()
+
+
+def create_index_concurrently(name: str, table: str, columns, unique: bool = False):
+    """以 CONCURRENTLY 建立索引；先刪除失敗留下的 INVALID 索引，建立後仍不可用時拋出例外"""
+    if pg_index_valid(name) is False:
+        logger.warning(f"Dropping invalid index {name} left by a failed build")
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    op.create_index(
+        name, table, columns, unique=unique, postgresql_concurrently=True, if_not_exists=True
+    )
+    if not pg_index_valid(name):
+        raise RuntimeError(f"Index {name} is not valid after CREATE INDEX CONCURRENTLY")
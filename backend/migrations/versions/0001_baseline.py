@@ -0,0 +1,176 @@
+"""baseline schema
+
+導入 migration 前的資料庫是由 create_all 建立、再以 ALTER TABLE 補欄位，
+各環境的結構不一定相同。這個版本只建立缺少的資料表與欄位，
+因此全新資料庫與舊資料庫都會升級到同一個起點。
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# 舊版 upgrade_database 逐一補上的欄位
+LEGACY_COLUMNS = [
+    ("users", sa.Column("last_sync_at", sa.DateTime())),
+    ("users", sa.Column("gmail_history_id", sa.String())),
+    ("users", sa.Column("backfill_page_token", sa.String())),
+    ("users", sa.Column("backfill_completed_at", sa.DateTime())),
+    ("emails", sa.Column("body_fetched", sa.Boolean(), server_default=sa.true())),
+    ("emails", sa.Column("language", sa.String())),
+    ("draft_replies", sa.Column("polish_status", sa.String())),
+]
+
+
+def _tables():
+    """(資料表, 欄位, [(索引名稱, 欄位, unique)])，依外鍵相依順序排列"""
+    return [
+        (
+            "users",
+            [
+                sa.Column("id", sa.Integer(), primary_key=True),
+                sa.Column("google_id", sa.String()),
+                sa.Column("email", sa.String()),
+                sa.Column("name", sa.String()),
+                sa.Column("access_token", sa.Text()),
+                sa.Column("refresh_token", sa.Text()),
+                sa.Column("token_expires_at", sa.DateTime()),
+                sa.Column("created_at", sa.DateTime()),
+                sa.Column("updated_at", sa.DateTime()),
+                sa.Column("last_sync_at", sa.DateTime()),
+                sa.Column("gmail_history_id", sa.String()),
+                sa.Column("backfill_page_token", sa.String()),
+                sa.Column("backfill_completed_at", sa.DateTime()),
+            ],
+            [
+                ("ix_users_id", ["id"], False),
+                ("ix_users_google_id", ["google_id"], True),
+                ("ix_users_email", ["email"], True),
+            ],
+        ),
+        (
+            "emails",
+            [
+                sa.Column("id", sa.Integer(), primary_key=True),
+                sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+                sa.Column("gmail_id", sa.String()),
+                sa.Column("thread_id", sa.String()),
+                sa.Column("subject", sa.String()),
+                sa.Column("sender", sa.String()),
+                sa.Column("recipient", sa.String()),
+                sa.Column("body_text", sa.Text()),
+                sa.Column("body_html", sa.Text()),
+                sa.Column("received_at", sa.DateTime()),
+                sa.Column("body_fetched", sa.Boolean()),
+                sa.Column("is_processed", sa.Boolean()),
+                sa.Column("is_interview_related", sa.Boolean()),
+                sa.Column("language", sa.String()),
+                sa.Column("created_at", sa.DateTime()),
+            ],
+            [
+                ("ix_emails_id", ["id"], False),
+                ("ix_emails_gmail_id", ["gmail_id"], True),
+            ],
+        ),
+        (
+            "interview_invitations",
+            [
+                sa.Column("id", sa.Integer(), primary_key=True),
+                sa.Column("email_id", sa.Integer(), sa.ForeignKey("emails.id")),
+                sa.Column("company_name", sa.String()),
+                sa.Column("position", sa.String()),
+                sa.Column("interview_date", sa.DateTime()),
+                sa.Column("interview_time", sa.String()),
+                sa.Column("interview_location", sa.String()),
+                sa.Column("interview_type", sa.String()),
+                sa.Column("interviewer_name", sa.String()),
+                sa.Column("interviewer_email", sa.String()),
+                sa.Column("additional_info", sa.Text()),
+                sa.Column("confidence_score", sa.Integer()),
+                sa.Column("created_at", sa.DateTime()),
+            ],
+            [("ix_interview_invitations_id", ["id"], False)],
+        ),
+        (
+            "draft_replies",
+            [
+                sa.Column("id", sa.Integer(), primary_key=True),
+                sa.Column(
+                    "interview_invitation_id",
+                    sa.Integer(),
+                    sa.ForeignKey("interview_invitations.id"),
+                ),
+                sa.Column("subject", sa.String()),
+                sa.Column("body", sa.Text()),
+                sa.Column("tone", sa.String()),
+                sa.Column("polish_status", sa.String()),
+                sa.Column("is_sent", sa.Boolean()),
+                sa.Column("sent_at", sa.DateTime()),
+                sa.Column("created_at", sa.DateTime()),
+            ],
+            [("ix_draft_replies_id", ["id"], False)],
+        ),
+        (
+            "analysis_cache",
+            [
+                sa.Column("cache_key", sa.String(64), primary_key=True),
+                sa.Column("kind", sa.String()),
+                sa.Column("model", sa.String()),
+                sa.Column("result", sa.Text()),
+                sa.Column("hit_count", sa.Integer()),
+                sa.Column("created_at", sa.DateTime()),
+                sa.Column("last_accessed_at", sa.DateTime()),
+            ],
+            [("ix_analysis_cache_last_accessed_at", ["last_accessed_at"], False)],
+        ),
+        (
+            "analysis_batches",
+            [
+                sa.Column("id", sa.Integer(), primary_key=True),
+                sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+                sa.Column("transport", sa.String()),
+                sa.Column("batch_id", sa.String()),
+                sa.Column("status", sa.String()),
+                sa.Column("input_file", sa.String()),
+                sa.Column("email_ids", sa.Text()),
+                sa.Column("request_count", sa.Integer()),
+                sa.Column("succeeded_count", sa.Integer()),
+                sa.Column("failed_count", sa.Integer()),
+                sa.Column("error", sa.Text()),
+                sa.Column("created_at", sa.DateTime()),
+                sa.Column("completed_at", sa.DateTime()),
+            ],
+            [
+                ("ix_analysis_batches_id", ["id"], False),
+                ("ix_analysis_batches_user_id", ["user_id"], False),
+            ],
+        ),
+    ]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = set(inspector.get_table_names())
+
+    for table, columns, indexes in _tables():
+        if table in existing:
+            # 舊資料庫：只補上缺少的欄位
+            present = {column["name"] for column in inspector.get_columns(table)}
+            for legacy_table, column in LEGACY_COLUMNS:
+                if legacy_table == table and column.name not in present:
+                    op.add_column(table, column)
+            continue
+        op.create_table(table, *columns)
+        for name, index_columns, unique in indexes:
+            op.create_index(name, table, index_columns, unique=unique)
+
+
+def downgrade():
+    for table, _, _ in reversed(_tables()):
+        op.drop_table(table)
@@ -0,0 +1,74 @@
+"""hot path indexes
+
+- emails (user_id, received_at)：/emails 依收信時間分頁
+- emails (user_id, is_interview_related)：gmail_status 的面試郵件計數
+- interview_invitations.email_id 唯一：每封郵件只有一筆面試資訊，
+  建立前先合併重複的記錄
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+from migrations.index_helpers import create_index_concurrently
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_emails_user_received", "emails", ["user_id", "received_at"], False),
+    ("ix_emails_user_interview", "emails", ["user_id", "is_interview_related"], False),
+    ("ix_interview_invitations_email_id", "interview_invitations", ["email_id"], True),
+]
+
+# save_interview_invitation 一直更新的是最早的那筆，保留它並把草稿改指過去
+KEPT_INVITATIONS = (
+    "SELECT MIN(id) FROM interview_invitations WHERE email_id IS NOT NULL GROUP BY email_id"
+)
+
+
+def _dedupe_invitations():
+    op.execute(
+        f"""
+        UPDATE draft_replies
+        SET interview_invitation_id = (
+            SELECT MIN(kept.id) FROM interview_invitations kept
+            WHERE kept.email_id = (
+                SELECT duplicate.email_id FROM interview_invitations duplicate
+                WHERE duplicate.id = draft_replies.interview_invitation_id
+            )
+        )
+        WHERE interview_invitation_id IN (
+            SELECT id FROM interview_invitations
+            WHERE email_id IS NOT NULL AND id NOT IN ({KEPT_INVITATIONS})
+        )
+        """
+    )
+    op.execute(
+        f"""
+        DELETE FROM interview_invitations
+        WHERE email_id IS NOT NULL AND id NOT IN ({KEPT_INVITATIONS})
+        """
+    )
+
+
+def upgrade():
+    _dedupe_invitations()
+
+    if op.get_bind().dialect.name == "postgresql":
+        # 建立索引時不鎖住寫入；CONCURRENTLY 不能在 transaction 內執行
+        with op.get_context().autocommit_block():
+            for name, table, columns, unique in INDEXES:
+                create_index_concurrently(name, table, columns, unique=unique)
+        return
+
+    for name, table, columns, unique in INDEXES:
+        op.create_index(name, table, columns, unique=unique, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,47 @@
+"""user mailbox stats
+
+每位用戶的信箱統計，建立後立即從 emails 回填。
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "user_mailbox_stats",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("total_emails", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("interview_emails", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("processed_emails", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("last_received_at", sa.DateTime()),
+        sa.Column("updated_at", sa.DateTime()),
+    )
+    op.execute(
+        """
+        INSERT INTO user_mailbox_stats
+            (user_id, total_emails, interview_emails, processed_emails, last_received_at, updated_at)
+        SELECT
+            user_id,
+            COUNT(*),
+            SUM(CASE WHEN is_interview_related THEN 1 ELSE 0 END),
+            SUM(CASE WHEN is_processed THEN 1 ELSE 0 END),
+            MAX(received_at),
+            CURRENT_TIMESTAMP
+        FROM emails
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+        """
+    )
+
+
+def downgrade():
+    op.drop_table("user_mailbox_stats")
@@ -0,0 +1,84 @@
+"""email list pagination
+
+- emails.body_preview：列表用的預覽文字，寫入時產生，這裡回填既有郵件
+- received_at 為空的舊郵件以 created_at 補上，cursor 分頁的排序才穩定
+- ix_emails_user_received 加上 id，(received_at, id) 的 cursor 條件可直接走索引
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from email_preprocess import html_to_text
+from migrations.index_helpers import create_index_concurrently
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+PREVIEW_LENGTH = 200
+PREVIEW_HTML_CHARS = 64 * 1024
+BACKFILL_BATCH_SIZE = 500
+
+
+def _preview(body_text, body_html):
+    text = body_text or ""
+    if not text.strip() and body_html:
+        text = html_to_text(body_html[:PREVIEW_HTML_CHARS])
+    text = " ".join(text.split())
+    if not text:
+        return None
+    return text[:PREVIEW_LENGTH] + "..." if len(text) > PREVIEW_LENGTH else text
+
+
+def _backfill_previews():
+    """依 id 分批讀取內容產生預覽，不一次載入所有郵件"""
+    bind = op.get_bind()
+    select = sa.text(
+        "SELECT id, body_text, body_html FROM emails WHERE id > :last_id ORDER BY id LIMIT :limit"
+    )
+    update = sa.text("UPDATE emails SET body_preview = :preview WHERE id = :id")
+    last_id = 0
+    while True:
+        rows = bind.execute(select, {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        previews = [
+            {"id": row.id, "preview": _preview(row.body_text, row.body_html)} for row in rows
+        ]
+        previews = [item for item in previews if item["preview"]]
+        if previews:
+            bind.execute(update, previews)
+        last_id = rows[-1].id
+
+
+def _replace_index(columns):
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.drop_index(
+                "ix_emails_user_received", table_name="emails",
+                postgresql_concurrently=True, if_exists=True,
+            )
+            create_index_concurrently("ix_emails_user_received", "emails", columns)
+        return
+    op.drop_index("ix_emails_user_received", table_name="emails")
+    op.create_index("ix_emails_user_received", "emails", columns)
+
+
+def upgrade():
+    op.execute(
+        "UPDATE emails SET received_at = COALESCE(created_at, CURRENT_TIMESTAMP) "
+        "WHERE received_at IS NULL"
+    )
+    op.add_column("emails", sa.Column("body_preview", sa.String()))
+    _backfill_previews()
+    _replace_index(["user_id", "received_at", "id"])
+
+
+def downgrade():
+    _replace_index(["user_id", "received_at"])
+    with op.batch_alter_table("emails") as batch:
+        batch.drop_column("body_preview")
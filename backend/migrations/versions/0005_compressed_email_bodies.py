@@ -0,0 +1,128 @@
+"""compressed email bodies
+
+把 emails.body_text / body_html 以 zlib 壓縮後搬到 email_bodies，再移除原本的欄位。
+依 id 分批讀寫，不會一次載入所有郵件；完成後記錄壓縮前後的大小。
+
+移除欄位後空間不會立即釋放：SQLite 需要 VACUUM，PostgreSQL 需要 VACUUM FULL
+（或 pg_repack）才會把空間還給檔案系統。
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+import logging
+import zlib
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+BATCH_SIZE = 500
+ZLIB_LEVEL = 6
+
+
+def _compress(text):
+    return zlib.compress(text.encode("utf-8"), ZLIB_LEVEL) if text is not None else None
+
+
+def _size(text):
+    return len(text.encode("utf-8")) if text else 0
+
+
+def _move_bodies():
+    bind = op.get_bind()
+    select = sa.text(
+        "SELECT id, body_text, body_html FROM emails "
+        "WHERE id > :last_id ORDER BY id LIMIT :limit"
+    )
+    insert = sa.text(
+        "INSERT INTO email_bodies (email_id, compression, text_data, html_data, raw_size) "
+        "VALUES (:email_id, 'zlib', :text_data, :html_data, :raw_size)"
+    ).bindparams(
+        sa.bindparam("text_data", type_=sa.LargeBinary),
+        sa.bindparam("html_data", type_=sa.LargeBinary),
+    )
+
+    last_id = moved = raw_total = stored_total = 0
+    while True:
+        rows = bind.execute(select, {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        bodies = []
+        for row in rows:
+            if not (row.body_text or row.body_html):
+                continue
+            body = {
+                "email_id": row.id,
+                "text_data": _compress(row.body_text),
+                "html_data": _compress(row.body_html),
+                "raw_size": _size(row.body_text) + _size(row.body_html),
+            }
+            raw_total += body["raw_size"]
+            stored_total += sum(len(body[key] or b"") for key in ("text_data", "html_data"))
+            bodies.append(body)
+        if bodies:
+            bind.execute(insert, bodies)
+        moved += len(bodies)
+        last_id = rows[-1].id
+        logger.info(f"Compressed {moved} email bodies (up to email {last_id})")
+
+    if raw_total:
+        logger.info(
+            f"Email bodies: {raw_total / 1024 / 1024:.1f} MB -> {stored_total / 1024 / 1024:.1f} MB "
+            f"({1 - stored_total / raw_total:.0%} smaller) across {moved} emails"
+        )
+
+
+def upgrade():
+    op.create_table(
+        "email_bodies",
+        sa.Column("email_id", sa.Integer(), sa.ForeignKey("emails.id"), primary_key=True),
+        sa.Column("compression", sa.String(), nullable=False),
+        sa.Column("text_data", sa.LargeBinary()),
+        sa.Column("html_data", sa.LargeBinary()),
+        sa.Column("raw_size", sa.Integer()),
+    )
+    _move_bodies()
+    with op.batch_alter_table("emails") as batch:
+        batch.drop_column("body_text")
+        batch.drop_column("body_html")
+
+
+def downgrade():
+    with op.batch_alter_table("emails") as batch:
+        batch.add_column(sa.Column("body_text", sa.Text()))
+        batch.add_column(sa.Column("body_html", sa.Text()))
+
+    bind = op.get_bind()
+    select = sa.text(
+        "SELECT email_id, compression, text_data, html_data FROM email_bodies "
+        "WHERE email_id > :last_id ORDER BY email_id LIMIT :limit"
+    )
+    update = sa.text("UPDATE emails SET body_text = :body_text, body_html = :body_html WHERE id = :id")
+    last_id = 0
+    while True:
+        rows = bind.execute(select, {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            if row.compression != "zlib":
+                raise RuntimeError(f"Cannot downgrade {row.compression}-compressed body {row.email_id}")
+        bind.execute(
+            update,
+            [
+                {
+                    "id": row.email_id,
+                    "body_text": zlib.decompress(row.text_data).decode("utf-8") if row.text_data else None,
+                    "body_html": zlib.decompress(row.html_data).decode("utf-8") if row.html_data else None,
+                }
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].email_id
+    op.drop_table("email_bodies")
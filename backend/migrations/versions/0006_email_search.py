@@ -0,0 +1,52 @@
+"""email full-text search
+
+SQLite：FTS5 虛擬表，rank 設為加權的 bm25。
+PostgreSQL：tsvector 欄位加 GIN 索引，以 user_id 限定範圍。
+兩者都不在 models 中定義（migrations/env.py 會略過），建立後立即為既有郵件建立索引。
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from email_search import SQLITE_RANK, rebuild_search_index
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            """
+            CREATE TABLE email_search (
+                email_id INTEGER PRIMARY KEY REFERENCES emails (id),
+                user_id INTEGER NOT NULL,
+                document TSVECTOR NOT NULL
+            )
+            """
+        )
+        op.create_index("ix_email_search_user_id", "email_search", ["user_id"])
+        op.create_index(
+            "ix_email_search_document", "email_search", ["document"], postgresql_using="gin"
+        )
+    else:
+        op.execute(
+            "CREATE VIRTUAL TABLE email_search USING fts5("
+            "owner, subject, sender, body, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        op.execute(
+            sa.text("INSERT INTO email_search (email_search, rank) VALUES ('rank', :rank)").bindparams(
+                rank=SQLITE_RANK
+            )
+        )
+
+    rebuild_search_index(op.get_bind())
+
+
+def downgrade():
+    op.execute("DROP TABLE email_search")
@@ -0,0 +1,93 @@
+import base64
+import codecs
+import re
+from functools import lru_cache
+from typing import Dict
+from config import config
+
+# 需要保留的 MIME 類型
+PART_TYPES = {
+    "text/plain": "plain",
+    "text/html": "html",
+    "text/calendar": "calendar",
+}
+
+_CHARSET_RE = re.compile(r'charset\s*=\s*"?([^";\s]+)"?', re.IGNORECASE)
+
+
+@lru_cache(maxsize=64)
+def _lookup_codec(charset: str) -> str:
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return "utf-8"
+
+
+def _read_headers(part: Dict):
+    """一次掃過 header，回傳 (是否為附件, codec)"""
+    content_type = ""
+    disposition = ""
+    for header in part.get("headers") or ():
+        name = header.get("name", "").lower()
+        if name == "content-type":
+            content_type = header.get("value", "")
+        elif name == "content-disposition":
+            disposition = header.get("value", "")
+
+    # 有檔名或 Content-Disposition: attachment 的 part 視為附件
+    is_attachment = bool(part.get("filename")) or disposition.lower().startswith(
+        "attachment"
+    )
+
+    # 無法辨識 charset 時使用 utf-8
+    match = _CHARSET_RE.search(content_type)
+    codec = _lookup_codec(match.group(1).lower()) if match else "utf-8"
+    return is_attachment, codec
+
+
+def _decode_data(data: str, codec: str, max_bytes: int) -> str:
+    """base64url 解碼並轉成文字，超過 max_bytes 的部分不解碼"""
+    # 每 4 個 base64 字元對應 3 個 byte，只截取需要的長度
+    max_chars = -(-max_bytes // 3) * 4
+    if len(data) > max_chars:
+        data = data[:max_chars]
+    else:
+        data += "=" * (-len(data) % 4)
+
+    raw = base64.urlsafe_b64decode(data)[:max_bytes]
+    return raw.decode(codec, errors="ignore")
+
+
+def extract_parts(payload: Dict, max_bytes: int = None) -> Dict[str, str]:
+    """走訪 Gmail payload 的 MIME 樹，回傳 {"plain", "html", "calendar"} 中找到的內容
+
+    - 以堆疊迭代，不遞迴；每個類型只取文件順序中的第一個 part
+    - 每個 part 只解碼一次，並依其 charset 轉成文字
+    - 附件一律略過，內容超過 max_bytes 的部分直接截斷
+    """
+    max_bytes = max_bytes or config.GMAIL_MAX_BODY_BYTES
+    parts = {}
+    stack = [payload]
+
+    while stack and len(parts) < len(PART_TYPES):
+        part = stack.pop()
+
+        children = part.get("parts")
+        if children:
+            # 反向放入堆疊，才會依文件順序處理
+            stack.extend(reversed(children))
+            continue
+
+        kind = PART_TYPES.get((part.get("mimeType") or "").lower())
+        if not kind or kind in parts:
+            continue
+
+        data = (part.get("body") or {}).get("data")
+        if not data:
+            continue
+
+        is_attachment, codec = _read_headers(part)
+        if not is_attachment:
+            parts[kind] = _decode_data(data, codec, max_bytes)
+
+    return parts
@@ -6,10 +6,13 @@ from sqlalchemy import (
     DateTime,
     Boolean,
     ForeignKey,
+    Index,
+    LargeBinary,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
+from email_compression import compress_text, decompress_text
 
 # 只保留模型定義，移除重複的資料庫引擎設定
 # 資料庫配置都由 database.py 統一管理
@@ -31,6 +34,9 @@ class User(Base):
 
     # 同步狀態追蹤
     last_sync_at = Column(DateTime)
+    gmail_history_id = Column(String)  # 上次同步時的 mailbox historyId
+    backfill_page_token = Column(String)  # 回填進度（Gmail list 的 nextPageToken）
+    backfill_completed_at = Column(DateTime)
 
     emails = relationship("Email", back_populates="user")
 
@@ -45,24 +51,83 @@ class Email(Base):
     subject = Column(String)
     sender = Column(String)
     recipient = Column(String)
-    body_text = Column(Text)
-    body_html = Column(Text)
+    body_preview = Column(String)  # 列表用的前 200 字，寫入時產生
     received_at = Column(DateTime)
+    body_fetched = Column(Boolean, default=True)  # False 表示只存了 header，內容之後再抓
     is_processed = Column(Boolean, default=False)
     is_interview_related = Column(Boolean, default=False)
+    language = Column(String)  # chinese, english
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="emails")
     interview_invitation = relationship(
         "InterviewInvitation", back_populates="email", uselist=False
     )
+    # 內容另存在 email_bodies，只有存取 body_text / body_html 時才載入
+    body = relationship(
+        "EmailBody", back_populates="email", uselist=False, cascade="all, delete-orphan"
+    )
+
+    @property
+    def body_text(self):
+        return self.body.text if self.body else None
+
+    @body_text.setter
+    def body_text(self, value):
+        self.set_body(value, self.body_html)
+
+    @property
+    def body_html(self):
+        return self.body.html if self.body else None
+
+    @body_html.setter
+    def body_html(self, value):
+        self.set_body(self.body_text, value)
+
+    def set_body(self, body_text, body_html):
+        if self.body is None:
+            self.body = EmailBody()
+        self.body.set_content(body_text, body_html)
+
+    # 由 migration 建立，名稱需與 migrations/versions 一致
+    __table_args__ = (
+        Index("ix_emails_user_received", "user_id", "received_at", "id"),
+        Index("ix_emails_user_interview", "user_id", "is_interview_related"),
+    )
+
+
+class EmailBody(Base):
+    """壓縮後的郵件內容（email_compression.py）"""
+
+    __tablename__ = "email_bodies"
+
+    email_id = Column(Integer, ForeignKey("emails.id"), primary_key=True)
+    compression = Column(String, nullable=False)  # zlib, zstd
+    text_data = Column(LargeBinary)
+    html_data = Column(LargeBinary)
+    raw_size = Column(Integer, default=0)  # 壓縮前的 UTF-8 位元組數
+
+    email = relationship("Email", back_populates="body")
+
+    @property
+    def text(self):
+        return decompress_text(self.text_data, self.compression)
+
+    @property
+    def html(self):
+        return decompress_text(self.html_data, self.compression)
+
+    def set_content(self, body_text, body_html):
+        self.text_data, self.compression = compress_text(body_text)
+        self.html_data, _ = compress_text(body_html, self.compression)
+        self.raw_size = sum(len(part.encode("utf-8")) for part in (body_text, body_html) if part)
 
 
 class InterviewInvitation(Base):
     __tablename__ = "interview_invitations"
 
     id = Column(Integer, primary_key=True, index=True)
-    email_id = Column(Integer, ForeignKey("emails.id"))
+    email_id = Column(Integer, ForeignKey("emails.id"), unique=True, index=True)
     company_name = Column(String)
     position = Column(String)
     interview_date = Column(DateTime)
@@ -87,6 +152,7 @@ class DraftReply(Base):
     subject = Column(String)
     body = Column(Text)
     tone = Column(String)  # professional, friendly, formal
+    polish_status = Column(String)  # None 表示未要求潤飾；pending, done, failed
     is_sent = Column(Boolean, default=False)
     sent_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -95,3 +161,50 @@ class DraftReply(Base):
         "InterviewInvitation", back_populates="draft_replies"
     )
 
+
+
+class UserMailboxStats(Base):
+    """每位用戶的信箱統計，寫入郵件與分析結果時增量更新（mailbox_stats.py）"""
+
+    __tablename__ = "user_mailbox_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_emails = Column(Integer, nullable=False, default=0, server_default="0")
+    interview_emails = Column(Integer, nullable=False, default=0, server_default="0")
+    processed_emails = Column(Integer, nullable=False, default=0, server_default="0")
+    last_received_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class AnalysisCache(Base):
+    """OpenAI 分析結果快取，key 為 (model, prompt 版本, 主旨, 內容) 的雜湊"""
+
+    __tablename__ = "analysis_cache"
+
+    cache_key = Column(String(64), primary_key=True)
+    kind = Column(String)  # analysis；classify, extract 為已移除的舊方法留下的項目
+    model = Column(String)
+    result = Column(Text)  # JSON
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class AnalysisBatch(Base):
+    """送出的離線批次分析工作"""
+
+    __tablename__ = "analysis_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    transport = Column(String)  # openai, local
+    batch_id = Column(String)  # transport 回傳的工作 ID
+    status = Column(String, default="submitted")  # submitted, completed, failed, ingested
+    input_file = Column(String)
+    email_ids = Column(Text)  # JSON，這個批次包含的郵件
+    request_count = Column(Integer, default=0)
+    succeeded_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime)
@@ -0,0 +1,433 @@
+"""離線批次分析
+
+信箱回填後可能有上千封尚未分析的郵件，逐封即時呼叫又慢又貴。這裡把分析請求
+寫成 JSONL 交給 OpenAI Batch API，完成後再把結果寫回 Email 與 InterviewInvitation。
+送出與查詢由 transport 負責，LocalBatchTransport 以本機檔案模擬整個流程。
+
+郵件分段讀取並逐行寫入輸入檔，單一檔案超過 Batch API 的上限
+（50,000 筆請求、200 MB）時拆成多個批次，每個批次送出後立即 commit。
+
+python openai_batch.py submit <user_id> [limit]   送出用戶尚未分析的郵件
+python openai_batch.py poll <batch 編號>          查詢一次，完成時寫回結果
+python openai_batch.py wait <batch 編號>          持續查詢直到完成
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from datetime import datetime
+from typing import Dict, List, Optional
+from openai import OpenAI
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session, selectinload
+from models import AnalysisBatch, Email
+from database import get_db_session
+from email_store import apply_email_analysis, email_prompt_body, user_emails_query
+from openai_service import get_openai_service
+from local_classifier import local_classifier
+from llm_gateway import llm_gateway
+from config import config
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Batch API 每個輸入檔最多 50,000 筆請求、200 MB，檔案大小保留一些餘裕
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_FILE_BYTES = 190 * 1024 * 1024
+# 送出時每次從資料庫讀取、寫回結果時每次處理的郵件數
+CHUNK_SIZE = 500
+
+
+def _read_jsonl(path: str) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _write_jsonl(path: str, lines: List[Dict]):
+    """先寫暫存檔再改名，避免讀到寫一半的檔案"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    os.replace(temp_path, path)
+
+
+class _BatchInput:
+    """逐行寫入的批次輸入檔，close 時才改名成正式檔名"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.email_ids = []
+        self.size = 0
+        self._file = open(path + ".tmp", "w", encoding="utf-8")
+
+    def fits(self, line: str, max_requests: int, max_bytes: int) -> bool:
+        """空檔案一定放得下，避免送出沒有請求的批次"""
+        if not self.email_ids:
+            return True
+        return len(self.email_ids) < max_requests and self.size + len(line.encode("utf-8")) <= max_bytes
+
+    def add(self, email_id: int, line: str):
+        self._file.write(line)
+        self.email_ids.append(email_id)
+        self.size += len(line.encode("utf-8"))
+
+    def close(self):
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class OpenAIBatchTransport:
+    """透過 OpenAI Files 與 Batches API 送出、查詢批次工作"""
+
+    name = "openai"
+
+    def __init__(self, client: OpenAI = None):
+        self.client = client or llm_gateway.client
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> str:
+        status = self.client.batches.retrieve(batch_id).status
+        # 逾時的批次仍有部分結果，寫回已完成的部分，其餘郵件留待下次
+        if status in ("completed", "expired"):
+            return "completed"
+        if status in ("failed", "cancelled"):
+            return "failed"
+        return "running"
+
+    def fetch_results(self, batch_id: str) -> List[Dict]:
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = self.client.files.content(file_id).text
+                lines.extend(json.loads(line) for line in content.splitlines() if line.strip())
+        return lines
+
+
+def _local_responder(request_body: Dict) -> str:
+    """本機模擬用的回應：以本地分類器判斷，不提取面試資訊"""
+    prompt = request_body["messages"][-1]["content"]
+    match = re.search(r"Subject: (.*?)\nContent: (.*)\n\nRespond", prompt, re.DOTALL)
+    subject, body = match.groups() if match else ("", prompt)
+    probability = local_classifier.predict(subject, body)
+    return json.dumps(
+        {
+            "is_interview": probability >= 0.5,
+            "confidence": round(max(probability, 1 - probability) * 100, 1),
+            "language": None,
+            "interview_info": None,
+        }
+    )
+
+
+class LocalBatchTransport:
+    """以本機檔案模擬 Batch API：submit 複製輸入檔，poll 時以 responder 產生輸出檔"""
+
+    name = "local"
+
+    def __init__(self, directory: str = None, responder=None):
+        self.directory = directory or config.OPENAI_BATCH_DIR
+        # responder(request_body) 回傳模型輸出的文字，拋出例外代表該筆請求失敗
+        self.responder = responder or _local_responder
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"local-{uuid.uuid4().hex[:12]}"
+        shutil.copyfile(input_path, self._path(batch_id, "input"))
+        return batch_id
+
+    def poll(self, batch_id: str) -> str:
+        if not os.path.exists(self._path(batch_id, "input")):
+            return "failed"
+        if not os.path.exists(self._path(batch_id, "output")):
+            self._run(batch_id)
+        return "completed"
+
+    def _run(self, batch_id: str):
+        output = []
+        for request in _read_jsonl(self._path(batch_id, "input")):
+            try:
+                content = self.responder(request["body"])
+                response = {
+                    "status_code": 200,
+                    "body": {"choices": [{"message": {"content": content}}]},
+                }
+                output.append({"custom_id": request["custom_id"], "response": response, "error": None})
+            except Exception as e:
+                output.append(
+                    {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+                )
+        _write_jsonl(self._path(batch_id, "output"), output)
+
+    def fetch_results(self, batch_id: str) -> List[Dict]:
+        return _read_jsonl(self._path(batch_id, "output"))
+
+
+def get_batch_transport(name: str = None):
+    """依名稱取得 transport，預設使用 config.OPENAI_BATCH_TRANSPORT"""
+    name = name or config.OPENAI_BATCH_TRANSPORT
+    if name == LocalBatchTransport.name:
+        return LocalBatchTransport()
+    if name == OpenAIBatchTransport.name:
+        return OpenAIBatchTransport()
+    raise ValueError(f"Unknown batch transport: {name}")
+
+
+def _custom_id(email_id: int) -> str:
+    return f"email-{email_id}"
+
+
+def _email_id(custom_id: str) -> Optional[int]:
+    prefix, _, value = (custom_id or "").partition("-")
+    return int(value) if prefix == "email" and value.isdigit() else None
+
+
+class BatchAnalyzer:
+    """把用戶尚未分析的郵件送出批次分析，完成後寫回資料庫"""
+
+    def __init__(
+        self,
+        transport=None,
+        openai_service=None,
+        work_dir: str = None,
+        max_requests: int = MAX_BATCH_REQUESTS,
+        max_file_bytes: int = MAX_BATCH_FILE_BYTES,
+    ):
+        self.transport = transport or get_batch_transport()
+        self.openai_service = openai_service or get_openai_service()
+        self.work_dir = work_dir or config.OPENAI_BATCH_DIR
+        self.max_requests = max_requests
+        self.max_file_bytes = max_file_bytes
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def _pending_email_ids(self, db: Session, user_id: int) -> set:
+        """已送出但還沒寫回結果的郵件，不重複送出"""
+        pending = set()
+        batches = db.query(AnalysisBatch.email_ids).filter(
+            AnalysisBatch.user_id == user_id, AnalysisBatch.status == "submitted"
+        )
+        for (email_ids,) in batches:
+            pending.update(json.loads(email_ids or "[]"))
+        return pending
+
+    def _unprocessed_chunks(self, db: Session, user_id: int, limit: int = None):
+        """分段讀取尚未分析、也還沒送出的郵件，每次回傳一段
+
+        每段是以 (received_at, id) 接續的獨立查詢，不保留開著的 cursor，呼叫端可以在段與段之間 commit
+        """
+        pending = self._pending_email_ids(db, user_id)
+        selected, last = 0, None
+        while limit is None or selected < limit:
+            query = (
+                user_emails_query(db, user_id)
+                .filter(Email.is_processed == False)
+                .options(selectinload(Email.body))
+            )
+            if last:
+                query = query.filter(tuple_(Email.received_at, Email.id) < tuple_(*last))
+            emails = query.limit(CHUNK_SIZE).all()
+            if not emails:
+                break
+            last = (emails[-1].received_at, emails[-1].id)
+
+            chunk = [email for email in emails if email.id not in pending]
+            if limit is not None:
+                chunk = chunk[: limit - selected]
+            selected += len(chunk)
+            if chunk:
+                yield chunk
+
+    def _submit_input(self, db: Session, user_id: int, batch_input: _BatchInput) -> AnalysisBatch:
+        """送出一個輸入檔並立即 commit，後面的批次送出失敗時已送出的批次仍有紀錄，不會重送"""
+        batch_input.close()
+        batch = AnalysisBatch(
+            user_id=user_id,
+            transport=self.transport.name,
+            batch_id=self.transport.submit(batch_input.path),
+            input_file=batch_input.path,
+            email_ids=json.dumps(batch_input.email_ids),
+            request_count=len(batch_input.email_ids),
+        )
+        db.add(batch)
+        db.commit()
+        return batch
+
+    def submit(
+        self, db: Session, user_id: int, limit: int = None, use_cache: bool = True
+    ) -> List[AnalysisBatch]:
+        """送出批次，本地分類器或快取能決定的郵件直接寫回
+
+        請求超過單一輸入檔的上限時拆成多個批次，回傳送出的批次；沒有需要送出的請求時回傳空列表
+        """
+        timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        batches, batch_input = [], None
+        resolved_count = request_count = 0
+
+        for emails in self._unprocessed_chunks(db, user_id, limit):
+            by_custom_id = {_custom_id(email.id): email for email in emails}
+            requests, resolved = self.openai_service.build_analysis_batch(
+                [
+                    (custom_id, email.subject or "", email_prompt_body(email), email.sender or "")
+                    for custom_id, email in by_custom_id.items()
+                ],
+                use_cache=use_cache,
+            )
+            for custom_id, analysis in resolved.items():
+                apply_email_analysis(db, by_custom_id[custom_id], analysis)
+            resolved_count += len(resolved)
+
+            for request in requests:
+                line = json.dumps(request, ensure_ascii=False) + "\n"
+                if batch_input and not batch_input.fits(line, self.max_requests, self.max_file_bytes):
+                    batches.append(self._submit_input(db, user_id, batch_input))
+                    batch_input = None
+                if batch_input is None:
+                    batch_input = _BatchInput(
+                        os.path.join(
+                            self.work_dir, f"analysis-{user_id}-{timestamp}-{len(batches) + 1}.jsonl"
+                        )
+                    )
+                batch_input.add(by_custom_id[request["custom_id"]].id, line)
+                request_count += 1
+
+        if batch_input:
+            batches.append(self._submit_input(db, user_id, batch_input))
+        db.commit()
+        logger.info(
+            f"Batch for user {user_id}: {resolved_count} resolved locally, "
+            f"{request_count} submitted in {len(batches)} batches"
+        )
+        return batches
+
+    def poll(self, db: Session, batch: AnalysisBatch) -> str:
+        """查詢一次狀態，完成時寫回結果，回傳 batch.status"""
+        if batch.status != "submitted":
+            return batch.status
+
+        status = self.transport.poll(batch.batch_id)
+        if status == "completed":
+            self.ingest(db, batch)
+        elif status == "failed":
+            batch.status = "failed"
+            batch.error = "batch failed or was cancelled"
+            batch.completed_at = datetime.utcnow()
+            db.commit()
+        return batch.status
+
+    def ingest(self, db: Session, batch: AnalysisBatch):
+        """把批次結果分段寫回郵件，單筆失敗的郵件維持未處理；快取在 commit 後才寫入"""
+        email_ids = set(json.loads(batch.email_ids or "[]"))
+        lines = self.transport.fetch_results(batch.batch_id)
+
+        succeeded = failed = 0
+        cache_entries = []
+        for start in range(0, len(lines), CHUNK_SIZE):
+            chunk = lines[start : start + CHUNK_SIZE]
+            chunk_ids = [_email_id(line.get("custom_id")) for line in chunk]
+            emails = {
+                email.id: email
+                for email in db.query(Email)
+                .filter(Email.id.in_([email_id for email_id in chunk_ids if email_id in email_ids]))
+                .options(selectinload(Email.body))
+            }
+            for email_id, line in zip(chunk_ids, chunk):
+                email = emails.get(email_id)
+                # 等待期間已被即時分析處理過的郵件不覆蓋
+                if not email or email.is_processed:
+                    continue
+                try:
+                    analysis = self.openai_service.parse_analysis_batch_result(line)
+                except Exception as e:
+                    logger.error(f"Batch result for email {email.id} failed: {e}")
+                    failed += 1
+                    continue
+                apply_email_analysis(db, email, analysis)
+                cache_entries.append((email.subject or "", email_prompt_body(email), analysis))
+                succeeded += 1
+
+        batch.status = "ingested"
+        batch.succeeded_count = succeeded
+        batch.failed_count = failed
+        batch.completed_at = datetime.utcnow()
+        db.commit()
+        self.openai_service.cache_analyses(cache_entries)
+        logger.info(f"Batch {batch.id} ingested: {succeeded} succeeded, {failed} failed")
+
+    def wait(
+        self, db: Session, batch: AnalysisBatch, interval: float = 60, timeout: float = None
+    ) -> str:
+        """持續查詢直到完成或逾時"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while self.poll(db, batch) == "submitted":
+            if deadline and time.monotonic() >= deadline:
+                break
+            time.sleep(interval)
+        return batch.status
+
+
+def _print_batch(batch: AnalysisBatch):
+    print(
+        f"batch {batch.id} ({batch.transport} {batch.batch_id}): {batch.status}, "
+        f"{batch.request_count} requests, {batch.succeeded_count} succeeded, "
+        f"{batch.failed_count} failed"
+    )
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="離線批次分析")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="送出用戶尚未分析的郵件")
+    submit.add_argument("user_id", type=int)
+    submit.add_argument("limit", type=int, nargs="?", help="最多處理幾封郵件")
+    for name, help_text in (("poll", "查詢一次，完成時寫回結果"), ("wait", "持續查詢直到完成")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("batch", type=int, help="analysis_batches 的編號")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = _parse_args()
+    db = get_db_session()
+    try:
+        if args.command == "submit":
+            batches = BatchAnalyzer().submit(db, args.user_id, limit=args.limit)
+            for batch in batches:
+                _print_batch(batch)
+            if not batches:
+                print("沒有需要送出的郵件")
+        else:
+            batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == args.batch).first()
+            if not batch:
+                print(f"找不到批次 {args.batch}")
+                sys.exit(1)
+            analyzer = BatchAnalyzer(transport=get_batch_transport(batch.transport))
+            if args.command == "wait":
+                analyzer.wait(db, batch)
+            else:
+                analyzer.poll(db, batch)
+            _print_batch(batch)
+    finally:
+        db.close()
@@ -1,13 +1,24 @@
 import os
 import json
-from openai import OpenAI
-from typing import Dict, Optional, Tuple
+import asyncio
+import threading
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import logging
 from dotenv import load_dotenv
+from analysis_cache import analysis_cache
+from local_classifier import local_classifier
+from language_detector import detect_language
+from email_preprocess import prepare_prompt_body
+from reply_templates import render_reply, render_subject
+from config import config
+from llm_gateway import llm_gateway
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# prompt 內容修改時要更新版本號，讓舊的快取結果失效
+ANALYSIS_PROMPT_VERSION = "analysis-v2"
+
 
 class OpenAIService:
     def __init__(self, api_key: str = None):
@@ -15,200 +26,321 @@ class OpenAIService:
         if not self.api_key:
             raise ValueError("OpenAI API key not found")
 
-        self.client = OpenAI(api_key=self.api_key)
         self.model = "gpt-4o-mini"
 
-    def detect_language(self, subject: str, body: str) -> str:
-        """檢測郵件主要語言"""
-        try:
-            prompt = f"""
-Analyze the following email and determine its primary language.
-
-Subject: {subject}
-Content: {body[:500]}
-
-Respond with only one word: "chinese" or "english"
-"""
-
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a language detection expert.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.1,
-            )
-
-            result = response.choices[0].message.content.strip().lower()
-            return "chinese" if "chinese" in result else "english"
+    def _local_decision(self, subject: str, body: str, sender: str) -> Tuple[Optional[bool], float]:
+        """本地預分類，停用時一律交給 LLM"""
+        if not config.LOCAL_CLASSIFIER_ENABLED:
+            return None, 0
+        return local_classifier.classify(subject, body, sender)
+
+    def _analysis_precheck(self, subject: str, body: str, use_cache: bool, sender: str):
+        """回傳 (cache_key, 不需呼叫 LLM 的結果)，結果為 None 時才需要呼叫 LLM"""
+        return self._analysis_precheck_many([(subject, body, sender)], use_cache)[0]
+
+    def _analysis_precheck_many(
+        self, emails: List[Tuple[str, str, str]], use_cache: bool
+    ) -> List[Tuple[str, Optional[Dict]]]:
+        """批次版的 _analysis_precheck，emails 為 (subject, body, sender) 列表，快取只查詢一次
+
+        回傳與輸入同順序的 (cache_key, 不需呼叫 LLM 的結果)
+        """
+        checked = []
+        for subject, body, sender in emails:
+            # 本地就能確定不是面試邀請時不必呼叫 LLM；確定是面試時仍需要 LLM 提取資訊
+            decision, confidence = self._local_decision(subject, body, sender)
+            cache_key = analysis_cache.make_key(self.model, ANALYSIS_PROMPT_VERSION, subject, body)
+            result = None
+            if decision is False:
+                result = {
+                    "is_interview": False,
+                    "confidence": confidence,
+                    "language": None,
+                    "interview_info": None,
+                }
+            checked.append((cache_key, result))
 
-        except Exception as e:
-            logger.error(f"Failed to detect language: {e}")
-            return "english"  # 預設英文
+        lookup = [cache_key for cache_key, result in checked if result is None]
+        if not use_cache:
+            analysis_cache.record_bypass(len(lookup))
+            return checked
+        cached = analysis_cache.get_many(lookup)
+        return [(cache_key, result or cached.get(cache_key)) for cache_key, result in checked]
 
-    def is_interview_email(self, subject: str, body: str) -> Tuple[bool, float]:
-        """判斷郵件是否為面試邀請"""
-        try:
-            prompt = f"""
-Analyze if the following email is an interview invitation.
+    def _analysis_request(self, subject: str, body: str) -> Dict:
+        """組出分析用的 chat completion 參數，同步與非同步呼叫共用"""
+        prompt = f"""
+Analyze the following email. Decide whether it is an interview invitation,
+detect its primary language, and if it is an interview invitation extract the interview details.
 
 Subject: {subject}
-Content: {body[:1500]}
+Content: {prepare_prompt_body(body, config.PROMPT_BODY_TOKEN_BUDGET, "analysis")}
 
-You must respond with EXACTLY this JSON format (no extra text):
+Respond with a JSON object in exactly this format:
 {{
     "is_interview": true or false,
     "confidence": number between 0-100,
-    "reason": "brief explanation"
+    "language": "chinese" or "english",
+    "interview_info": null or {{
+        "company_name": "company name or null",
+        "position": "job position or null",
+        "interview_date": "interview date in YYYY-MM-DD format or null",
+        "interview_time": "interview time or null",
+        "interview_location": "interview location or null",
+        "interview_type": "online or onsite or phone or null",
+        "interviewer_name": "interviewer name or null",
+        "interviewer_email": "interviewer email or null",
+        "additional_info": "other important information or null",
+        "confidence_score": number between 0-100
+    }}
 }}
 
-Criteria:
+Criteria for an interview invitation:
 - Contains interview-related keywords (interview, 面試, meeting, 會談, etc.)
 - Mentions time scheduling
 - From company HR or recruiter
 - Job position related content
+
+Important: Use null (not "null" string) for missing information.
+interview_info must be null when is_interview is false.
 """
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are a professional email analysis and information extraction expert. Always respond with valid JSON only.",
+                },
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": 0.1,
+            "response_format": {"type": "json_object"},
+        }
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a professional email analysis expert. Always respond with valid JSON only.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.1,
-            )
+    def _finish_analysis(self, response, cache_key: str) -> Dict:
+        result = self._parse_analysis(response.choices[0].message.content)
+        analysis_cache.put(cache_key, "analysis", self.model, result)
+        return result
+
+    def _parse_analysis(self, content: str) -> Dict:
+        content = content.strip()
+        logger.info(f"OpenAI analysis response: {content}")
+        return self._normalize_analysis(json.loads(content))
+
+    def _analysis_fallback(self, subject: str, body: str) -> Dict:
+        is_interview, confidence = self._keyword_fallback(subject, body)
+        return {
+            "is_interview": is_interview,
+            "confidence": confidence,
+            "language": None,
+            "interview_info": None,
+        }
+
+    def analyze_email(
+        self, subject: str, body: str, use_cache: bool = True, sender: str = ""
+    ) -> Dict:
+        """一次呼叫完成面試判斷、語言偵測與資訊提取
 
-            content = response.choices[0].message.content.strip()
-            logger.info(f"OpenAI raw response: {content}")
-
-            # 嘗試解析 JSON
-            try:
-                result = json.loads(content)
-                return result["is_interview"], result["confidence"]
-            except json.JSONDecodeError:
-                # 如果 JSON 解析失敗，嘗試提取關鍵字
-                logger.warning(f"JSON parse failed, using fallback: {content}")
-
-                # 簡單的關鍵字檢測作為備用
-                text_to_check = (subject + " " + body).lower()
-                interview_keywords = [
-                    "interview",
-                    "面試",
-                    "面談",
-                    "會面",
-                    "meeting",
-                    "討論",
-                    "chat",
-                    "talk",
-                ]
-
-                found_keywords = [
-                    kw for kw in interview_keywords if kw in text_to_check
-                ]
-                if found_keywords:
-                    return True, 70.0
-                else:
-                    return False, 30.0
+        回傳 {"is_interview", "confidence", "language", "interview_info"}，
+        不是面試邀請時 interview_info 為 None
+        """
+        cache_key, result = self._analysis_precheck(subject, body, use_cache, sender)
+        if result is not None:
+            return result
+
+        try:
+            response = llm_gateway.chat(
+                **self._analysis_request(subject, body)
+            )
+            return self._finish_analysis(response, cache_key)
 
         except Exception as e:
             logger.error(f"Failed to analyze email: {e}")
-            text_to_check = (subject + " " + body).lower()
-            interview_keywords = ["interview", "面試", "面談", "會面"]
-            if any(kw in text_to_check for kw in interview_keywords):
-                return True, 60.0
-            return False, 0
-
-    def extract_interview_info(self, subject: str, body: str) -> Optional[Dict]:
-        """從面試邀請中提取詳細資訊"""
-        try:
-            prompt = f"""
-Extract detailed information from the following interview invitation email.
+            return self._analysis_fallback(subject, body)
+
+    async def analyze_emails_async(
+        self,
+        emails: List[Tuple[str, str, str]],
+        use_cache: bool = True,
+        max_concurrency: int = None,
+    ) -> List:
+        """以非同步 client 並行分析多封郵件，emails 為 (subject, body, sender) 列表
+
+        回傳與輸入同順序的列表，每個元素是 analyze_email 格式的結果，
+        或該封郵件失敗時的 Exception（不以關鍵字結果代替，讓呼叫端可以之後重試）
+
+        本地分類、快取查詢與 prompt 前處理在 worker thread 中一次完成，
+        新的結果最後在同一個 transaction 寫入快取，event loop 上只等待 LLM 回應
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or config.OPENAI_MAX_CONCURRENCY)
+
+        def prepare() -> List[Tuple[str, Optional[Dict], Optional[Dict]]]:
+            checked = self._analysis_precheck_many(emails, use_cache)
+            return [
+                (cache_key, result, None if result is not None else self._analysis_request(subject, body))
+                for (subject, body, _), (cache_key, result) in zip(emails, checked)
+            ]
+
+        async def analyze_one(request: Dict) -> Dict:
+            async with semaphore:
+                response = await llm_gateway.achat(**request)
+            return self._parse_analysis(response.choices[0].message.content)
+
+        prepared = await asyncio.to_thread(prepare)
+        pending = [index for index, (_, result, _) in enumerate(prepared) if result is None]
+        analyses = await asyncio.gather(
+            *(analyze_one(prepared[index][2]) for index in pending), return_exceptions=True
+        )
 
-Subject: {subject}
-Content: {body}
+        results = [result for _, result, _ in prepared]
+        new_entries = []
+        for index, analysis in zip(pending, analyses):
+            results[index] = analysis
+            if not isinstance(analysis, Exception):
+                new_entries.append((prepared[index][0], "analysis", self.model, analysis))
+        await asyncio.to_thread(analysis_cache.put_many, new_entries)
+        return results
+
+    def build_analysis_batch(
+        self, emails: List[Tuple[str, str, str, str]], use_cache: bool = True
+    ) -> Tuple[List[Dict], Dict[str, Dict]]:
+        """把郵件轉成 Batch API 的 JSONL 請求，emails 為 (custom_id, subject, body, sender) 列表
+
+        回傳 (要送出的請求, 本地分類器或快取已能決定的結果)，後者以 custom_id 為 key
+        """
+        requests, resolved = [], {}
+        checked = self._analysis_precheck_many(
+            [(subject, body, sender) for _, subject, body, sender in emails], use_cache
+        )
+        for (custom_id, subject, body, sender), (_, result) in zip(emails, checked):
+            if result is not None:
+                resolved[custom_id] = result
+                continue
 
-You must respond with EXACTLY this JSON format (no extra text):
-{{
-    "company_name": "company name or null",
-    "position": "job position or null", 
-    "interview_date": "interview date in YYYY-MM-DD format or null",
-    "interview_time": "interview time or null",
-    "interview_location": "interview location or null",
-    "interview_type": "online or onsite or phone or null",
-    "interviewer_name": "interviewer name or null",
-    "interviewer_email": "interviewer email or null",
-    "additional_info": "other important information or null",
-    "confidence_score": number between 0-100
-}}
+            requests.append(
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self._analysis_request(subject, body),
+                }
+            )
+        return requests, resolved
+
+    def parse_analysis_batch_result(self, line: Dict) -> Dict:
+        """解析 Batch API 輸出的一行，該筆請求失敗時拋出 ValueError；快取由 cache_analyses 寫入"""
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            raise ValueError(line.get("error") or f"status {response.get('status_code')}")
+
+        return self._parse_analysis(response["body"]["choices"][0]["message"]["content"])
+
+    def cache_analyses(self, analyses: List[Tuple[str, str, Dict]]):
+        """在同一個 transaction 把多筆 (subject, body, 分析結果) 寫入快取"""
+        analysis_cache.put_many(
+            [
+                (
+                    analysis_cache.make_key(self.model, ANALYSIS_PROMPT_VERSION, subject, body),
+                    "analysis",
+                    self.model,
+                    result,
+                )
+                for subject, body, result in analyses
+            ]
+        )
 
-Important: Use null (not "null" string) for missing information.
-"""
+    def _normalize_analysis(self, result: Dict) -> Dict:
+        """整理模型回傳的 JSON，確保欄位型別正確"""
+        is_interview = bool(result.get("is_interview"))
+        language = str(result.get("language") or "").lower()
+        interview_info = result.get("interview_info") if is_interview else None
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a professional information extraction expert. Always respond with valid JSON only.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.1,
-            )
+        if interview_info is not None and not isinstance(interview_info, dict):
+            interview_info = None
 
-            content = response.choices[0].message.content.strip()
-            logger.info(f"OpenAI extract response: {content}")
-
-            try:
-                result = json.loads(content)
-                return result
-            except json.JSONDecodeError:
-                logger.warning(f"JSON parse failed for extraction: {content}")
-                # 返回基本結構
-                return {
-                    "company_name": None,
-                    "position": None,
-                    "interview_date": None,
-                    "interview_time": None,
-                    "interview_location": None,
-                    "interview_type": None,
-                    "interviewer_name": None,
-                    "interviewer_email": None,
-                    "additional_info": None,
-                    "confidence_score": 50,
-                }
+        return {
+            "is_interview": is_interview,
+            "confidence": float(result.get("confidence") or 0),
+            "language": language if language in ("chinese", "english") else None,
+            "interview_info": interview_info,
+        }
 
-        except Exception as e:
-            logger.error(f"Failed to extract interview info: {e}")
-            return None
+    def _keyword_fallback(self, subject: str, body: str) -> Tuple[bool, float]:
+        """API 失敗時以關鍵字判斷"""
+        text_to_check = (subject + " " + body).lower()
+        interview_keywords = ["interview", "面試", "面談", "會面"]
+        if any(kw in text_to_check for kw in interview_keywords):
+            return True, 60.0
+        return False, 0
+
+    def detect_language(self, subject: str, body: str) -> str:
+        """檢測郵件主要語言（本地判斷，不呼叫 API）"""
+        return detect_language(subject, body)
 
     def generate_reply(
         self, interview_info: Dict, tone: str = "professional", language: str = None
     ) -> Optional[str]:
-        """生成回信草稿"""
-        try:
-            # 如果沒指定語言，根據公司名稱判斷
-            if not language:
-                company_name = interview_info.get("company_name", "")
-                language = self.detect_language(company_name, str(interview_info))
+        """以範本生成回信草稿（不呼叫 LLM）"""
+        language = language or self._reply_language(interview_info)
+        return render_reply(interview_info, tone, language)
 
-            if language == "chinese":
-                return self._generate_chinese_reply(interview_info, tone)
-            else:
-                return self._generate_english_reply(interview_info, tone)
+    def polish_reply(
+        self, draft: str, interview_info: Dict, tone: str = "professional", language: str = None
+    ) -> Optional[str]:
+        """以 LLM 潤飾範本草稿，失敗時回傳 None"""
+        language = language or self._reply_language(interview_info)
+        try:
+            response = llm_gateway.chat(**self._polish_request(draft, interview_info, tone, language))
+            return response.choices[0].message.content.strip()
 
         except Exception as e:
-            logger.error(f"Failed to generate reply: {e}")
+            logger.error(f"Failed to polish reply: {e}")
             return None
 
-    def _generate_chinese_reply(self, interview_info: Dict, tone: str) -> Optional[str]:
-        """生成中文回信"""
+    async def stream_reply(
+        self, interview_info: Dict, tone: str = "professional", language: str = None
+    ) -> AsyncIterator[str]:
+        """以串流方式潤飾範本草稿，逐段 yield 模型產生的文字
+
+        與 generate_reply + polish_reply 使用同一份範本與 prompt，兩種回信方式的結果一致。
+        呼叫端停止迭代（例如瀏覽器斷線）時會關閉上游連線，不會繼續消耗 token
+        """
+        language = language or self._reply_language(interview_info)
+        draft = self.generate_reply(interview_info, tone, language)
+        stream = llm_gateway.astream(**self._polish_request(draft, interview_info, tone, language))
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.aclose()
+
+    def _polish_request(self, draft: str, interview_info: Dict, tone: str, language: str) -> Dict:
+        """組出潤飾範本草稿的 chat completion 參數，一般與串流呼叫共用"""
+        request = self._reply_request(interview_info, tone, language)
+        instruction = (
+            f"\n以下是已經寫好的草稿，請保留其中所有面試資訊，改寫成更自然的版本：\n\n{draft}"
+            if language == "chinese"
+            else f"\nHere is an existing draft. Keep every interview detail in it and rewrite it to read more naturally:\n\n{draft}"
+        )
+        request["messages"][-1]["content"] += instruction
+        return request
+
+    def _reply_language(self, interview_info: Dict) -> str:
+        """沒指定語言時根據面試資訊判斷"""
+        company_name = interview_info.get("company_name") or ""
+        return self.detect_language(company_name, str(interview_info))
+
+    def _reply_request(self, interview_info: Dict, tone: str, language: str) -> Dict:
+        """組出回信用的 chat completion 參數，由 _polish_request 加上範本草稿"""
+        if (language or self._reply_language(interview_info)) == "chinese":
+            messages = self._chinese_reply_messages(interview_info, tone)
+        else:
+            messages = self._english_reply_messages(interview_info, tone)
+        return {"model": self.model, "messages": messages, "temperature": 0.3}
+
+    def _chinese_reply_messages(self, interview_info: Dict, tone: str) -> List[Dict]:
+        """中文回信的 prompt"""
         tone_instructions = {
             "professional": "專業且有禮貌",
             "friendly": "友善且熱忱",
@@ -241,19 +373,13 @@ Important: Use null (not "null" string) for missing information.
 請直接回傳郵件內容，不需要額外說明。
 """
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": "你是專業的商務郵件撰寫專家，擅長撰寫各種語調的回信。"},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.3,
-        )
+        return [
+            {"role": "system", "content": "你是專業的商務郵件撰寫專家，擅長撰寫各種語調的回信。"},
+            {"role": "user", "content": prompt},
+        ]
 
-        return response.choices[0].message.content.strip()
-
-    def _generate_english_reply(self, interview_info: Dict, tone: str) -> Optional[str]:
-        """生成英文回信"""
+    def _english_reply_messages(self, interview_info: Dict, tone: str) -> List[Dict]:
+        """英文回信的 prompt"""
         tone_instructions = {
             "professional": "professional and polite",
             "friendly": "friendly and enthusiastic",
@@ -286,73 +412,30 @@ Reply requirements:
 Return only the email content without additional explanations.
 """
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a professional business email writing expert skilled in crafting replies with various tones.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.3,
-        )
-
-        return response.choices[0].message.content.strip()
+        return [
+            {
+                "role": "system",
+                "content": "You are a professional business email writing expert skilled in crafting replies with various tones.",
+            },
+            {"role": "user", "content": prompt},
+        ]
 
     def generate_reply_subject(
         self, original_subject: str, language: str = None
     ) -> str:
         """生成回信主旨（支援中英文）"""
-        try:
-            if not language:
-                language = self.detect_language(original_subject, "")
-
-            if language == "chinese":
-                prompt = f"""
-請為以下面試邀請郵件生成適當的回信主旨。
+        language = language or self.detect_language(original_subject, "")
+        return render_subject(original_subject, language)
 
-原主旨: {original_subject}
 
-回信主旨要求：
-1. 表明這是回信 (Re:)
-2. 保持簡潔專業
-3. 繁體中文
-
-請直接回傳主旨，不需要額外說明。
-"""
-                system_content = "你是專業的郵件主旨專家。"
-            else:
-                prompt = f"""
-Generate an appropriate reply subject for the following interview invitation email.
-
-Original Subject: {original_subject}
-
-Reply subject requirements:
-1. Indicate this is a reply (Re:)
-2. Keep it concise and professional
-3. Use English
-
-Return only the subject line without additional explanations.
-"""
-                system_content = "You are a professional email subject line expert."
-
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_content},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.1,
-            )
-
-            return response.choices[0].message.content.strip()
-
-        except Exception as e:
-            logger.error(f"Failed to generate subject: {e}")
-            return f"Re: {original_subject}"
+_openai_service = None
+_openai_service_lock = threading.Lock()
 
 
 def get_openai_service() -> OpenAIService:
-    """取得 OpenAI 服務實例"""
-    return OpenAIService()
+    """取得共用的 OpenAI 服務實例，所有呼叫經由 llm_gateway 共用連線"""
+    global _openai_service
+    with _openai_service_lock:
+        if _openai_service is None:
+            _openai_service = OpenAIService()
+        return _openai_service
@@ -0,0 +1,168 @@
+"""面試邀請回信範本
+
+回信內容固定是：感謝 → 確認出席 → 重述時間地點 → 表達期待，因此直接以範本
+依語言與語調組出草稿與主旨，不需要呼叫 LLM。需要更自然的文字時再交給
+OpenAIService.polish_reply 潤飾。
+"""
+from datetime import datetime
+from typing import Dict, List
+import re
+
+INTERVIEW_TYPE_NAMES = {
+    "chinese": {"online": "線上", "onsite": "現場", "phone": "電話"},
+    "english": {"online": "online", "onsite": "on-site", "phone": "phone"},
+}
+
+# 每種語言、語調的句子；句中的欄位都要有值，缺少時依序改用 *_partial（只有公司）、
+# *_position（只有職位）、*_fallback 句型，已知的欄位不會被捨棄
+TEMPLATES = {
+    "chinese": {
+        "professional": {
+            "greeting": "{interviewer}您好：",
+            "greeting_fallback": "您好：",
+            "thanks": "感謝貴公司提供{company}「{position}」職位的面試機會。",
+            "thanks_partial": "感謝貴公司提供{company}的面試機會。",
+            "thanks_position": "感謝貴公司提供「{position}」職位的面試機會。",
+            "thanks_fallback": "感謝您提供這次的面試機會。",
+            "confirm": "我確認會準時參加面試，以下為面試資訊：",
+            "closing": "若有任何需要事先準備的資料，請再告訴我。期待與您見面，謝謝！",
+            "sign_off": "敬祝 順利",
+        },
+        "friendly": {
+            "greeting": "{interviewer}您好！",
+            "greeting_fallback": "您好！",
+            "thanks": "很開心收到{company}「{position}」職位的面試邀請，謝謝您！",
+            "thanks_partial": "很開心收到{company}的面試邀請，謝謝您！",
+            "thanks_position": "很開心收到「{position}」職位的面試邀請，謝謝您！",
+            "thanks_fallback": "很開心收到這次的面試邀請，謝謝您！",
+            "confirm": "我會準時參加，再跟您確認一下面試資訊：",
+            "closing": "非常期待和大家見面聊聊，有任何需要準備的地方也歡迎告訴我！",
+            "sign_off": "祝 一切順心",
+        },
+        "formal": {
+            "greeting": "{interviewer}您好：",
+            "greeting_fallback": "敬啟者：",
+            "thanks": "承蒙貴公司邀請參加{company}「{position}」職位之面試，謹致謝忱。",
+            "thanks_partial": "承蒙貴公司邀請參加{company}之面試，謹致謝忱。",
+            "thanks_position": "承蒙貴公司邀請參加「{position}」職位之面試，謹致謝忱。",
+            "thanks_fallback": "承蒙貴公司邀請參加面試，謹致謝忱。",
+            "confirm": "本人確認將準時出席，面試資訊如下：",
+            "closing": "如需事先提供任何資料，敬請告知。期待當面向您請益。",
+            "sign_off": "敬祝 商祺",
+        },
+    },
+    "english": {
+        "professional": {
+            "greeting": "Dear {interviewer},",
+            "greeting_fallback": "Dear Hiring Team,",
+            "thanks": "Thank you for the opportunity to interview for the {position} position at {company}.",
+            "thanks_partial": "Thank you for the opportunity to interview with {company}.",
+            "thanks_position": "Thank you for the opportunity to interview for the {position} position.",
+            "thanks_fallback": "Thank you for the opportunity to interview with you.",
+            "confirm": "I am writing to confirm my attendance. Please find the interview details below:",
+            "closing": "Please let me know if there is anything I should prepare in advance. I look forward to speaking with you.",
+            "sign_off": "Best regards,",
+        },
+        "friendly": {
+            "greeting": "Hi {interviewer},",
+            "greeting_fallback": "Hi there,",
+            "thanks": "Thanks so much for inviting me to interview for the {position} role at {company}!",
+            "thanks_partial": "Thanks so much for inviting me to interview with {company}!",
+            "thanks_position": "Thanks so much for inviting me to interview for the {position} role!",
+            "thanks_fallback": "Thanks so much for inviting me to interview!",
+            "confirm": "I'm happy to confirm that I'll be there. Here are the details I have:",
+            "closing": "I'm really looking forward to meeting the team. Let me know if there's anything I should bring or prepare!",
+            "sign_off": "Cheers,",
+        },
+        "formal": {
+            "greeting": "Dear {interviewer},",
+            "greeting_fallback": "Dear Sir or Madam,",
+            "thanks": "I would like to express my sincere gratitude for the invitation to interview for the {position} position at {company}.",
+            "thanks_partial": "I would like to express my sincere gratitude for the invitation to interview with {company}.",
+            "thanks_position": "I would like to express my sincere gratitude for the invitation to interview for the {position} position.",
+            "thanks_fallback": "I would like to express my sincere gratitude for the invitation to interview.",
+            "confirm": "I hereby confirm my attendance at the interview as detailed below:",
+            "closing": "Should any documents be required in advance, please do not hesitate to inform me. I look forward to meeting you.",
+            "sign_off": "Yours sincerely,",
+        },
+    },
+}
+
+DETAIL_LABELS = {
+    "chinese": {"date": "日期", "time": "時間", "location": "地點", "type": "形式"},
+    "english": {"date": "Date", "time": "Time", "location": "Location", "type": "Format"},
+}
+
+_FIELD_RE = re.compile(r"{(\w+)}")
+_REPLY_PREFIX_RE = re.compile(r"^\s*(re|回覆|答覆)\s*[:：]\s*", re.IGNORECASE)
+
+
+def _value(interview_info: Dict, key: str) -> str:
+    value = interview_info.get(key)
+    if value is None or str(value).strip().lower() in ("", "null", "none", "unknown", "未知"):
+        return ""
+    return str(value).strip()
+
+
+def _fill(templates: Dict, key: str, fields: Dict) -> str:
+    """依序嘗試主要、partial、position、fallback 句型，使用第一個欄位都有值的句型"""
+    for suffix in ("", "_partial", "_position", "_fallback"):
+        template = templates.get(key + suffix)
+        if template is None:
+            continue
+        if all(fields.get(name) for name in _FIELD_RE.findall(template)):
+            return template.format(**fields)
+    return ""
+
+
+def _format_date(value: str, language: str) -> str:
+    try:
+        date = datetime.strptime(value[:10], "%Y-%m-%d")
+    except ValueError:
+        return value
+    if language == "chinese":
+        weekday = "一二三四五六日"[date.weekday()]
+        return f"{date.year} 年 {date.month} 月 {date.day} 日（星期{weekday}）"
+    return date.strftime("%A, %B %d, %Y").replace(" 0", " ")
+
+
+def _detail_lines(interview_info: Dict, language: str) -> List[str]:
+    labels = DETAIL_LABELS[language]
+    separator = "：" if language == "chinese" else ": "
+    interview_type = _value(interview_info, "interview_type").lower()
+    details = [
+        ("date", _format_date(_value(interview_info, "interview_date"), language)),
+        ("time", _value(interview_info, "interview_time")),
+        ("location", _value(interview_info, "interview_location")),
+        ("type", INTERVIEW_TYPE_NAMES[language].get(interview_type, interview_type)),
+    ]
+    return [f"- {labels[key]}{separator}{value}" for key, value in details if value]
+
+
+def render_reply(interview_info: Dict, tone: str = "professional", language: str = "english") -> str:
+    """依面試資訊組出回信草稿"""
+    language = language if language in TEMPLATES else "english"
+    templates = TEMPLATES[language].get(tone) or TEMPLATES[language]["professional"]
+
+    fields = {
+        "interviewer": _value(interview_info, "interviewer_name"),
+        "company": _value(interview_info, "company_name"),
+        "position": _value(interview_info, "position"),
+    }
+
+    lines = [_fill(templates, "greeting", fields), "", _fill(templates, "thanks", fields)]
+    details = _detail_lines(interview_info, language)
+    if details:
+        lines += [templates["confirm"], *details]
+    lines += ["", templates["closing"], "", templates["sign_off"]]
+    return "\n".join(lines)
+
+
+def render_subject(original_subject: str, language: str = "english") -> str:
+    """回信主旨：原主旨加上 Re:，已經是回覆時不重複加"""
+    subject = (original_subject or "").strip()
+    if not subject:
+        return "Re: 面試邀請" if language == "chinese" else "Re: Interview Invitation"
+    if _REPLY_PREFIX_RE.match(subject):
+        return _REPLY_PREFIX_RE.sub("Re: ", subject, count=1)
+    return f"Re: {subject}"
@@ -0,0 +1,273 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from models import User
+from database import get_db_session
+from gmail_service import get_gmail_service
+from config import config
+import itertools
+import random
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 排程器多久檢查一次到期的用戶
+SCHEDULER_TICK_SECONDS = 30
+# 保留最近幾筆工作紀錄供 API 查詢
+MAX_JOB_HISTORY = 200
+
+
+class SyncJob:
+    """單次同步工作的狀態，同時作為 GmailService 回報進度的對象"""
+
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        user_id: int,
+        trigger: str,
+        kind: str = "sync",
+        max_results: int = 50,
+        max_pages: int = None,
+    ):
+        self.id = next(self._ids)
+        self.user_id = user_id
+        self.trigger = trigger  # scheduled, manual
+        self.kind = kind  # sync, backfill
+        self.max_results = max_results
+        self.max_pages = max_pages
+        self.sync_type = None  # 首次同步、增量同步、重新同步、回填
+        self.status = "queued"  # queued, running, succeeded, failed
+        self.fetched_count = 0
+        self.saved_count = 0
+        self.errors = []
+        self.failed = False
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+
+    def record_batch(self, fetched: int, saved: int):
+        """GmailService 每寫完一批呼叫一次"""
+        self.fetched_count += fetched
+        self.saved_count += saved
+
+    def record_error(self, message: str, fatal: bool = False):
+        self.errors.append(message)
+        if fatal:
+            self.failed = True
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "trigger": self.trigger,
+            "kind": self.kind,
+            "sync_type": self.sync_type,
+            "status": self.status,
+            "fetched_count": self.fetched_count,
+            "saved_count": self.saved_count,
+            "errors": self.errors,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class SyncScheduler:
+    """定期為所有已授權用戶同步郵件
+
+    - 同一用戶同時只會有一個工作；同類工作會合併，不同類的工作（例如同步中要求回填）
+      排在目前工作之後執行。排程時以最久沒同步的用戶優先
+    - 每個用戶的下次同步時間加上隨機抖動，避免全部用戶同時打 Gmail
+    - 工作在固定大小的 thread pool 執行，Gmail 並行呼叫另由 gmail_service 限制
+    """
+
+    def __init__(
+        self,
+        interval_seconds: int = None,
+        jitter: float = None,
+        max_workers: int = None,
+    ):
+        self.interval_seconds = interval_seconds or config.SYNC_INTERVAL_SECONDS
+        self.jitter = config.SYNC_INTERVAL_JITTER if jitter is None else jitter
+        self.max_workers = max_workers or config.SYNC_MAX_WORKERS
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="gmail-sync"
+        )
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self._jobs = OrderedDict()  # job_id -> SyncJob
+        self._running = {}  # user_id -> SyncJob
+        self._queued = {}  # user_id -> 等目前工作結束後才執行的 SyncJob
+        self._next_run_at = {}  # user_id -> monotonic 時間
+        self._last_finished_at = {}  # user_id -> monotonic 時間
+
+    def start(self):
+        """啟動背景排程執行緒"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="sync-scheduler", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"Sync scheduler started: every {self.interval_seconds}s, {self.max_workers} workers"
+        )
+
+    def stop(self):
+        """停止排程，不等待進行中的工作"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        logger.info("Sync scheduler stopped")
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def submit(
+        self,
+        user_id: int,
+        trigger: str = "manual",
+        kind: str = "sync",
+        max_results: int = 50,
+        max_pages: int = None,
+    ) -> Tuple[SyncJob, bool]:
+        """送出同步工作，回傳 (job, 是否新建立)
+
+        該用戶已有同類工作在排隊或執行時不會重複，直接回傳那一個；
+        正在執行的是另一類工作時，新工作排在它之後執行
+        """
+        with self._lock:
+            for existing in (self._running.get(user_id), self._queued.get(user_id)):
+                if existing and existing.kind == kind:
+                    return existing, False
+
+            job = SyncJob(user_id, trigger, kind, max_results, max_pages)
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOB_HISTORY:
+                self._jobs.popitem(last=False)
+
+            if user_id in self._running:
+                self._queued[user_id] = job
+                return job, True
+            self._running[user_id] = job
+
+        self._executor.submit(self._run_job, job)
+        return job, True
+
+    def get_job(self, job_id: int) -> Optional[SyncJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self) -> Dict:
+        """排程器與各用戶最近一次工作的狀態"""
+        now = time.monotonic()
+        with self._lock:
+            latest_by_user = {}
+            for job in self._jobs.values():
+                latest_by_user[job.user_id] = job
+
+            users = []
+            for user_id, job in sorted(latest_by_user.items()):
+                next_run_at = self._next_run_at.get(user_id)
+                users.append(
+                    {
+                        "user_id": user_id,
+                        "last_job": job.to_dict(),
+                        "next_run_in_seconds": round(max(0, next_run_at - now))
+                        if next_run_at
+                        else None,
+                    }
+                )
+
+            return {
+                "enabled": self.is_running,
+                "interval_seconds": self.interval_seconds,
+                "max_workers": self.max_workers,
+                "running_jobs": len(self._running),
+                "queued_jobs": len(self._queued),
+                "users": users,
+            }
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self._schedule_due_users()
+            except Exception as e:
+                logger.error(f"Sync scheduler tick failed: {e}")
+            self._stop_event.wait(SCHEDULER_TICK_SECONDS)
+
+    def _schedule_due_users(self):
+        """把到期的用戶送進 pool，不超過 worker 數量"""
+        db = get_db_session()
+        try:
+            user_ids = [
+                user_id
+                for (user_id,) in db.query(User.id).filter(User.access_token.isnot(None))
+            ]
+        finally:
+            db.close()
+
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                # 新用戶的第一次同步分散在一個間隔內
+                self._next_run_at.setdefault(
+                    user_id, now + random.uniform(0, self.interval_seconds)
+                )
+
+            due = [
+                user_id
+                for user_id in user_ids
+                if self._next_run_at[user_id] <= now and user_id not in self._running
+            ]
+            # 公平性：最久沒完成同步的用戶排前面
+            due.sort(key=lambda user_id: self._last_finished_at.get(user_id, 0))
+            free_slots = self.max_workers - len(self._running)
+
+        # 沒排到的用戶留到下一輪，不在 pool 裡無限排隊
+        for user_id in due[: max(0, free_slots)]:
+            self.submit(user_id, trigger="scheduled")
+
+    def _run_job(self, job: SyncJob):
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        try:
+            gmail_service = get_gmail_service(job.user_id)
+            if job.kind == "backfill":
+                job.sync_type = "回填"
+                gmail_service.backfill_emails(max_pages=job.max_pages, progress=job)
+            else:
+                gmail_service.sync_recent_emails(job.max_results, progress=job)
+            job.status = "failed" if job.failed else "succeeded"
+        except Exception as e:
+            logger.error(f"Sync job {job.id} for user {job.user_id} failed: {e}")
+            job.record_error(str(e), fatal=True)
+            job.status = "failed"
+        finally:
+            job.finished_at = datetime.utcnow()
+            now = time.monotonic()
+            with self._lock:
+                self._running.pop(job.user_id, None)
+                self._last_finished_at[job.user_id] = now
+                self._next_run_at[job.user_id] = now + self._jittered_interval()
+                # 有排在後面的工作時接著執行，仍維持同一用戶只有一個工作在跑
+                next_job = self._queued.pop(job.user_id, None)
+                if next_job:
+                    self._running[job.user_id] = next_job
+            if next_job:
+                self._executor.submit(self._run_job, next_job)
+
+    def _jittered_interval(self) -> float:
+        return self.interval_seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+sync_scheduler = SyncScheduler()
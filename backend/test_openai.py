@@ -13,16 +13,17 @@ try:
     body = "您好，我們想邀請您來參加軟體工程師的面試，時間是明天下午2點。"
 
     print("測試郵件分析...")
-    is_interview, confidence = service.is_interview_email(subject, body)
-    print(f"分析結果: 是面試邀請={is_interview}, 信心度={confidence}")
+    analysis = service.analyze_email(subject, body, use_cache=False)
+    print(
+        f"分析結果: 是面試邀請={analysis['is_interview']}, 信心度={analysis['confidence']}, "
+        f"語言={analysis['language']}"
+    )
 
-    if is_interview:
-        print("測試面試資訊提取...")
-        interview_info = service.extract_interview_info(subject, body)
-        print(f"提取結果: {interview_info}")
+    if analysis["interview_info"]:
+        print(f"提取結果: {analysis['interview_info']}")
 
         print("測試回信生成...")
-        reply = service.generate_reply(interview_info, "professional")
+        reply = service.generate_reply(analysis["interview_info"], "professional", analysis["language"])
         print(f"回信內容: {reply}")
 
     print("OpenAI 測試完成！")
@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from models import User
+from database import get_db_session
+from gmail_service import save_user_token
+from config import config
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 換新失敗（例如用戶撤銷授權）後多久再試
+REFRESH_FAILURE_BACKOFF_SECONDS = 900
+# 同時向 Google 換新 token 的數量
+REFRESH_WORKERS = 4
+
+
+class TokenManager:
+    """在 access token 到期前於背景換新，寫回 User 並同步給快取中的 Gmail service"""
+
+    def __init__(self, margin_seconds: int = None, check_seconds: int = None):
+        self.margin_seconds = margin_seconds or config.TOKEN_REFRESH_MARGIN_SECONDS
+        self.check_seconds = check_seconds or config.TOKEN_REFRESH_CHECK_SECONDS
+
+        self._request = Request()  # 共用 requests session，重複使用連線
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._failed_until = {}  # user_id -> monotonic 時間
+
+    def start(self):
+        """啟動背景換新執行緒"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="token-manager", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Token manager started: refresh {self.margin_seconds}s before expiry")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh_expiring_tokens()
+            except Exception as e:
+                logger.error(f"Token refresh tick failed: {e}")
+            self._stop_event.wait(self.check_seconds)
+
+    def refresh_expiring_tokens(self) -> int:
+        """換新所有即將到期的 token，回傳成功數量"""
+        deadline = datetime.utcnow() + timedelta(seconds=self.margin_seconds)
+        now = time.monotonic()
+
+        db = get_db_session()
+        try:
+            users = (
+                db.query(User.id, User.refresh_token)
+                .filter(
+                    User.refresh_token.isnot(None),
+                    User.token_expires_at.isnot(None),
+                    User.token_expires_at < deadline,
+                )
+                .all()
+            )
+        finally:
+            db.close()
+
+        users = [
+            (user_id, refresh_token)
+            for user_id, refresh_token in users
+            if self._failed_until.get(user_id, 0) <= now
+        ]
+        if not users:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=REFRESH_WORKERS) as executor:
+            results = list(executor.map(lambda user: self.refresh_user(*user), users))
+
+        refreshed = sum(results)
+        logger.info(f"Refreshed {refreshed}/{len(users)} expiring tokens")
+        return refreshed
+
+    def refresh_user(self, user_id: int, refresh_token: str) -> bool:
+        """換新單一用戶的 access token"""
+        credentials = Credentials(
+            token=None,
+            refresh_token=refresh_token,
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id=config.GOOGLE_CLIENT_ID,
+            client_secret=config.GOOGLE_CLIENT_SECRET,
+        )
+
+        try:
+            credentials.refresh(self._request)
+        except RefreshError as e:
+            logger.warning(f"Failed to refresh token for user {user_id}: {e}")
+            self._failed_until[user_id] = time.monotonic() + REFRESH_FAILURE_BACKOFF_SECONDS
+            return False
+        except Exception as e:
+            logger.error(f"Failed to refresh token for user {user_id}: {e}")
+            return False
+
+        self._failed_until.pop(user_id, None)
+        # credentials.expiry 是 naive UTC，與資料庫一致
+        save_user_token(user_id, credentials.token, credentials.expiry)
+        return True
+
+
+token_manager = TokenManager()